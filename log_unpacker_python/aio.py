@@ -0,0 +1,159 @@
+"""asyncio pipeline decoding captures from files, pipes or sockets.
+
+A producer task reads raw record batches (the blocks of a compact capture,
+compact.py, decoded back to .bin records) and submits their decoding to an
+executor; the decoded batches go through a bounded queue to the consumer, so
+a slow consumer stops the reads (backpressure) instead of growing memory.
+Closing or cancelling the consumer cancels the producer and the decodes not
+started yet; a blocking file read already running in a thread cannot be
+interrupted and is waited for before the file is closed. Many captures can be
+processed concurrently from one event loop.
+"""
+
+import asyncio
+import collections
+import os
+
+import numpy as np
+
+import columnar
+import compact
+import pd_fields
+
+DEFAULT_MAX_PENDING = 4
+
+# A decoded batch: the records and their pd_fields.decode_records fields.
+DecodedBatch = collections.namedtuple("DecodedBatch", ["records", "fields"])
+
+
+def decode_batch(data):
+  """Default decoder, run in the executor: raw bytes to a DecodedBatch."""
+  records = np.frombuffer(
+      data,
+      dtype=columnar.snooper_packet,
+      count=len(data) // columnar.SNOOPER_PACKET_SIZE,
+  )
+  return DecodedBatch(records, pd_fields.decode_records(records))
+
+
+async def _read_stream(reader, size):
+  """Reads up to `size` bytes from an asyncio.StreamReader."""
+  try:
+    return await reader.readexactly(size)
+  except asyncio.IncompleteReadError as e:
+    return e.partial
+
+
+def _reader(source, size, loop):
+  """Returns (read, close): an async read of the next raw batch of `source`
+  and a coroutine function closing what was opened here once no read runs."""
+  if isinstance(source, asyncio.StreamReader):
+    async def close():
+      pass
+
+    return (lambda: _read_stream(source, size)), close
+
+  opened = isinstance(source, (str, os.PathLike))
+  if opened and compact.is_compact(source):
+    f = compact.CompactReader(source)
+    position = [0]
+
+    def read_full():
+      # Decoded in the read thread: the decoder gets .bin bytes either way.
+      first = position[0]
+      position[0] += size // columnar.SNOOPER_PACKET_SIZE
+      return f.read(first, position[0]).tobytes()
+  else:
+    f = open(source, "rb") if opened else source
+
+    def read_full():
+      chunks = []
+      remaining = size
+      while remaining:
+        chunk = f.read(remaining)
+        if not chunk:
+          break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+      return b"".join(chunks)
+
+  # Blocking reads go to the loop default executor, not the decode one. A
+  # cancelled read keeps running in its thread: it is shielded from the
+  # cancellation so that close() can wait for it before closing the file.
+  pending = []
+
+  def read():
+    pending[:] = [loop.run_in_executor(None, read_full)]
+    return asyncio.shield(pending[0])
+
+  async def close():
+    if pending:
+      await asyncio.wait(pending)
+    if opened:
+      f.close()
+
+  return read, close
+
+
+async def iter_batches(
+    source,
+    batch_records=columnar.DEFAULT_BATCH_RECORDS,
+    decode=decode_batch,
+    executor=None,
+    max_pending=DEFAULT_MAX_PENDING,
+):
+  """Asynchronously yields decoded batches of a capture, in order.
+
+  Args:
+    source: .bin or compact capture path, binary file object of .bin
+      records (blocking reads run in the default executor) or
+      asyncio.StreamReader (pipe, socket).
+    batch_records: records per batch.
+    decode: function mapping the raw bytes of whole records to a result, run
+      in `executor`; must be picklable for a ProcessPoolExecutor.
+    executor: concurrent.futures executor, the loop default when None.
+    max_pending: batches read or decoded ahead of the consumer.
+
+  Yields:
+    The `decode` result of every batch. A truncated final record is dropped.
+  """
+  loop = asyncio.get_running_loop()
+  size = batch_records * columnar.SNOOPER_PACKET_SIZE
+  read, close = _reader(source, size, loop)
+  queue = asyncio.Queue(maxsize=max_pending)
+  done = object()
+
+  async def produce():
+    try:
+      while True:
+        data = await read()
+        data = data[:len(data) - len(data) % columnar.SNOOPER_PACKET_SIZE]
+        if data:
+          await queue.put(loop.run_in_executor(executor, decode, data))
+        if len(data) < size:
+          break
+    except Exception as e:  # pylint: disable=broad-except
+      # Handed to the consumer in order, after the batches read before.
+      failure = loop.create_future()
+      failure.set_exception(e)
+      await queue.put(failure)
+    await queue.put(done)
+
+  producer = asyncio.create_task(produce())
+  try:
+    while True:
+      item = await queue.get()
+      if item is done:
+        break
+      yield await item
+  finally:
+    producer.cancel()
+    while not queue.empty():
+      item = queue.get_nowait()
+      if item is not done:
+        item.cancel()
+    try:
+      await producer
+    except asyncio.CancelledError:
+      pass
+    await close()
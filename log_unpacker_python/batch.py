@@ -0,0 +1,188 @@
+"""Decoding of whole session directories across a process pool.
+
+Every worker maps its capture and decodes its PD records into PD index rows
+(pd_index.py, saving the sidecar), so only those small rows travel back to
+the parent; the records themselves stay in the files, to be mapped where
+needed (columnar.lazy_records, capture.Capture).
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import os
+import pathlib
+import sys
+
+import construct as ct
+import numpy as np
+
+import columnar
+import memo
+import pd_index
+import session
+
+# Result of decoding one capture: its record count and the result of the
+# decode function, pd_index.pd_index_entry rows by default; both None when
+# `error` is set.
+FileResult = collections.namedtuple(
+    "FileResult", ["path", "start", "count", "decoded", "error"]
+)
+
+# The PD rows of a session: pd_index.pd_index_entry and the position of the
+# capture in the decode_files results.
+session_pd_entry = np.dtype(
+    pd_index.pd_index_entry.descr + [("file", "<u4")]
+)
+
+# A capture decoded by decode_file_parallel: its records, read on access
+# (columnar.lazy_records), and the (record index, twinkie.twinkie container)
+# pair of every PD record. The container is replaced by the construct error
+# for records that fail to parse.
+DecodedCapture = collections.namedtuple("DecodedCapture", ["records", "pd"])
+
+# Shards per worker, so that PD-dense parts of a capture do not serialize
+# the pool on a single shard.
+SHARDS_PER_WORKER = 4
+
+
+def _decode_file(path):
+  """Worker: returns the PD index rows of one capture (pd_index.get_index)."""
+  return pd_index.get_index(path)
+
+
+def decode_files(paths, workers=None, decode=_decode_file):
+  """Decodes capture files in parallel.
+
+  Errors are reported per file and do not abort the batch.
+
+  Args:
+    paths: capture paths, decoded and returned in chronological order.
+    workers: number of worker processes, os.cpu_count() by default.
+    decode: picklable function mapping a path to its decoded result.
+
+  Returns:
+    A list of FileResult sorted by capture start time.
+  """
+  paths = session.chronological(paths)
+  results = []
+  with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+    futures = [pool.submit(decode, path) for path in paths]
+    for path, future in zip(paths, futures):
+      try:
+        decoded, error = future.result(), None
+        count = columnar.record_count(path)
+      except Exception as e:  # pylint: disable=broad-except
+        count, decoded, error = None, None, e
+      results.append(
+          FileResult(path, session.capture_start(path), count, decoded, error)
+      )
+  return results
+
+
+def decode_directory(dir_str, workers=None, decode=_decode_file):
+  """Decodes every capture of a session directory; see decode_files."""
+  return decode_files(session.list_captures(dir_str), workers, decode)
+
+
+def merge(results):
+  """Concatenates the PD rows of the successfully decoded files in order.
+
+  Args:
+    results: decode_files results with the default decode function.
+
+  Returns:
+    A session_pd_entry array; `file` indexes `results`.
+  """
+  parts = []
+  for i, r in enumerate(results):
+    if r.error is None:
+      rows = np.empty(len(r.decoded), dtype=session_pd_entry)
+      for name in pd_index.pd_index_entry.names:
+        rows[name] = r.decoded[name]
+      rows["file"] = i
+      parts.append(rows)
+  if not parts:
+    return np.empty(0, dtype=session_pd_entry)
+  return np.concatenate(parts)
+
+
+def shard_ranges(count, shards):
+  """Splits `count` records into at most `shards` contiguous index ranges."""
+  shards = max(1, min(shards, count))
+  bounds = np.linspace(0, count, shards + 1).astype(int)
+  return [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+
+def _decode_shard(path, start, stop):
+  """Worker: maps records [start, stop) and parses their PD messages.
+
+  Repeated payloads are parsed once per worker process (memo.pd_cache).
+  """
+  records = columnar.read_records(path, start, stop)
+  pd = []
+  for i in np.flatnonzero(records["data_length"]):
+    try:
+      container = memo.parse_record(records[i].tobytes())
+    except ct.ConstructError as e:
+      container = e
+    pd.append((start + int(i), container))
+  return pd
+
+
+def decode_file_parallel(path, workers=None):
+  """Decodes one capture, sharded on record boundaries across processes.
+
+  Every worker maps its own shard and parses the PD records in it like
+  twinkie.twinkie; the shard results are concatenated in record order.
+
+  Args:
+    path: path of the .bin or compact capture.
+    workers: number of worker processes, os.cpu_count() by default.
+
+  Returns:
+    A DecodedCapture.
+  """
+  workers = workers or os.cpu_count()
+  records = columnar.lazy_records(path)
+  ranges = shard_ranges(len(records), workers * SHARDS_PER_WORKER)
+  pd = []
+  with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+    futures = [pool.submit(_decode_shard, path, a, b) for a, b in ranges]
+    for future in futures:
+      pd.extend(future.result())
+  return DecodedCapture(records, pd)
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(
+      description="Decode a capture, or every capture of a twinkie_console"
+      " session directory, in parallel."
+  )
+  parser.add_argument("path", help="capture file or session directory")
+  parser.add_argument(
+      "-j", "--workers", type=int, default=os.cpu_count(),
+      help="number of worker processes",
+  )
+  args = parser.parse_args(argv)
+
+  if pathlib.Path(args.path).is_file():
+    decoded = decode_file_parallel(args.path, args.workers)
+    for index, container in decoded.pd:
+      if isinstance(container, ct.ConstructError):
+        print(f"{index}: error: {container}", file=sys.stderr)
+      else:
+        print(index, container.pd.header.msg_typ, container.pd.body)
+    return 0
+
+  failed = 0
+  for r in decode_directory(args.path, args.workers):
+    if r.error is not None:
+      failed += 1
+      print(f"{r.path}: error: {r.error}", file=sys.stderr)
+    else:
+      print(f"{r.path}: {r.count} records, {len(r.decoded)} PD messages")
+  return 1 if failed else 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,423 @@
+"""Benchmark suite of the unpacker on synthetic captures (synth.py).
+
+Measures the throughput of the original per-record paths (get_header_list,
+twinkie.twinkie.parse, the data_mesg constructs), of their vectorized
+counterparts and the import time of twinkie. Every run is stored as JSON in
+the results directory and compared with the previous one made with the same
+parameters (COMPARED_PARAMETERS), so a regression shows up as a drop of the
+throughput ratio.
+
+  python bench.py                 # run everything, compare with the last run
+  python bench.py -k parse -n 50000
+"""
+
+import argparse
+import datetime
+import json
+import os
+import pathlib
+import platform
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+import construct as ct
+import numpy as np
+
+import columnar
+import compact
+import crc
+import data_mesg
+import data_objects
+import get_header
+import pd_fields
+import pd_index
+import synth
+import twinkie
+
+DEFAULT_RECORDS = 100000
+# twinkie.twinkie.parse and data_mesg run per record: cap the work.
+DEFAULT_PARSE_RECORDS = 20000
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 0.1
+RESULTS_DIR = pathlib.Path(__file__).with_name("bench_results")
+# Runs are only compared when these match: the throughput depends on them.
+COMPARED_PARAMETERS = (
+    "capture", "records", "parse_records", "repeat", "platform",
+)
+
+_MB = 1 << 20
+
+
+class BaselineMismatch(ValueError):
+  """Raised when comparing runs made with different parameters."""
+
+
+def _best(function, repeat):
+  """Returns the best wall time of `repeat` calls, and the last result."""
+  best = float("inf")
+  result = None
+  for _ in range(repeat):
+    start = time.perf_counter()
+    result = function()
+    best = min(best, time.perf_counter() - start)
+  return best, result
+
+
+class _Context:
+  """Capture and derived inputs shared by the benchmarks."""
+
+  def __init__(self, path, parse_records):
+    self.path = path
+    self.records = columnar.read_records(path)
+    self.raw = pathlib.Path(path).read_bytes()
+    self.parse_records = min(parse_records, len(self.records))
+
+    fields = pd_fields.decode_records(self.records)
+    data = (fields["msg_kind"] == pd_fields.MSG_DATA) & (
+        self.records["data_length"] != 0
+    )
+    objs = data_objects.data_objects(self.records)
+    self.objects = {}
+    for name, msg_typ in (
+        ("pdo", twinkie.DataMesgEnum.SRC_CAP),
+        ("rdo", twinkie.DataMesgEnum.REQUEST),
+        ("vdm", twinkie.DataMesgEnum.VDM),
+    ):
+      rows = data & (fields["msg_typ"] == msg_typ)
+      keep = (
+          np.arange(data_objects.MAX_DATA_OBJ)
+          < fields["num_data_obj"][rows][:, None]
+      )
+      self.objects[name] = np.ascontiguousarray(objs[rows][keep])
+
+  def object_bytes(self, name):
+    values = self.objects[name][:self.parse_records]
+    return [struct.pack("<I", int(v)) for v in values]
+
+
+def _bench_import(context, repeat):
+  """Seconds to import twinkie and build its parser in a fresh interpreter."""
+  code = "import twinkie; twinkie.twinkie.compiled"
+  here = pathlib.Path(__file__).parent
+
+  def run():
+    subprocess.run(
+        [sys.executable, "-c", code], cwd=here, check=True,
+        capture_output=True,
+    )
+
+  def baseline():
+    subprocess.run(
+        [sys.executable, "-c", "pass"], check=True, capture_output=True
+    )
+
+  seconds, _ = _best(run, repeat)
+  empty, _ = _best(baseline, repeat)
+  return {"seconds": seconds - empty, "items": 1, "unit": "import"}
+
+
+def _records_result(seconds, count):
+  return {
+      "seconds": seconds,
+      "items": count,
+      "unit": "records",
+      "mb_per_s": count * columnar.SNOOPER_PACKET_SIZE / _MB / seconds,
+  }
+
+
+def _bench_get_header_list(context, repeat):
+  seconds, _ = _best(lambda: get_header.get_header_list(context.path), repeat)
+  return _records_result(seconds, len(context.records))
+
+
+def _bench_twinkie_parse(context, repeat):
+  size = columnar.SNOOPER_PACKET_SIZE
+  count = context.parse_records
+  raw = context.raw
+  parse = twinkie.twinkie.parse
+
+  def run():
+    for i in range(count):
+      parse(raw[i * size:(i + 1) * size])
+
+  seconds, _ = _best(run, repeat)
+  return _records_result(seconds, count)
+
+
+def _parse_rdo(blob):
+  """Parses an RDO the two-step way: position, then the variant's bits."""
+  return data_mesg.fix_variable_rdo.parse(data_mesg.rdo.parse(blob).data)
+
+
+def _data_mesg_bench(name, parse):
+  def bench(context, repeat):
+    blobs = context.object_bytes(name)
+
+    def run():
+      for blob in blobs:
+        try:
+          parse(blob)
+        except ct.ConstructError:
+          pass
+
+    seconds, _ = _best(run, repeat)
+    return {"seconds": seconds, "items": len(blobs), "unit": "objects"}
+
+  return bench
+
+
+def _bench_columnar_decode(context, repeat):
+  def run():
+    records = columnar.read_records(context.path)
+    return pd_fields.decode_records(records)
+
+  seconds, _ = _best(run, repeat)
+  return _records_result(seconds, len(context.records))
+
+
+def _bench_data_objects(context, repeat):
+  def run():
+    data_objects.decode_pdo(context.objects["pdo"])
+    data_objects.decode_rdo(context.objects["rdo"])
+    data_objects.decode_vdm(context.objects["vdm"])
+
+  seconds, _ = _best(run, repeat)
+  count = sum(len(context.objects[name]) for name in ("pdo", "rdo", "vdm"))
+  return {"seconds": seconds, "items": count, "unit": "objects"}
+
+
+def _bench_crc(context, repeat):
+  seconds, _ = _best(lambda: crc.valid_mask(context.records), repeat)
+  return _records_result(seconds, len(context.records))
+
+
+def _bench_build_index(context, repeat):
+  seconds, _ = _best(lambda: pd_index.build_index(context.path), repeat)
+  return _records_result(seconds, len(context.records))
+
+
+def _bench_compact_read(context, repeat):
+  """Reads the capture back from its compact form, batch by batch."""
+  with tempfile.TemporaryDirectory() as tmp:
+    path = compact.pack(context.path, pathlib.Path(tmp) / "capture.twkc")
+
+    def run():
+      for _ in columnar.iter_batches(path):
+        pass
+
+    seconds, _ = _best(run, repeat)
+  return _records_result(seconds, len(context.records))
+
+
+BENCHMARKS = {
+    "import_twinkie": _bench_import,
+    "get_header_list": _bench_get_header_list,
+    "twinkie_parse": _bench_twinkie_parse,
+    "data_mesg_pdo": _data_mesg_bench("pdo", data_mesg.pdo.parse),
+    "data_mesg_rdo": _data_mesg_bench("rdo", _parse_rdo),
+    "data_mesg_vdm": _data_mesg_bench("vdm", data_mesg.vdm.parse),
+    "columnar_decode": _bench_columnar_decode,
+    "data_objects": _bench_data_objects,
+    "crc_valid_mask": _bench_crc,
+    "build_index": _bench_build_index,
+    "compact_read": _bench_compact_read,
+}
+
+
+def _git_commit():
+  try:
+    return subprocess.run(
+        ["git", "rev-parse", "HEAD"], cwd=pathlib.Path(__file__).parent,
+        check=True, capture_output=True, text=True,
+    ).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def run(path, names=None, repeat=DEFAULT_REPEAT,
+        parse_records=DEFAULT_PARSE_RECORDS, capture=None):
+  """Runs benchmarks on a capture.
+
+  Args:
+    path: capture to measure.
+    names: BENCHMARKS to run, all by default.
+    repeat: calls per benchmark, the best one is kept.
+    parse_records: records or objects given to the per-record parsers.
+    capture: name of the capture stored in the run, its path by default;
+      only runs on the same capture are compared.
+
+  Returns:
+    The run as a JSON-serializable dict; `results` maps every benchmark to
+    its seconds, item count and unit, and the derived items_per_s.
+  """
+  context = _Context(path, parse_records)
+  results = {}
+  for name in names or BENCHMARKS:
+    result = BENCHMARKS[name](context, repeat)
+    if result["seconds"] > 0:
+      result["items_per_s"] = result["items"] / result["seconds"]
+    results[name] = result
+  return {
+      "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+      "commit": _git_commit(),
+      "python": platform.python_version(),
+      "platform": platform.platform(),
+      "cpus": os.cpu_count(),
+      "numpy": np.__version__,
+      "construct": ct.__version__,
+      "capture": str(path) if capture is None else capture,
+      "records": len(context.records),
+      "parse_records": parse_records,
+      "repeat": repeat,
+      "results": results,
+  }
+
+
+def save(report, results_dir=RESULTS_DIR):
+  """Stores a run under a timestamped name; returns its path."""
+  results_dir = pathlib.Path(results_dir)
+  results_dir.mkdir(parents=True, exist_ok=True)
+  stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+  path = results_dir / f"{stamp}.json"
+  path.write_text(json.dumps(report, indent=2) + "\n")
+  return path
+
+
+def mismatches(report, baseline):
+  """Returns (parameter, report value, baseline value) of every
+  COMPARED_PARAMETERS entry differing between two runs."""
+  return [
+      (name, report.get(name), baseline.get(name))
+      for name in COMPARED_PARAMETERS
+      if report.get(name) != baseline.get(name)
+  ]
+
+
+def previous(results_dir=RESULTS_DIR, exclude=None, report=None):
+  """Returns the path of the latest stored run, or None.
+
+  Args:
+    results_dir: directory of the stored runs.
+    exclude: path of a run to skip, e.g. the one just saved.
+    report: only return a run made with the same parameters as this one.
+
+  Returns:
+    (path or None, number of later runs skipped for their parameters).
+  """
+  runs = sorted(pathlib.Path(results_dir).glob("*.json"), reverse=True)
+  skipped = 0
+  for path in runs:
+    if path == exclude:
+      continue
+    if report is not None and mismatches(
+        report, json.loads(path.read_text())
+    ):
+      skipped += 1
+      continue
+    return path, skipped
+  return None, skipped
+
+
+def compare(report, baseline, threshold=DEFAULT_THRESHOLD):
+  """Compares two runs.
+
+  Returns:
+    (name, ratio, regressed) per benchmark in both runs; `ratio` is the
+    throughput of `report` over `baseline` (the inverse time ratio for
+    imports), and `regressed` is True when it is below 1 - threshold.
+
+  Raises:
+    BaselineMismatch: the runs were made with different parameters.
+  """
+  different = mismatches(report, baseline)
+  if different:
+    raise BaselineMismatch("runs made with different parameters: " + ", ".join(
+        f"{name} {new!r} (baseline {old!r})" for name, new, old in different
+    ))
+  rows = []
+  for name, result in report["results"].items():
+    old = baseline["results"].get(name)
+    if old is None or not result["seconds"] or not old["seconds"]:
+      continue
+    ratio = (old["seconds"] / old["items"]) / (
+        result["seconds"] / result["items"]
+    )
+    rows.append((name, ratio, ratio < 1 - threshold))
+  return rows
+
+
+def _format(name, result):
+  rate = result.get("items_per_s")
+  line = f"{name:18} {result['seconds'] * 1000:10.1f} ms"
+  if result["unit"] != "import" and rate is not None:
+    line += f" {rate:14,.0f} {result['unit']}/s"
+  if "mb_per_s" in result:
+    line += f" {result['mb_per_s']:9.1f} MB/s"
+  return line
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument(
+      "--capture", help="capture to measure, a synthetic one by default"
+  )
+  parser.add_argument("-n", "--records", type=int, default=DEFAULT_RECORDS)
+  parser.add_argument(
+      "--parse-records", type=int, default=DEFAULT_PARSE_RECORDS
+  )
+  parser.add_argument("-r", "--repeat", type=int, default=DEFAULT_REPEAT)
+  parser.add_argument(
+      "-k", dest="pattern", help="only run benchmarks containing this"
+  )
+  parser.add_argument("--results", default=RESULTS_DIR)
+  parser.add_argument(
+      "--baseline", help="run to compare with, the previous one by default"
+  )
+  parser.add_argument(
+      "--threshold", type=float, default=DEFAULT_THRESHOLD,
+      help="throughput drop reported as a regression",
+  )
+  parser.add_argument("--no-save", action="store_true")
+  args = parser.parse_args(argv)
+
+  names = [n for n in BENCHMARKS if not args.pattern or args.pattern in n]
+  with tempfile.TemporaryDirectory() as tmp:
+    path = args.capture or synth.generate(tmp, args.records)
+    capture = args.capture or "synthetic"
+    report = run(path, names, args.repeat, args.parse_records, capture)
+
+  for name, result in report["results"].items():
+    print(_format(name, result))
+
+  saved = None if args.no_save else save(report, args.results)
+  baseline = args.baseline
+  if baseline is None:
+    baseline, skipped = previous(args.results, saved, report)
+    if skipped:
+      print(f"\nskipped {skipped} newer stored runs made with other parameters")
+  status = 0
+  if baseline is not None:
+    old = json.loads(pathlib.Path(baseline).read_text())
+    try:
+      rows = compare(report, old, args.threshold)
+    except BaselineMismatch as e:
+      print(f"\nnot compared with {baseline}: {e}")
+      rows = []
+      status = 2
+    else:
+      print(f"\ncompared with {baseline}")
+    for name, ratio, regressed in rows:
+      status = status or int(regressed)
+      print(f"{name:18} x{ratio:6.2f}{'  REGRESSION' if regressed else ''}")
+  elif args.baseline is None:
+    print("\nno earlier run with the same parameters to compare with")
+  if saved is not None:
+    print(f"\nsaved {saved}")
+  return status
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,250 @@
+"""Random access to the records of one capture.
+
+A Capture maps its file instead of reading it: opening one reads nothing
+but the file header, and indexing it or slicing it by record index only
+reads the pages of the records involved. Slicing by time also reads the
+time field of the O(log n) records its bisection probes, plus, on the first
+time query, of the first and last records and of the bisection for a month
+rollover (timeline.Timeline). Compact captures (compact.py) decode the
+blocks holding those records instead, and time queries find their block
+from the times of the block index. PD messages are parsed record by record,
+on first access.
+
+  with capture.Capture("2024_0_15_10_0_0.bin") as cap:
+    for record in cap[1000000:1000100]:
+      print(record.index, record.time, record.pd)
+    minute = cap.window(datetime.datetime(2024, 1, 15, 10, 5),
+                        datetime.datetime(2024, 1, 15, 10, 6))
+"""
+
+import argparse
+import functools
+import operator
+import sys
+
+import construct as ct
+
+import columnar
+import compact
+import memo
+import query
+import session
+import timeline
+
+# Records read at a time when iterating.
+ITER_BATCH_RECORDS = 1024
+
+
+class Record:
+  """One record of a capture, with its twinkie.twinkie parse on demand."""
+
+  def __init__(self, index, row):
+    """Wraps a record.
+
+    Args:
+      index: index of the record in its capture file.
+      row: the columnar.snooper_packet record.
+    """
+    self.index = index
+    self.row = row
+    self.time = int(row["time"])
+    for name in columnar.ANALOG_CHANNELS:
+      setattr(self, name, int(row[name]))
+    self.packet_bin = int(row["packet_bin"])
+    self.data_length = int(row["data_length"])
+
+  @property
+  def raw(self):
+    """The 512 bytes of the record."""
+    return self.row.tobytes()
+
+  @property
+  def packet_type(self):
+    """The twinkie.twinkie_typ container of packet_bin."""
+    return memo.packet_type(self.packet_bin)
+
+  @functools.cached_property
+  def parsed(self):
+    """The record parsed like twinkie.twinkie (memo.parse_record).
+
+    Parsed on first access; a malformed PD message raises its construct
+    error here. Payloads are shared with memo.pd_cache: treat as read-only.
+    """
+    return memo.parse_record(self.raw)
+
+  @property
+  def pd(self):
+    """The parsed PD message, or None if the record holds none."""
+    return self.parsed.pd if self.data_length else None
+
+  def __str__(self):
+    return query.format_record(self.index, self.row)
+
+  def __repr__(self):
+    return (
+        f"Record({self.index}, time={self.time}, "
+        f"data_length={self.data_length})"
+    )
+
+
+class Capture:
+  """Memory-mapped capture with record and time indexing.
+
+  cap[i] is a Record and cap[a:b] the Capture of records [a, b), sharing
+  the map. Indices given to a sliced Capture count from its first record,
+  while Record.index is always the index in the file.
+  """
+
+  def __init__(self, path_str, start=None):
+    """Maps a capture.
+
+    Args:
+      path_str: path of the .bin or compact capture.
+      start: capture start datetime, taken from the file name by default;
+        only needed by the time queries.
+    """
+    self.path = path_str
+    self.start = start or session.capture_start(path_str)
+    self._reader = None
+    if compact.is_compact(path_str):
+      self._reader = compact.CompactReader(path_str)
+      self._records = compact.LazyRecords(self._reader)
+    else:
+      self._records = columnar.read_records(path_str)
+    self._first = 0
+    self._stop = len(self._records)
+    self._shared = {}
+
+  def _view(self, first, stop):
+    view = object.__new__(Capture)
+    view.__dict__.update(self.__dict__)
+    view._first = first
+    view._stop = max(first, stop)
+    return view
+
+  def close(self):
+    """Closes a compact capture; mapped captures close with their map."""
+    if self._reader is not None:
+      self._reader.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+    return False
+
+  def __len__(self):
+    return self._stop - self._first
+
+  def __repr__(self):
+    return f"Capture({self.path!r})[{self._first}:{self._stop}]"
+
+  def __getitem__(self, key):
+    if isinstance(key, slice):
+      start, stop, step = key.indices(len(self))
+      if step != 1:
+        raise ValueError("capture slices take no step")
+      return self._view(self._first + start, self._first + stop)
+    index = operator.index(key)
+    if index < 0:
+      index += len(self)
+    if not 0 <= index < len(self):
+      raise IndexError(f"record {key} out of range for {len(self)} records")
+    index += self._first
+    return Record(index, self._records[index])
+
+  def __iter__(self):
+    for first in range(self._first, self._stop, ITER_BATCH_RECORDS):
+      rows = self._records[first:min(first + ITER_BATCH_RECORDS, self._stop)]
+      for i, row in enumerate(rows):
+        yield Record(first + i, row)
+
+  @property
+  def first_index(self):
+    """Index in the file of the first record."""
+    return self._first
+
+  @property
+  def records(self):
+    """The columnar.snooper_packet records, read (or decoded) on access."""
+    return self._records[self._first:self._stop]
+
+  @property
+  def timeline(self):
+    """Timeline of the whole file, built on first use.
+
+    Raises:
+      ValueError: the capture has no start time.
+    """
+    line = self._shared.get("timeline")
+    if line is None:
+      blocks = None if self._reader is None else self._reader.blocks
+      line = timeline.Timeline(
+          self.path, self.start, self._records["time"], blocks
+      )
+      self._shared["timeline"] = line
+    return line
+
+  def times(self):
+    """Returns the timeline ms of every record (timeline.py)."""
+    return self.timeline.times(self._first, self._stop)
+
+  def index_at(self, when):
+    """Returns the index of the first record at or after `when`.
+
+    Args:
+      when: naive local datetime or timeline ms.
+    """
+    index = self.timeline.index_at(when)
+    return min(max(index, self._first), self._stop) - self._first
+
+  def window(self, begin, end):
+    """Returns the Capture of the records with begin <= time < end.
+
+    Args:
+      begin: naive local datetime or timeline ms.
+      end: naive local datetime or timeline ms.
+    """
+    return self[self.index_at(begin):self.index_at(end)]
+
+
+def _range(text):
+  """Parses a record range like `1000:1100`, `1000:` or `1000`."""
+  first, colon, stop = text.partition(":")
+  try:
+    first = int(first) if first else None
+    if not colon:
+      return slice(first, None if first is None else first + 1)
+    return slice(first, int(stop) if stop else None)
+  except ValueError:
+    raise argparse.ArgumentTypeError(f"not a record range: {text}") from None
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(
+      description="Print a range of records of a capture."
+  )
+  parser.add_argument("capture")
+  parser.add_argument(
+      "range", type=_range, nargs="?", default=slice(None),
+      help="records to print, e.g. 1000000:1000100",
+  )
+  parser.add_argument(
+      "--pd", action="store_true", help="also print the parsed PD messages"
+  )
+  args = parser.parse_args(argv)
+
+  with Capture(args.capture) as cap:
+    for record in cap[args.range]:
+      print(record)
+      if args.pd and record.data_length:
+        try:
+          print(record.pd)
+        except ct.ConstructError as e:
+          print(f"  unparsable PD message: {e}")
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
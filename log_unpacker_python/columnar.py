@@ -0,0 +1,210 @@
+"""Columnar access to twinkie capture files.
+
+A capture is a flat sequence of fixed size `struct SnooperPacket` records
+(include/snooper_packet.h). Mapping the file with a matching NumPy structured
+dtype gives every field as a zero-copy column without a per-record loop.
+
+Compact captures (compact.py) are recognized by their magic and decoded
+instead, so every reader below accepts both formats.
+"""
+
+import contextlib
+import os
+import pathlib
+
+import numpy as np
+
+import profiling
+
+SNOOPER_PACKET_SIZE = 512
+SNOOPER_MAX_DATA_SIZE = 488
+
+# struct SnooperPacket, field names follow twinkie.twinkie.
+snooper_packet = np.dtype([
+    ("time", "<u4"),
+    ("cc1_v", "<u2"),
+    ("cc2_v", "<u2"),
+    ("cc2_c", "<u2"),
+    ("vbus_v", "<u2"),
+    ("vbus_c", "<u2"),
+    ("packet_bin", "<u2"),
+    ("data_length", "<u2"),
+    ("unused", "<u2"),
+    ("data", "u1", (SNOOPER_MAX_DATA_SIZE,)),
+    ("crc", "<u4"),
+])
+assert snooper_packet.itemsize == SNOOPER_PACKET_SIZE
+
+ANALOG_CHANNELS = ("cc1_v", "cc2_v", "cc2_c", "vbus_v", "vbus_c")
+
+# Records per batch of iter_batches, 8 MiB of capture.
+DEFAULT_BATCH_RECORDS = 16384
+
+
+def _compact(path_str):
+  """Returns the compact module if `path_str` is a compact capture, or None.
+
+  Imported on first use: compact imports this module.
+  """
+  import compact
+
+  return compact if compact.is_compact(path_str) else None
+
+
+def record_count(path_str):
+  """Returns the number of complete records of a capture file."""
+  compact = _compact(path_str)
+  if compact is not None:
+    with compact.CompactReader(path_str) as reader:
+      return len(reader)
+  return pathlib.Path(path_str).stat().st_size // SNOOPER_PACKET_SIZE
+
+
+def read_records(path_str, start=0, stop=None):
+  """Maps a capture file as a read only array of `snooper_packet` records.
+
+  A truncated final record is ignored, the same way get_header_list does.
+  Only the blocks of a compact capture holding the range are decoded.
+
+  Args:
+    path_str: path of the .bin or compact capture.
+    start: index of the first record to map.
+    stop: index past the last record to map, the end of the file by default.
+
+  Returns:
+    A structured array (memory mapped when not empty and not compact).
+  """
+  compact = _compact(path_str)
+  if compact is not None:
+    with compact.CompactReader(path_str) as reader:
+      records = reader.read(start, stop)
+    records.flags.writeable = False
+    return records
+  count = record_count(path_str)
+  stop = count if stop is None else min(stop, count)
+  if stop <= start:
+    return np.empty(0, dtype=snooper_packet)
+  return np.memmap(
+      path_str,
+      dtype=snooper_packet,
+      mode="r",
+      offset=start * SNOOPER_PACKET_SIZE,
+      shape=(stop - start,),
+  )
+
+
+def lazy_records(path_str):
+  """Returns the records of a capture, indexed like an array, read on access.
+
+  Nothing is read upfront: a .bin capture is memory mapped (read_records),
+  a compact one wrapped in compact.LazyRecords, which decodes only the
+  blocks holding the indexed records. `lazy_records(path)["time"]` is a
+  column indexed the same way.
+
+  Args:
+    path_str: path of the .bin or compact capture.
+  """
+  compact = _compact(path_str)
+  if compact is not None:
+    return compact.LazyRecords(compact.CompactReader(path_str))
+  return read_records(path_str)
+
+
+def read_columns(path_str):
+  """Returns the capture fields as a dict of zero-copy column views.
+
+  Args:
+    path_str: path of the .bin or compact capture.
+
+  Returns:
+    A dict keyed by `snooper_packet` field name.
+  """
+  records = read_records(path_str)
+  return {name: records[name] for name in snooper_packet.names}
+
+
+_pd_header_view = np.dtype({
+    "names": ["pd_header"],
+    "formats": ["<u2"],
+    "offsets": [snooper_packet.fields["data"][1]],
+    "itemsize": SNOOPER_PACKET_SIZE,
+})
+
+
+def pd_header_words(records):
+  """Returns the 16-bit PD message header of every record as a column view.
+
+  The value is only meaningful where `data_length` is not zero.
+  """
+  return records.view(_pd_header_view)["pd_header"]
+
+
+@contextlib.contextmanager
+def _open_source(source):
+  """Yields a binary file object for a path or an already open file."""
+  if hasattr(source, "readinto") or hasattr(source, "read"):
+    yield source
+  else:
+    with open(source, "rb") as f:
+      yield f
+
+
+def _read_full(f, view):
+  """Fills `view` from `f` until it is full or the stream ends."""
+  filled = 0
+  while filled < len(view):
+    if hasattr(f, "readinto"):
+      n = f.readinto(view[filled:])
+    else:
+      chunk = f.read(len(view) - filled)
+      n = len(chunk) if chunk else 0
+      view[filled:filled + n] = chunk or b""
+    if not n:
+      break
+    filled += n
+  return filled
+
+
+def iter_batches(source, batch_records=DEFAULT_BATCH_RECORDS):
+  """Yields consecutive batches of `snooper_packet` records.
+
+  Memory use is bounded by `batch_records` whatever the capture size. Each
+  yielded array owns its buffer, so it stays valid after the next batch is
+  read. A truncated final record is dropped.
+
+  Args:
+    source: path of a .bin or compact capture, or a binary file-like object
+      (file, pipe, socket makefile) of .bin records positioned on a record
+      boundary.
+    batch_records: number of records read at a time.
+
+  Yields:
+    Structured arrays of at most `batch_records` records.
+  """
+  if batch_records < 1:
+    raise ValueError("batch_records must be positive")
+
+  if isinstance(source, (str, os.PathLike)):
+    compact = _compact(source)
+    if compact is not None:
+      yield from compact.iter_batches(source, batch_records)
+      return
+
+  size = batch_records * SNOOPER_PACKET_SIZE
+  with _open_source(source) as f:
+    while True:
+      buf = bytearray(size)
+      with profiling.stage("io.read") as stage:
+        filled = _read_full(f, memoryview(buf))
+        stage.add(filled // SNOOPER_PACKET_SIZE, filled)
+      count = filled // SNOOPER_PACKET_SIZE
+      if count:
+        yield np.frombuffer(buf, dtype=snooper_packet, count=count)
+      if filled < size:
+        return
+
+
+def iter_records(source, batch_records=DEFAULT_BATCH_RECORDS):
+  """Yields single records, reading `batch_records` at a time."""
+  for batch in iter_batches(source, batch_records):
+    yield from batch
@@ -0,0 +1,590 @@
+"""Compact container format of twinkie captures (.twkc).
+
+A .bin record is 512 bytes whatever it holds, while most records are analog
+samples carrying no PD bytes at all. A compact capture stores the same
+records losslessly, a block of consecutive records at a time:
+
+* time, the analog channels and packet_bin as zigzag varints of their
+  differences with the previous record of the block;
+* data_length and unused as varints;
+* the data bytes of every record up to `data_length`, or up to its last
+  non-zero byte if a stray byte lies past it, concatenated;
+* in place of the CRC, the sequence word it was computed with
+  (crc.sequence_words), as zigzag varints of its differences: consecutive
+  sequence numbers take a byte per record, and the reader recomputes the
+  CRC from it (crc.device_crcs).
+
+Every block is compressed with zlib on its own, and an index at the end of
+the file gives the first record, offset and size of each block, so any
+record range is read without decoding the blocks before it. The bytes of a
+truncated final record are kept in the index, so that `unpack` restores the
+.bin byte for byte.
+
+  file   := header block* index footer
+  header := "TWKC", u2 version, u2 flags (0), u4 block records
+  block  := zlib(u4 column sizes, columns)
+  index  := block_entry[block count], u4 tail size, tail bytes
+  footer := u8 index offset, u4 block count, "TWKI"
+
+columnar.record_count, read_records and iter_batches open compact captures
+transparently, so the tools built on them do too.
+
+  python compact.py pack 2024_0_15_10_0_0.bin      # writes ...0_0.twkc
+  python compact.py unpack 2024_0_15_10_0_0.twkc
+"""
+
+import argparse
+import collections
+import operator
+import os
+import pathlib
+import struct
+import sys
+import threading
+import zlib
+
+import numpy as np
+
+import columnar
+import crc
+import profiling
+
+SUFFIX = ".twkc"
+FORMAT_VERSION = 2
+MAGIC = b"TWKC"
+INDEX_MAGIC = b"TWKI"
+
+DEFAULT_BLOCK_RECORDS = 16384
+DEFAULT_LEVEL = 6
+# Decoded blocks kept by LazyRecords, 8 MiB each by default.
+DEFAULT_CACHE_BLOCKS = 4
+
+_HEADER = struct.Struct("<4sHHI")
+_FOOTER = struct.Struct("<QI4s")
+_TAIL_SIZE = struct.Struct("<I")
+
+block_entry = np.dtype([
+    ("first_record", "<u8"),
+    ("offset", "<u8"),
+    ("size", "<u4"),
+    ("records", "<u4"),
+    ("first_time", "<u4"),
+    ("last_time", "<u4"),
+])
+
+# Fields stored as differences with the previous record.
+_DELTA_FIELDS = ("time",) + columnar.ANALOG_CHANNELS + ("packet_bin",)
+_VARINT_FIELDS = ("data_length", "unused")
+# Columns of a block after the fields: stored data bytes past data_length,
+# data bytes and the zigzag deltas of the sequence words (crc.sequence_words)
+# the CRCs are recomputed from.
+_COLUMN_COUNT = len(_DELTA_FIELDS) + len(_VARINT_FIELDS) + 3
+
+_MAX_DATA = columnar.SNOOPER_MAX_DATA_SIZE
+_DATA_POSITIONS = np.arange(_MAX_DATA)
+
+
+class CompactError(ValueError):
+  """A file is not a valid compact capture."""
+
+
+def is_compact(path_str):
+  """Returns True if a file has the SUFFIX extension and starts with MAGIC.
+
+  The suffix is checked first: the first 4 bytes of a .bin capture are a
+  timer value, which may spell MAGIC.
+  """
+  if pathlib.Path(path_str).suffix != SUFFIX:
+    return False
+  with open(path_str, "rb") as f:
+    return f.read(len(MAGIC)) == MAGIC
+
+
+def _zigzag_deltas(values):
+  deltas = np.diff(values.astype(np.int64), prepend=np.int64(0))
+  return ((deltas << 1) ^ (deltas >> 63)).view(np.uint64)
+
+
+def _undo_zigzag_deltas(encoded):
+  one = np.uint64(1)
+  deltas = (encoded >> one).view(np.int64) ^ -(encoded & one).view(np.int64)
+  return np.cumsum(deltas)
+
+
+def _varint_encode(values):
+  """Encodes unsigned integers as LEB128 varints."""
+  values = np.asarray(values, dtype=np.uint64)
+  lengths = np.ones(len(values), dtype=np.int64)
+  for k in range(1, 10):
+    longer = values >= np.uint64(1 << 7 * k)
+    if not longer.any():
+      break
+    lengths += longer
+  if k == 1:
+    # Single byte varints, the common case of slowly varying columns.
+    return values.astype(np.uint8).tobytes()
+  ends = np.cumsum(lengths)
+  starts = ends - lengths
+  out = np.empty(ends[-1], dtype=np.uint8)
+  for k in range(int(lengths.max())):
+    rows = np.flatnonzero(lengths > k)
+    byte = (values[rows] >> np.uint64(7 * k)) & np.uint64(0x7F)
+    byte[lengths[rows] > k + 1] |= np.uint64(0x80)
+    out[starts[rows] + k] = byte
+  return out.tobytes()
+
+
+def _varint_decode(data, count):
+  """Decodes `count` LEB128 varints filling `data` exactly."""
+  b = np.frombuffer(data, dtype=np.uint8)
+  if len(b) == count and not (b & 0x80).any():
+    return b.astype(np.uint64)
+  ends = np.flatnonzero(b < 0x80)
+  if len(ends) != count or (count and ends[-1] != len(b) - 1):
+    raise CompactError("corrupt varint column")
+  if not count:
+    return np.empty(0, dtype=np.uint64)
+  starts = np.empty(count, dtype=np.int64)
+  starts[0] = 0
+  starts[1:] = ends[:-1] + 1
+  shifts = 7 * (np.arange(len(b)) - np.repeat(starts, ends - starts + 1))
+  values = (b & 0x7F).astype(np.uint64) << shifts.astype(np.uint64)
+  return np.add.reduceat(values, starts)
+
+
+def _stored_lengths(records):
+  """Returns data_length capped to the data size, and the stored lengths."""
+  data = records["data"]
+  length = np.minimum(records["data_length"], _MAX_DATA).astype(np.int64)
+  nonzero = data != 0
+  last = np.where(
+      nonzero.any(axis=1), _MAX_DATA - np.argmax(nonzero[:, ::-1], axis=1), 0
+  )
+  return length, np.maximum(length, last)
+
+
+def _encode_block(records, level):
+  columns = [_varint_encode(_zigzag_deltas(records[n])) for n in _DELTA_FIELDS]
+  columns += [_varint_encode(records[n]) for n in _VARINT_FIELDS]
+  length, stored = _stored_lengths(records)
+  columns.append(_varint_encode(stored - length))
+  rows = np.flatnonzero(stored)
+  columns.append(
+      records["data"][rows][_DATA_POSITIONS < stored[rows, None]].tobytes()
+  )
+  sequences = crc.sequence_words(records, zero_data=stored == 0)
+  columns.append(_varint_encode(_zigzag_deltas(sequences)))
+  sizes = np.array([len(c) for c in columns], dtype="<u4").tobytes()
+  return zlib.compress(sizes + b"".join(columns), level)
+
+
+def _decode_block(blob, count):
+  try:
+    body = zlib.decompress(blob)
+  except zlib.error as e:
+    raise CompactError(f"corrupt block: {e}") from None
+  sizes = np.frombuffer(body, dtype="<u4", count=_COLUMN_COUNT)
+  bounds = np.cumsum(np.concatenate(([sizes.nbytes], sizes)))
+  if bounds[-1] != len(body):
+    raise CompactError("corrupt block: column sizes do not match")
+  columns = [body[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+
+  records = np.zeros(count, dtype=columnar.snooper_packet)
+  for name, column in zip(_DELTA_FIELDS, columns):
+    records[name] = _undo_zigzag_deltas(_varint_decode(column, count))
+  columns = columns[len(_DELTA_FIELDS):]
+  for name, column in zip(_VARINT_FIELDS, columns):
+    records[name] = _varint_decode(column, count)
+  extra, data, sequences = columns[len(_VARINT_FIELDS):]
+
+  length = np.minimum(records["data_length"], _MAX_DATA).astype(np.int64)
+  stored = length + _varint_decode(extra, count).astype(np.int64)
+  if stored.sum() != len(data) or (stored > _MAX_DATA).any():
+    raise CompactError("corrupt block: data size does not match")
+  rows = np.flatnonzero(stored)
+  payloads = np.zeros((len(rows), _MAX_DATA), dtype=np.uint8)
+  payloads[_DATA_POSITIONS < stored[rows, None]] = np.frombuffer(
+      data, dtype=np.uint8
+  )
+  records["data"][rows] = payloads
+
+  sequences = _undo_zigzag_deltas(_varint_decode(sequences, count))
+  records["crc"] = crc.device_crcs(
+      records, sequences.astype(np.uint32), zero_data=stored == 0
+  )
+  return records
+
+
+class CompactWriter:
+  """Writes records to a compact capture, a block at a time."""
+
+  def __init__(self, f, block_records=DEFAULT_BLOCK_RECORDS,
+               level=DEFAULT_LEVEL):
+    """Writes the header.
+
+    Args:
+      f: binary file object opened for writing, positioned at 0.
+      block_records: records per block; larger blocks compress slightly
+        better, smaller ones make random access cheaper.
+      level: zlib compression level.
+    """
+    if block_records < 1:
+      raise ValueError("block_records must be positive")
+    self._file = f
+    self.block_records = block_records
+    self.level = level
+    self._pending = []
+    self._pending_count = 0
+    self._entries = []
+    self._records = 0
+    self._offset = f.write(
+        _HEADER.pack(MAGIC, FORMAT_VERSION, 0, block_records)
+    )
+
+  def write(self, records):
+    """Appends an array of columnar.snooper_packet records."""
+    self._pending.append(records)
+    self._pending_count += len(records)
+    if self._pending_count >= self.block_records:
+      self._flush(final=False)
+
+  def _flush(self, final):
+    if not self._pending_count:
+      return
+    pending = np.concatenate(self._pending)
+    whole = len(pending) if final else (
+        len(pending) - len(pending) % self.block_records
+    )
+    for first in range(0, whole, self.block_records):
+      self._write_block(pending[first:first + self.block_records])
+    rest = pending[whole:]
+    self._pending = [rest] if len(rest) else []
+    self._pending_count = len(rest)
+
+  def _write_block(self, records):
+    with profiling.stage(
+        "compact.encode", len(records), records.nbytes
+    ):
+      blob = _encode_block(records, self.level)
+    self._file.write(blob)
+    self._entries.append((
+        self._records, self._offset, len(blob), len(records),
+        records["time"][0], records["time"][-1],
+    ))
+    self._records += len(records)
+    self._offset += len(blob)
+
+  def close(self, tail=b""):
+    """Writes the pending records, the index and the footer.
+
+    Args:
+      tail: bytes of a truncated final record, restored by unpack.
+    """
+    self._flush(final=True)
+    entries = np.array(self._entries, dtype=block_entry)
+    self._file.write(entries.tobytes())
+    self._file.write(_TAIL_SIZE.pack(len(tail)) + bytes(tail))
+    self._file.write(_FOOTER.pack(self._offset, len(entries), INDEX_MAGIC))
+
+
+class CompactReader:
+  """Random access to the records of a compact capture.
+
+  Reads are serialized on the file, so a reader can be shared by threads.
+  """
+
+  def __init__(self, path_str):
+    self.path = pathlib.Path(path_str)
+    self._file = open(self.path, "rb")
+    self._lock = threading.Lock()
+    try:
+      self._read_index()
+    except struct.error:
+      self._file.close()
+      raise CompactError(f"{self.path} is not a compact capture") from None
+    except BaseException:
+      self._file.close()
+      raise
+
+  def _read_index(self):
+    f = self._file
+    magic, version, _, self.block_records = _HEADER.unpack(
+        f.read(_HEADER.size)
+    )
+    if magic != MAGIC:
+      raise CompactError(f"{self.path} is not a compact capture")
+    if version != FORMAT_VERSION:
+      raise CompactError(f"unsupported compact format version {version}")
+    size = f.seek(0, os.SEEK_END)
+    f.seek(size - _FOOTER.size)
+    index_offset, count, magic = _FOOTER.unpack(f.read(_FOOTER.size))
+    if magic != INDEX_MAGIC:
+      raise CompactError(f"{self.path} has no block index (truncated?)")
+    f.seek(index_offset)
+    self.blocks = np.frombuffer(
+        f.read(count * block_entry.itemsize), dtype=block_entry
+    )
+    (tail_size,) = _TAIL_SIZE.unpack(f.read(_TAIL_SIZE.size))
+    self.tail = f.read(tail_size)
+    if len(self.blocks) != count or len(self.tail) != tail_size:
+      raise CompactError(f"{self.path} has a truncated block index")
+    self._starts = self.blocks["first_record"].astype(np.int64)
+    self._count = int(self.blocks["records"].sum())
+
+  def __len__(self):
+    return self._count
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+    return False
+
+  def close(self):
+    self._file.close()
+
+  def read_block(self, i):
+    """Decodes block `i` into an array of columnar.snooper_packet records."""
+    entry = self.blocks[i]
+    count = int(entry["records"])
+    with self._lock, profiling.stage("io.read", 0, int(entry["size"])):
+      self._file.seek(int(entry["offset"]))
+      blob = self._file.read(int(entry["size"]))
+    with profiling.stage(
+        "compact.decode", count, count * columnar.SNOOPER_PACKET_SIZE
+    ):
+      return _decode_block(blob, count)
+
+  def iter_blocks(self, first=0):
+    """Yields the decoded blocks from block `first` on."""
+    for i in range(first, len(self.blocks)):
+      yield self.read_block(i)
+
+  def read(self, start=0, stop=None):
+    """Returns records [start, stop) as an in-memory array."""
+    start = max(start, 0)
+    stop = self._count if stop is None else min(stop, self._count)
+    if stop <= start:
+      return np.empty(0, dtype=columnar.snooper_packet)
+    first = int(np.searchsorted(self._starts, start, side="right")) - 1
+    last = int(np.searchsorted(self._starts, stop, side="left"))
+    blocks = [self.read_block(i) for i in range(first, last)]
+    records = blocks[0] if len(blocks) == 1 else np.concatenate(blocks)
+    offset = start - self._starts[first]
+    return records[offset:offset + stop - start]
+
+
+class LazyRecords:
+  """Array-like records of a compact capture, decoded a block at a time.
+
+  len(), integer, slice, integer array and boolean mask indexing decode only
+  the blocks holding the selected records, and return what the same index
+  returns on an array of columnar.snooper_packet records. Indexing with a
+  field name returns a column indexed the same way, without decoding.
+  The last decoded blocks are kept for the next accesses. `blocks` is the
+  block index of the reader.
+  """
+
+  def __init__(self, reader, cache_blocks=DEFAULT_CACHE_BLOCKS):
+    self.dtype = columnar.snooper_packet
+    self.blocks = reader.blocks
+    self._reader = reader
+    self._cache_blocks = cache_blocks
+    self._blocks = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._reader)
+
+  def _block(self, i):
+    with self._lock:
+      block = self._blocks.get(i)
+      if block is not None:
+        self._blocks.move_to_end(i)
+        return block
+    block = self._reader.read_block(i)
+    block.flags.writeable = False
+    with self._lock:
+      self._blocks[i] = block
+      while len(self._blocks) > self._cache_blocks:
+        self._blocks.popitem(last=False)
+    return block
+
+  def _take(self, indices):
+    indices = np.asarray(indices, dtype=np.int64)
+    count = len(self)
+    indices = np.where(indices < 0, indices + count, indices)
+    if len(indices) and (indices.min() < 0 or indices.max() >= count):
+      raise IndexError(f"record index out of range for {count} records")
+    starts = self._reader._starts
+    blocks = np.searchsorted(starts, indices, side="right") - 1
+    out = np.empty(len(indices), dtype=self.dtype)
+    for i in np.unique(blocks):
+      where = blocks == i
+      out[where] = self._block(int(i))[indices[where] - starts[i]]
+    return out
+
+  def __getitem__(self, key):
+    if isinstance(key, str):
+      return _LazyColumn(self, key)
+    if isinstance(key, slice):
+      return self._take(np.arange(*key.indices(len(self))))
+    if np.ndim(key) == 0:
+      return self._take([operator.index(key)])[0]
+    key = np.asarray(key)
+    if key.dtype == bool:
+      key = np.flatnonzero(key)
+    return self._take(key)
+
+
+class _LazyColumn:
+  """One field of LazyRecords, indexed like LazyRecords."""
+
+  def __init__(self, records, name):
+    self._records = records
+    self._name = name
+
+  def __len__(self):
+    return len(self._records)
+
+  def __getitem__(self, key):
+    return self._records[key][self._name]
+
+
+def iter_batches(path_str, batch_records=columnar.DEFAULT_BATCH_RECORDS):
+  """Yields the records of a compact capture like columnar.iter_batches."""
+  if batch_records < 1:
+    raise ValueError("batch_records must be positive")
+  with CompactReader(path_str) as reader:
+    rest = None
+    for block in reader.iter_blocks():
+      if rest is not None and len(rest):
+        block = np.concatenate((rest, block))
+      whole = len(block) - len(block) % batch_records
+      for first in range(0, whole, batch_records):
+        yield block[first:first + batch_records]
+      rest = block[whole:]
+    if rest is not None and len(rest):
+      yield rest
+
+
+def raw_bytes(path_str):
+  """Returns the bytes of a capture as its .bin file holds them."""
+  if not is_compact(path_str):
+    return pathlib.Path(path_str).read_bytes()
+  with CompactReader(path_str) as reader:
+    return reader.read().tobytes() + reader.tail
+
+
+def _replace_atomically(target, write):
+  target = pathlib.Path(target)
+  tmp = target.with_name(target.name + f".{os.getpid()}.tmp")
+  try:
+    with open(tmp, "wb") as f:
+      write(f)
+    os.replace(tmp, target)
+  except BaseException:
+    tmp.unlink(missing_ok=True)
+    raise
+  return target
+
+
+def pack(src, dst=None, block_records=DEFAULT_BLOCK_RECORDS,
+         level=DEFAULT_LEVEL):
+  """Converts a .bin capture to a compact one.
+
+  Args:
+    src: path of the .bin capture.
+    dst: output path, `src` with the SUFFIX extension by default, which
+      keeps the control_d name (session.capture_start).
+    block_records, level: as in CompactWriter.
+
+  Returns:
+    The path of the compact capture.
+  """
+  src = pathlib.Path(src)
+  if is_compact(src):
+    raise CompactError(f"{src} is already a compact capture")
+  dst = src.with_suffix(SUFFIX) if dst is None else dst
+
+  def write(f):
+    writer = CompactWriter(f, block_records, level)
+    with open(src, "rb") as source:
+      for batch in columnar.iter_batches(source, block_records):
+        writer.write(batch)
+      size = source.seek(0, os.SEEK_END)
+      source.seek(size - size % columnar.SNOOPER_PACKET_SIZE)
+      writer.close(tail=source.read())
+
+  return _replace_atomically(dst, write)
+
+
+def unpack(src, dst=None):
+  """Converts a compact capture back to the original .bin bytes.
+
+  Args:
+    src: path of the compact capture.
+    dst: output path, `src` with the .bin extension by default.
+
+  Returns:
+    The path of the .bin capture.
+  """
+  src = pathlib.Path(src)
+  dst = src.with_suffix(".bin") if dst is None else dst
+
+  def write(f):
+    with CompactReader(src) as reader:
+      for block in reader.iter_blocks():
+        block.tofile(f)
+      f.write(reader.tail)
+
+  return _replace_atomically(dst, write)
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(
+      description="Convert captures to and from the compact format."
+  )
+  sub = parser.add_subparsers(dest="command", required=True)
+  pack_parser = sub.add_parser("pack", help=".bin to compact")
+  pack_parser.add_argument("captures", nargs="+")
+  pack_parser.add_argument("-o", "--output", help="output path, one capture")
+  pack_parser.add_argument(
+      "--block-records", type=int, default=DEFAULT_BLOCK_RECORDS
+  )
+  pack_parser.add_argument("--level", type=int, default=DEFAULT_LEVEL)
+  pack_parser.add_argument(
+      "--verify", action="store_true", help="check the round trip"
+  )
+  unpack_parser = sub.add_parser("unpack", help="compact to .bin")
+  unpack_parser.add_argument("captures", nargs="+")
+  unpack_parser.add_argument("-o", "--output", help="output path, one capture")
+  args = parser.parse_args(argv)
+
+  if args.output and len(args.captures) > 1:
+    parser.error("--output needs a single capture")
+  status = 0
+  for capture in args.captures:
+    try:
+      if args.command == "pack":
+        out = pack(capture, args.output, args.block_records, args.level)
+        if args.verify and raw_bytes(out) != pathlib.Path(capture).read_bytes():
+          print(f"{capture}: round trip mismatch", file=sys.stderr)
+          status = 1
+          continue
+      else:
+        out = unpack(capture, args.output)
+    except (OSError, CompactError) as e:
+      print(f"{capture}: {e}", file=sys.stderr)
+      status = 1
+      continue
+    before = os.path.getsize(capture)
+    after = os.path.getsize(out)
+    print(f"{out}: {before} -> {after} bytes "
+          f"({before / after if after else 0:.1f}x)")
+  return status
+
+
+if __name__ == "__main__":
+  sys.exit(main())
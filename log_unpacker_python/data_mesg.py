@@ -1,7 +1,6 @@
 """PD Data Message."""
 
 import enum
-import pathlib
 
 import construct as ct
 import util
@@ -327,63 +326,79 @@ rdo = util.ByteSwappedBitStruct(
 
 # Revision 3.1 Version 1.8 Table 6-21 Fixed and Variable Request Data Object
 # Revision 3.1 Version 1.8 Table 6-22 Fixed and Variable Request Data Object with GiveBack Support
-fix_variable_rdo = ct.Struct(
-    "pos" / ct.BitsInteger(4),
-    "give_back_flag" / ct.Flag,
-    "capability_mismatch" / ct.Flag,
-    "usb_communications_capable" / ct.Flag,
-    "no_usb_suspend" / ct.Flag,
-    "unchunked_extended_messages_supported" / ct.Flag,
-    "erp_mode_capable" / ct.Flag,
-    ct.Padding(2),
-    "current_10ma" / ct.BitsInteger(10),
-    "current_limit_10ma" / ct.BitsInteger(10),
-).compile(pathlib.Path(__file__).parent / "__pycache__" / "fix_variable_rdo.py")
+fix_variable_rdo = util.LazyCompiled(
+    ct.Struct(
+        "pos" / ct.BitsInteger(4),
+        "give_back_flag" / ct.Flag,
+        "capability_mismatch" / ct.Flag,
+        "usb_communications_capable" / ct.Flag,
+        "no_usb_suspend" / ct.Flag,
+        "unchunked_extended_messages_supported" / ct.Flag,
+        "erp_mode_capable" / ct.Flag,
+        ct.Padding(2),
+        "current_10ma" / ct.BitsInteger(10),
+        "current_limit_10ma" / ct.BitsInteger(10),
+    ),
+    "fix_variable_rdo",
+    __file__,
+)
 
 # Revision 3.1 Version 1.8 Table 6-23 Battery Request Data Object
 # Revision 3.1 Version 1.8 Table 6-24 Battery Request Data Object with GiveBack Support
-battery_rdo = ct.Struct(
-    "pos" / ct.BitsInteger(4),
-    "give_back_flag" / ct.Flag,
-    "Capability_Mismatch" / ct.Flag,
-    "usb_communications_capable" / ct.Flag,
-    "no_usb_suspend" / ct.Flag,
-    "unchunked_extended_messages_supported" / ct.Flag,
-    "erp_mode_capable" / ct.Flag,
-    ct.Padding(2),
-    "power_250mw" / ct.BitsInteger(10),
-    "power_limit_250mw" / ct.BitsInteger(10),
-).compile(pathlib.Path(__file__).parent / "__pycache__" / "battery_rdo.py")
+battery_rdo = util.LazyCompiled(
+    ct.Struct(
+        "pos" / ct.BitsInteger(4),
+        "give_back_flag" / ct.Flag,
+        "Capability_Mismatch" / ct.Flag,
+        "usb_communications_capable" / ct.Flag,
+        "no_usb_suspend" / ct.Flag,
+        "unchunked_extended_messages_supported" / ct.Flag,
+        "erp_mode_capable" / ct.Flag,
+        ct.Padding(2),
+        "power_250mw" / ct.BitsInteger(10),
+        "power_limit_250mw" / ct.BitsInteger(10),
+    ),
+    "battery_rdo",
+    __file__,
+)
 
 # Revision 3.1 Version 1.8 Table 6-25 PPS Request Data Object
-pps_rdo = ct.Struct(
-    "pos" / ct.BitsInteger(4),
-    ct.Padding(1),
-    "Capability_Mismatch" / ct.Flag,
-    "usb_communications_capable" / ct.Flag,
-    "no_usb_suspend" / ct.Flag,
-    "unchunked_extended_messages_supported" / ct.Flag,
-    "erp_mode_capable" / ct.Flag,
-    ct.Padding(1),
-    "voltage_20mv" / ct.BitsInteger(12),
-    ct.Padding(2),
-    "current_50ma" / ct.BitsInteger(7),
-).compile(pathlib.Path(__file__).parent / "__pycache__" / "pps_rdo.py")
+pps_rdo = util.LazyCompiled(
+    ct.Struct(
+        "pos" / ct.BitsInteger(4),
+        ct.Padding(1),
+        "Capability_Mismatch" / ct.Flag,
+        "usb_communications_capable" / ct.Flag,
+        "no_usb_suspend" / ct.Flag,
+        "unchunked_extended_messages_supported" / ct.Flag,
+        "erp_mode_capable" / ct.Flag,
+        ct.Padding(1),
+        "voltage_20mv" / ct.BitsInteger(12),
+        ct.Padding(2),
+        "current_50ma" / ct.BitsInteger(7),
+    ),
+    "pps_rdo",
+    __file__,
+)
 
 # Revision 3.1 Version 1.8 Table 6-26 AVS Request Data Object
-avs_rdo = ct.Struct(
-    "pos" / ct.BitsInteger(4),
-    ct.Padding(1),
-    "Capability_Mismatch" / ct.Flag,
-    "usb_communications_capable" / ct.Flag,
-    "no_usb_suspend" / ct.Flag,
-    "unchunked_extended_messages_supported" / ct.Flag,
-    "erp_mode_capable" / ct.Flag,
-    ct.Padding(1),
-    "voltage_25mv" / ct.BitsInteger(12),
-    ct.Padding(2),
-    "current_50ma" / ct.BitsInteger(7),
-).compile(pathlib.Path(__file__).parent / "__pycache__" / "avs_rdo.py")
+avs_rdo = util.LazyCompiled(
+    ct.Struct(
+        "pos" / ct.BitsInteger(4),
+        ct.Padding(1),
+        "Capability_Mismatch" / ct.Flag,
+        "usb_communications_capable" / ct.Flag,
+        "no_usb_suspend" / ct.Flag,
+        "unchunked_extended_messages_supported" / ct.Flag,
+        "erp_mode_capable" / ct.Flag,
+        ct.Padding(1),
+        "voltage_25mv" / ct.BitsInteger(12),
+        ct.Padding(2),
+        "current_50ma" / ct.BitsInteger(7),
+    ),
+    "avs_rdo",
+    __file__,
+)
 
 # Revision 3.1 Version 1.8 Table 6-27 BIST Data Object
 bits = util.ByteSwappedBitStruct("mode" / BitsMode, ct.Padding(28), __size=4)
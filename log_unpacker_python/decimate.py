@@ -0,0 +1,53 @@
+"""Min/max decimation pyramid for plotting long analog channels.
+
+Level k of the pyramid holds the min and max of consecutive buckets of
+FACTOR**k samples, built once from the level below. A view picks the finest
+level that stays under the requested number of points over the visible x
+range, so redrawing costs the same at any zoom level and the envelope of the
+signal (spikes included) is always kept.
+"""
+
+import numpy as np
+
+FACTOR = 4
+
+
+class MinMaxPyramid:
+  """Decimation pyramid of one channel y(x), x sorted ascending."""
+
+  def __init__(self, x, y, factor=FACTOR):
+    self.x = np.asarray(x)
+    self.y = np.asarray(y)
+    self.factor = factor
+    # levels[k] = (first sample index of every bucket, bucket min, bucket max)
+    self.levels = []
+    starts = np.arange(len(self.y))
+    low = high = self.y
+    while len(low) > factor:
+      idx = np.arange(0, len(low), factor)
+      starts = starts[idx]
+      low = np.minimum.reduceat(low, idx)
+      high = np.maximum.reduceat(high, idx)
+      self.levels.append((starts, low, high))
+
+  def view(self, xmin, xmax, max_points):
+    """Returns (x, y) arrays to draw the channel over [xmin, xmax].
+
+    Args:
+      xmin: left end of the visible range.
+      xmax: right end of the visible range.
+      max_points: point budget, about twice the axes width in pixels.
+    """
+    first = max(np.searchsorted(self.x, xmin, side="left") - 1, 0)
+    last = min(np.searchsorted(self.x, xmax, side="right") + 1, len(self.x))
+    if last - first <= max_points or not self.levels:
+      return self.x[first:last], self.y[first:last]
+
+    for starts, low, high in self.levels:
+      lo = max(np.searchsorted(starts, first, side="right") - 1, 0)
+      hi = np.searchsorted(starts, last, side="left")
+      if 2 * (hi - lo) <= max_points:
+        break
+    x = np.repeat(self.x[starts[lo:hi]], 2)
+    y = np.column_stack([low[lo:hi], high[lo:hi]]).ravel()
+    return x, y
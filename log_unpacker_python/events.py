@@ -0,0 +1,397 @@
+"""Rule-based detection of analog events: droops, spikes, CC attach/detach.
+
+Rules are evaluated over whole batches of records at once, on the columns of
+columnar.ANALOG_CHANNELS (mV and mA):
+
+* Threshold: the channel above (or below) a limit;
+* Slope: the change of the channel over the last `samples` records beyond
+  `delta`, rising for a positive delta, falling for a negative one;
+* Deviation: the channel beyond `delta` from its rolling mean over the
+  previous `window` records, e.g. a VBUS droop or a current spike;
+* Transition: the channel crossing a level with hysteresis, each crossing
+  being its own event, e.g. a CC line attach (rise) or detach (fall).
+
+Consecutive triggering records form one event, kept if it lasts at least
+`min_samples` records. Windows count records (about 1 ms apart).
+
+An EventDetector keeps the last records the windows need, the events still
+running and the crossing state, so batches of a stream give the same events
+as the whole capture at once. Every event also points to the nearest PD
+messages (GoodCRC excluded) before and after its start, within
+`context_ms`.
+"""
+
+import argparse
+import collections
+import sys
+
+import numpy as np
+
+import capture
+import columnar
+import timeline
+import twinkie
+
+Threshold = collections.namedtuple(
+    "Threshold", ["name", "channel", "limit", "above", "min_samples"],
+    defaults=(True, 1),
+)
+Slope = collections.namedtuple(
+    "Slope", ["name", "channel", "delta", "samples", "min_samples"],
+    defaults=(1,),
+)
+Deviation = collections.namedtuple(
+    "Deviation", ["name", "channel", "delta", "window", "min_samples"],
+    defaults=(1,),
+)
+Transition = collections.namedtuple(
+    "Transition", ["name", "channel", "low", "high"]
+)
+
+DEFAULT_RULES = (
+    Deviation("vbus_droop", "vbus_v", -500, 50, 2),
+    Deviation("vbus_overshoot", "vbus_v", 500, 50, 2),
+    Threshold("vbus_overcurrent", "vbus_c", 5500, min_samples=2),
+    Deviation("vbus_current_spike", "vbus_c", 1000, 50),
+    Transition("cc1_attach", "cc1_v", 150, 250),
+    Transition("cc2_attach", "cc2_v", 150, 250),
+    Deviation("vconn_glitch", "cc2_c", 200, 20),
+)
+
+DEFAULT_CONTEXT_MS = 500
+
+# The peak is the extreme of the rule's measure over the event: the channel
+# value (Threshold, Transition), its change (Slope) or its deviation from
+# the rolling mean (Deviation). Direction is 1 for rising events and -1 for
+# falling ones; pd_before and pd_after are record indices, -1 if none.
+event_row = np.dtype([
+    ("rule", "u1"),
+    ("index", "<i8"),
+    ("time", "<i8"),
+    ("end_index", "<i8"),
+    ("end_time", "<i8"),
+    ("samples", "<i8"),
+    ("peak", "<i8"),
+    ("direction", "i1"),
+    ("pd_before", "<i8"),
+    ("pd_after", "<i8"),
+])
+
+_GOOD_CRC_HEADER_MASK = 0b1111 << 12 | 0b11111
+
+
+def _lookback(rule):
+  """Records before a sample a rule needs to evaluate it."""
+  if isinstance(rule, Slope):
+    return rule.samples
+  if isinstance(rule, Deviation):
+    return rule.window
+  return 0
+
+
+def _direction(rule):
+  if isinstance(rule, Threshold):
+    return 1 if rule.above else -1
+  return 1 if rule.delta > 0 else -1
+
+
+def _runs(mask):
+  """Returns the starts and stops of the runs of True of a bool array."""
+  edges = np.diff(np.r_[np.int8(0), mask.view(np.int8), np.int8(0)])
+  return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def _run_peaks(measure, starts, stops, direction):
+  """Returns the extreme of `measure` over every run, in `direction`."""
+  if not len(starts):
+    return np.empty(0, dtype=measure.dtype)
+  signed = np.r_[measure * direction, 0]
+  bounds = np.column_stack([starts, stops]).ravel()
+  return np.maximum.reduceat(signed, bounds)[::2] * direction
+
+
+class _Event:
+  """An event being detected or waiting for its next PD message."""
+
+  __slots__ = (
+      "rule", "index", "time", "end_index", "end_time", "samples", "peak",
+      "direction", "pd_before", "pd_after", "closed",
+  )
+
+  def __init__(self, rule, index, time, peak, direction, pd_before):
+    self.rule = rule
+    self.index = self.end_index = index
+    self.time = self.end_time = time
+    self.samples = 0
+    self.peak = peak
+    self.direction = direction
+    self.pd_before = pd_before
+    self.pd_after = None
+    self.closed = False
+
+  def row(self):
+    return (
+        self.rule, self.index, self.time, self.end_index, self.end_time,
+        self.samples, self.peak, self.direction, self.pd_before,
+        self.pd_after,
+    )
+
+
+def _pd_rows(records):
+  """Returns the rows of the PD records other than GoodCRC."""
+  headers = columnar.pd_header_words(records)
+  good_crc = (headers & _GOOD_CRC_HEADER_MASK) == twinkie.CtrlMesgEnum.GOOD_CRC
+  return np.flatnonzero((records["data_length"] != 0) & ~good_crc)
+
+
+class EventDetector:
+  """Streaming evaluation of event rules over the records of one capture."""
+
+  def __init__(self, rules=DEFAULT_RULES, context_ms=DEFAULT_CONTEXT_MS):
+    """Creates a detector.
+
+    Args:
+      rules: Threshold, Slope, Deviation and Transition rules.
+      context_ms: how far from an event start PD messages are looked for.
+    """
+    rules = tuple(rules)
+    for rule in rules:
+      if rule.channel not in columnar.ANALOG_CHANNELS:
+        raise ValueError(f"{rule.name}: unknown channel {rule.channel}")
+      if _lookback(rule) < 0 or (
+          not isinstance(rule, (Threshold, Transition)) and not rule.delta
+      ):
+        raise ValueError(f"{rule.name}: invalid window or delta")
+    if len({rule.name for rule in rules}) != len(rules):
+      raise ValueError("rule names must be unique")
+    self.rules = rules
+    self.context_ms = context_ms
+    self._history = {}
+    for rule in rules:
+      self._history[rule.channel] = max(
+          self._history.get(rule.channel, 0), _lookback(rule)
+      )
+    self._tails = {
+        channel: np.empty(0, dtype=np.int64) for channel in self._history
+    }
+    self._open = [None] * len(rules)
+    self._states = [-1] * len(rules)
+    self._pending = []
+    self._last_pd = (-1, 0)
+    self._batch = None
+
+  def feed(self, records, first_index=0, times=None):
+    """Evaluates the rules over the next records of the capture.
+
+    Args:
+      records: consecutive columnar.snooper_packet records.
+      first_index: index of the first record in the capture.
+      times: timeline ms of the records, their raw `time` field by default.
+
+    Returns:
+      The events completed by these records (event_row), in order of their
+      completion: an event is complete when it ended and its next PD
+      message is known.
+    """
+    if not len(records):
+      return np.empty(0, dtype=event_row)
+    times = np.asarray(records["time"] if times is None else times, np.int64)
+    indices = first_index + np.arange(len(records), dtype=np.int64)
+    pd_rows = _pd_rows(records)
+    self._batch = (indices, times, indices[pd_rows], times[pd_rows])
+
+    for k, rule in enumerate(self.rules):
+      values = records[rule.channel].astype(np.int64)
+      tail = self._tails[rule.channel]
+      if isinstance(rule, Transition):
+        self._crossings(k, rule, values)
+      else:
+        mask, measure = self._evaluate(rule, tail, values)
+        self._extend_runs(k, rule, mask, measure)
+    for channel, history in self._history.items():
+      if history:
+        values = records[channel].astype(np.int64)
+        self._tails[channel] = np.r_[self._tails[channel], values][-history:]
+
+    self._resolve_pd_after()
+    if len(pd_rows):
+      self._last_pd = (int(indices[pd_rows[-1]]), int(times[pd_rows[-1]]))
+    return self._completed()
+
+  def finish(self):
+    """Ends the running events; returns the events not returned yet."""
+    for k, event in enumerate(self._open):
+      if event is not None:
+        self._close(k, event)
+    self._open = [None] * len(self.rules)
+    for event in self._pending:
+      if event.pd_after is None:
+        event.pd_after = -1
+    return self._completed()
+
+  def _evaluate(self, rule, tail, values):
+    """Returns the trigger mask and the measure of a run rule."""
+    if isinstance(rule, Threshold):
+      mask = values > rule.limit if rule.above else values < rule.limit
+      return mask, values
+    full = np.r_[tail, values]
+    h = len(tail)
+    n = len(values)
+    # Positions whose lookback window is complete.
+    valid = np.arange(n) >= _lookback(rule) - h
+    if isinstance(rule, Slope):
+      first = max(h - rule.samples, 0)
+      previous = np.zeros(n, dtype=np.int64)
+      previous[valid] = full[first:first + np.count_nonzero(valid)]
+      measure = values - previous
+    else:
+      sums = np.r_[0, np.cumsum(full)]
+      ends = h + np.arange(n)
+      begins = np.maximum(ends - rule.window, 0)
+      baseline = (sums[ends] - sums[begins]) / rule.window
+      measure = np.rint(values - baseline).astype(np.int64)
+    mask = valid & (measure * _direction(rule) >= abs(rule.delta))
+    return mask, measure
+
+  def _new_event(self, k, i, peak, direction):
+    indices, times, pd_indices, pd_times = self._batch
+    index, time = int(indices[i]), int(times[i])
+    j = int(np.searchsorted(pd_indices, index, side="right")) - 1
+    pd_index, pd_time = (
+        (int(pd_indices[j]), int(pd_times[j])) if j >= 0 else self._last_pd
+    )
+    if pd_index < 0 or time - pd_time > self.context_ms:
+      pd_index = -1
+    event = _Event(k, index, time, int(peak), direction, pd_index)
+    self._pending.append(event)
+    return event
+
+  def _extend_runs(self, k, rule, mask, measure):
+    direction = _direction(rule)
+    starts, stops = _runs(mask)
+    peaks = _run_peaks(measure, starts, stops, direction)
+    indices, times = self._batch[:2]
+    event = self._open[k]
+    if event is not None and not (len(starts) and starts[0] == 0):
+      self._close(k, event)
+      event = None
+    for start, stop, peak in zip(starts, stops, peaks):
+      if event is None:
+        event = self._new_event(k, start, peak, direction)
+      elif (peak - event.peak) * direction > 0:
+        event.peak = int(peak)
+      event.samples += int(stop - start)
+      event.end_index = int(indices[stop - 1])
+      event.end_time = int(times[stop - 1])
+      if stop < len(mask):
+        self._close(k, event)
+        event = None
+    self._open[k] = event
+
+  def _close(self, k, event):
+    event.closed = True
+    min_samples = getattr(self.rules[k], "min_samples", 1)
+    if event.samples < min_samples:
+      self._pending.remove(event)
+
+  def _crossings(self, k, rule, values):
+    state = np.where(
+        values >= rule.high, 1, np.where(values <= rule.low, 0, -1)
+    )
+    state = np.r_[self._states[k], state]
+    # Between the levels a sample keeps the state of the one before it.
+    known = np.where(state >= 0, np.arange(len(state)), 0)
+    state = state[np.maximum.accumulate(known)]
+    changes = np.flatnonzero((state[1:] != state[:-1]) & (state[:-1] >= 0))
+    for i in changes:
+      direction = 1 if state[i + 1] else -1
+      event = self._new_event(k, i, values[i], direction)
+      event.samples = 1
+      event.closed = True
+    self._states[k] = int(state[-1])
+
+  def _resolve_pd_after(self):
+    indices, times, pd_indices, pd_times = self._batch
+    for event in self._pending:
+      if event.pd_after is not None:
+        continue
+      j = int(np.searchsorted(pd_indices, event.index, side="right"))
+      if j < len(pd_indices):
+        within = pd_times[j] - event.time <= self.context_ms
+        event.pd_after = int(pd_indices[j]) if within else -1
+      elif times[-1] - event.time > self.context_ms:
+        event.pd_after = -1
+
+  def _completed(self):
+    done = [e for e in self._pending if e.closed and e.pd_after is not None]
+    if not done:
+      return np.empty(0, dtype=event_row)
+    self._pending = [
+        e for e in self._pending if not (e.closed and e.pd_after is not None)
+    ]
+    return np.array([e.row() for e in done], dtype=event_row)
+
+
+def detect(path_str, rules=DEFAULT_RULES, context_ms=DEFAULT_CONTEXT_MS,
+           batch_records=columnar.DEFAULT_BATCH_RECORDS):
+  """Detects the events of a capture in one streaming pass.
+
+  Args:
+    path_str: path of the capture.
+    rules, context_ms: as in EventDetector.
+    batch_records: records read at a time.
+
+  Returns:
+    The event_row array of the events sorted by start, timed as by
+    timeline.timed_batches.
+  """
+  detector = EventDetector(rules, context_ms)
+  parts = []
+  for first, batch, times in timeline.timed_batches(path_str, batch_records):
+    parts.append(detector.feed(batch, first, times))
+  parts.append(detector.finish())
+  events = np.concatenate(parts)
+  return events[np.argsort(events["index"], kind="stable")]
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(
+      description="List the VBUS/CC events of a capture with their PD context."
+  )
+  parser.add_argument("capture")
+  parser.add_argument(
+      "--context", type=int, default=DEFAULT_CONTEXT_MS,
+      help="ms around an event searched for PD messages",
+  )
+  parser.add_argument(
+      "-r", "--rule", action="append",
+      help="only report these rules, e.g. -r vbus_droop",
+  )
+  args = parser.parse_args(argv)
+
+  rules = DEFAULT_RULES
+  if args.rule:
+    unknown = set(args.rule) - {rule.name for rule in rules}
+    if unknown:
+      parser.error(f"unknown rules: {', '.join(sorted(unknown))}")
+    rules = tuple(rule for rule in rules if rule.name in args.rule)
+  events = detect(args.capture, rules, args.context)
+  counts = collections.Counter()
+  with capture.Capture(args.capture) as cap:
+    for event in events:
+      rule = rules[event["rule"]]
+      counts[rule.name] += 1
+      print(
+          f"{rule.name} {'rise' if event['direction'] > 0 else 'fall'} "
+          f"records {event['index']}-{event['end_index']} "
+          f"{event['end_time'] - event['time']} ms peak {event['peak']}"
+      )
+      for label in ("pd_before", "pd_after"):
+        if event[label] >= 0:
+          print(f"  {label}: {cap[int(event[label])]}")
+  print("  ".join(f"{name} {count}" for name, count in counts.items()))
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,371 @@
+"""Convert-once export of captures to Parquet.
+
+Writes the analog channels, the packet type and PD header fields and the
+fast-path decoded data objects (data_objects.py) of every record, one row per
+record: the PDO voltage, current and power ratings of capabilities messages
+and the operating and maximum current of Requests, in mV, mA and mW. The
+layout of an RDO depends on the type of the PDO it requests, taken from the
+last Source_Capabilities before it; Requests without one get null currents.
+Enum columns are dictionary encoded with the names of the twinkie and
+data_mesg enums. The capture is streamed batch by batch, each batch becoming
+a row group whose column statistics let later reads skip row groups with
+`filters` (predicate pushdown).
+"""
+
+import argparse
+import sys
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import columnar
+import data_mesg
+import data_objects
+import pd_fields
+import timeline
+import twinkie
+
+DEFAULT_BATCH_RECORDS = 1 << 18
+
+
+def _enum_lookup(*enums):
+  """Returns the dictionary of enum names and a code -> index table per enum."""
+  names = []
+  tables = []
+  for enum in enums:
+    table = np.full(1 << 8, -1, dtype=np.int32)
+    for member in enum:
+      table[member.value] = len(names)
+      names.append(member.name)
+    tables.append(table)
+  return pa.array(names, pa.string()), tables
+
+
+_SOP_NAMES, (_SOP_TABLE,) = _enum_lookup(twinkie.SoPEnum)
+_CC_NAMES, (_CC_TABLE,) = _enum_lookup(twinkie.CCEnum)
+_REV_NAMES, (_REV_TABLE,) = _enum_lookup(twinkie.ReVerEnum)
+_PDO_NAMES, (_PDO_TABLE,) = _enum_lookup(data_mesg.PdoEnum)
+_VDM_CMD_NAMES, (_VDM_CMD_TABLE,) = _enum_lookup(data_mesg.VdmCommandEnum)
+# Indexed by pd_fields.MSG_CTRL, MSG_DATA and MSG_EXT.
+_MSG_NAMES, _MSG_TABLES = _enum_lookup(
+    twinkie.CtrlMesgEnum, twinkie.DataMesgEnum, twinkie.ExtMesgEnum
+)
+_MSG_TABLE = np.stack(_MSG_TABLES)
+
+# Layouts of an RDO, by type of the requested PDO.
+_RDO_FIX_VARIABLE, _RDO_BATTERY, _RDO_PPS, _RDO_AVS = range(4)
+
+
+def _dictionary(indices, names, mask=None):
+  """Builds a dictionary array; negative indices and `mask` become null."""
+  indices = np.asarray(indices, dtype=np.int32)
+  null = indices < 0 if mask is None else (indices < 0) | mask
+  return pa.DictionaryArray.from_arrays(
+      pa.array(indices, mask=null), names
+  )
+
+
+def _list_array(values, counts, mask):
+  """Builds a list column of the first `counts` values of every row.
+
+  Args:
+    values: 2D array, one row per record.
+    counts: number of values kept per row.
+    mask: rows holding a list, the others are null.
+
+  Returns:
+    The list offsets and the flat values.
+  """
+  counts = np.where(mask, counts, 0).astype(np.int32)
+  offsets = np.zeros(len(counts) + 1, dtype=np.int32)
+  np.cumsum(counts, out=offsets[1:])
+  keep = np.arange(values.shape[1]) < counts[:, None]
+  return offsets, values[keep]
+
+
+def _source_cap_rows(batch):
+  """Returns the mask of the Source_Capabilities messages sent on SOP."""
+  headers = columnar.pd_header_words(batch)
+  return (
+      (batch["data_length"] != 0) & (headers >> 15 == 0)
+      & (headers >> 12 & 0b111 != 0)
+      & (headers & 0b11111 == twinkie.DataMesgEnum.SRC_CAP)
+      & (batch["packet_bin"] >> 12 == twinkie.SoPEnum.SOP)
+  )
+
+
+def last_source_caps(batch, previous=None):
+  """Returns the PDOs of the last Source_Capabilities of a batch.
+
+  Args:
+    batch: array of columnar.snooper_packet records.
+    previous: the result for the batches before, returned when this one
+      holds no Source_Capabilities.
+
+  Returns:
+    A uint32 array of PDOs, or `previous`.
+  """
+  rows = np.flatnonzero(_source_cap_rows(batch))
+  if not len(rows):
+    return previous
+  row = rows[-1]
+  count = int(columnar.pd_header_words(batch)[row]) >> 12 & 0b111
+  return data_objects.data_objects(batch[row:row + 1])[0, :count].copy()
+
+
+def _pdo_ratings(objs, sink):
+  """Returns the min and max voltage (mV), max current (mA) and max power
+  (mW) of PDOs, -1 where their type has none."""
+  if sink:
+    pdo = data_objects.decode_pdo_sink(objs)
+    fixed_v = pdo["fixed_supply"]["voltage_50ma"]
+    fixed_i = pdo["fixed_supply"]["current_10ma"]
+    variable_i = pdo["variable_supply"]["current_10ma"]
+    battery_p = pdo["battery"]["power_250mw"]
+  else:
+    pdo = data_objects.decode_pdo(objs)
+    fixed_v = pdo["fixed_supply"]["voltage_50mv"]
+    fixed_i = pdo["fixed_supply"]["max_current_10ma"]
+    variable_i = pdo["variable_supply"]["max_current_10ma"]
+    battery_p = pdo["battery"]["max_power_250mw"]
+  battery, variable = pdo["battery"], pdo["variable_supply"]
+  pps, avs = pdo["apdo"]["spr_pps"], pdo["apdo"]["epr_avs"]
+  typ = pdo["pdo_typ"]
+  apdo = typ == data_mesg.PdoEnum.APDO
+  is_fixed = typ == data_mesg.PdoEnum.FIXED_SUPPLY
+  is_battery = typ == data_mesg.PdoEnum.BATTERY
+  is_variable = typ == data_mesg.PdoEnum.VARIABLE_SUPPLY
+  is_pps = apdo & (pdo["apdo"]["apdo_typ"] == data_mesg.ApdoEnum.SPR_PPS)
+  is_avs = apdo & (pdo["apdo"]["apdo_typ"] == data_mesg.ApdoEnum.EPR_AVS)
+
+  kinds = [is_fixed, is_battery, is_variable, is_pps, is_avs]
+
+  def scaled(value, unit):
+    return value.astype(np.int32) * unit
+
+  min_voltage = np.select(kinds, [
+      scaled(fixed_v, 50), scaled(battery["min_voltage_50mv"], 50),
+      scaled(variable["min_voltage_50mv"], 50),
+      scaled(pps["min_voltage_100mv"], 100),
+      scaled(avs["min_voltage_100mv"], 100),
+  ], -1)
+  max_voltage = np.select(kinds, [
+      scaled(fixed_v, 50), scaled(battery["max_voltage_50mv"], 50),
+      scaled(variable["max_voltage_50mv"], 50),
+      scaled(pps["max_voltage_100mv"], 100),
+      scaled(avs["max_voltage_100mv"], 100),
+  ], -1)
+  max_current = np.select([is_fixed, is_variable, is_pps], [
+      scaled(fixed_i, 10), scaled(variable_i, 10),
+      scaled(pps["max_current_50ma"], 50),
+  ], -1)
+  max_power = np.select([is_battery, is_avs], [
+      scaled(battery_p, 250), scaled(avs["pdp_1w"], 1000),
+  ], -1)
+  return min_voltage, max_voltage, max_current, max_power
+
+
+def _rdo_layouts(batch, objs, rows, pos, source_caps):
+  """Returns the layout of the RDO of every row of `rows`, -1 if unknown.
+
+  The RDO requests PDO `pos` of the last Source_Capabilities before it, in
+  the batch or `source_caps` (last_source_caps) before the batch.
+  """
+  caps = _source_cap_rows(batch)
+  last = np.maximum.accumulate(np.where(caps, np.arange(len(batch)), -1))[rows]
+  counts = columnar.pd_header_words(batch) >> 12 & 0b111
+  index = np.clip(pos.astype(np.intp) - 1, 0, data_objects.MAX_DATA_OBJ - 1)
+  pdo = objs[np.maximum(last, 0), index]
+  count = counts[np.maximum(last, 0)]
+  if source_caps is not None:
+    before = np.zeros(data_objects.MAX_DATA_OBJ, dtype=np.uint32)
+    before[:len(source_caps)] = source_caps
+    pdo = np.where(last < 0, before[index], pdo)
+    count = np.where(last < 0, len(source_caps), count)
+  else:
+    count = np.where(last < 0, 0, count)
+  typ = pdo >> 30
+  apdo_typ = pdo >> 28 & 0b11
+  apdo = typ == data_mesg.PdoEnum.APDO
+  layout = np.select(
+      [
+          (typ == data_mesg.PdoEnum.FIXED_SUPPLY)
+          | (typ == data_mesg.PdoEnum.VARIABLE_SUPPLY),
+          typ == data_mesg.PdoEnum.BATTERY,
+          apdo & (apdo_typ == data_mesg.ApdoEnum.SPR_PPS),
+          apdo & (apdo_typ == data_mesg.ApdoEnum.EPR_AVS),
+      ],
+      [_RDO_FIX_VARIABLE, _RDO_BATTERY, _RDO_PPS, _RDO_AVS],
+      -1,
+  )
+  return np.where((pos >= 1) & (pos <= count), layout, -1)
+
+
+def batch_table(batch, times=None, source_caps=None):
+  """Converts a batch of records to an Arrow table.
+
+  Args:
+    batch: array of columnar.snooper_packet records.
+    times: timeline ms of the batch, if known.
+    source_caps: last_source_caps() of the batches before, resolving the
+      Requests made before the first Source_Capabilities of the batch.
+
+  Returns:
+    A pyarrow.Table with one row per record.
+  """
+  fields = pd_fields.decode_records(batch)
+  no_pd = batch["data_length"] == 0
+  data_msg = ~no_pd & (fields["msg_kind"] == pd_fields.MSG_DATA)
+  msg_typ = fields["msg_typ"]
+
+  columns = {}
+  if times is not None:
+    columns["timestamp"] = pa.array(times, pa.timestamp("ms"))
+  columns["time"] = pa.array(batch["time"])
+  for name in columnar.ANALOG_CHANNELS:
+    columns[name] = pa.array(batch[name])
+  columns["sop"] = _dictionary(_SOP_TABLE[fields["sop"]], _SOP_NAMES)
+  columns["cc"] = _dictionary(_CC_TABLE[fields["cc"]], _CC_NAMES)
+  columns["packet_lost"] = pa.array(fields["packet_lost"].astype(bool))
+  columns["version"] = pa.array(fields["version"])
+  columns["data_length"] = pa.array(batch["data_length"])
+
+  columns["msg_typ"] = _dictionary(
+      _MSG_TABLE[fields["msg_kind"], msg_typ], _MSG_NAMES, no_pd
+  )
+  for name in ("extended", "num_data_obj", "msg_id", "power_role", "data_role"):
+    columns[name] = pa.array(fields[name], mask=no_pd)
+  columns["spec"] = _dictionary(_REV_TABLE[fields["spec"]], _REV_NAMES, no_pd)
+
+  objs = data_objects.data_objects(batch)
+  num_data_obj = fields["num_data_obj"]
+  offsets, flat = _list_array(objs, num_data_obj, data_msg)
+  columns["objs"] = pa.ListArray.from_arrays(
+      pa.array(offsets), pa.array(flat, pa.uint32()), mask=pa.array(~data_msg)
+  )
+
+  caps = data_msg & np.isin(
+      msg_typ, (twinkie.DataMesgEnum.SRC_CAP, twinkie.DataMesgEnum.SNK_CAP)
+  )
+  pdo_typ = data_objects.decode_pdo(objs)["pdo_typ"]
+  offsets, flat = _list_array(pdo_typ, num_data_obj, caps)
+  columns["pdo_typ"] = pa.ListArray.from_arrays(
+      pa.array(offsets),
+      _dictionary(_PDO_TABLE[flat], _PDO_NAMES),
+      mask=pa.array(~caps),
+  )
+
+  sink_caps = msg_typ == twinkie.DataMesgEnum.SNK_CAP
+  for name, source, sink in zip(
+      ("pdo_min_voltage_mv", "pdo_max_voltage_mv", "pdo_max_current_ma",
+       "pdo_max_power_mw"),
+      _pdo_ratings(objs, sink=False),
+      _pdo_ratings(objs, sink=True),
+  ):
+    values = np.where(sink_caps[:, None], sink, source)
+    offsets, flat = _list_array(values, num_data_obj, caps)
+    columns[name] = pa.ListArray.from_arrays(
+        pa.array(offsets), pa.array(flat, pa.int32(), mask=flat < 0),
+        mask=pa.array(~caps),
+    )
+
+  first = objs[:, 0]
+  request = data_msg & (msg_typ == twinkie.DataMesgEnum.REQUEST)
+  rdo = data_objects.decode_rdo(first)
+  columns["rdo_pos"] = pa.array(rdo["pos"], mask=~request)
+  rows = np.flatnonzero(request)
+  layout = np.full(len(batch), -1)
+  layout[rows] = _rdo_layouts(batch, objs, rows, rdo["pos"][rows], source_caps)
+  fix_variable = rdo["fix_variable"]
+  operating = np.select(
+      [
+          layout == _RDO_FIX_VARIABLE,
+          (layout == _RDO_PPS) | (layout == _RDO_AVS),
+      ],
+      [
+          fix_variable["current_10ma"].astype(np.int32) * 10,
+          rdo["pps"]["current_50ma"].astype(np.int32) * 50,
+      ],
+      -1,
+  )
+  maximum = np.where(
+      layout == _RDO_FIX_VARIABLE,
+      fix_variable["current_limit_10ma"].astype(np.int32) * 10, -1,
+  )
+  columns["rdo_operating_current_ma"] = pa.array(
+      operating, pa.int32(), mask=operating < 0
+  )
+  columns["rdo_max_current_ma"] = pa.array(
+      maximum, pa.int32(), mask=maximum < 0
+  )
+  vdm_msg = data_msg & (msg_typ == twinkie.DataMesgEnum.VDM)
+  vdm = data_objects.decode_vdm(first)
+  columns["vdm_vid"] = pa.array(vdm["vid"], mask=~vdm_msg)
+  columns["vdm_command"] = _dictionary(
+      _VDM_CMD_TABLE[vdm["structured"]["command"]],
+      _VDM_CMD_NAMES,
+      ~(vdm_msg & vdm["vdm_typ"]),
+  )
+  return pa.table(columns)
+
+
+def export(path_str, out_str, batch_records=DEFAULT_BATCH_RECORDS):
+  """Exports a capture to a Parquet file, one row group per batch.
+
+  Args:
+    path_str: path of the .bin or compact capture.
+    out_str: path of the Parquet file to write.
+    batch_records: records converted and written at a time.
+
+  Returns:
+    The number of rows written.
+  """
+  writer = None
+  rows = 0
+  source_caps = None
+  try:
+    for _, batch, times in timeline.timed_batches(path_str, batch_records):
+      table = batch_table(batch, times, source_caps)
+      source_caps = last_source_caps(batch, source_caps)
+      if writer is None:
+        writer = pq.ParquetWriter(out_str, table.schema)
+      writer.write_table(table)
+      rows += len(batch)
+  finally:
+    if writer is not None:
+      writer.close()
+  return rows
+
+
+def read(path_str, columns=None, filters=None):
+  """Reads an export, skipping row groups ruled out by `filters`.
+
+  Args:
+    path_str: path of the Parquet file.
+    columns: columns to read, all by default.
+    filters: pyarrow filter expression or DNF list, for example
+      [("msg_typ", "=", "REQUEST"), ("vbus_v", ">", 15000)].
+
+  Returns:
+    A pyarrow.Table.
+  """
+  return pq.read_table(path_str, columns=columns, filters=filters)
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Export a capture to Parquet.")
+  parser.add_argument("capture")
+  parser.add_argument("output")
+  parser.add_argument(
+      "--batch-records", type=int, default=DEFAULT_BATCH_RECORDS,
+      help="records per row group",
+  )
+  args = parser.parse_args(argv)
+  rows = export(args.capture, args.output, args.batch_records)
+  print(f"{args.output}: {rows} rows")
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,293 @@
+"""Streaming reassembly of chunked extended messages.
+
+An extended message (twinkie.pd_ext_header) longer than a chunk travels in
+chunks of at most MAX_CHUNK_SIZE bytes: the sender sends chunk 0, the
+receiver requests every next chunk with a chunk request (Request Chunk set),
+and the sender answers with that chunk. The Reassembler follows these
+sequences record by record, one per SOP and sender (power role, or cable
+plug for SOP'/SOP'') at a time, and returns every extended message once its
+`data_size` bytes are in, with the index and time of its first and last
+chunk. Unchunked extended messages are returned as they come.
+
+A sequence holds at most MAX_EXTENDED_SIZE bytes and there is at most one
+per sender, so memory stays bounded whatever the capture size. A sequence
+is dropped when its sender goes quiet longer than the timeout, restarts
+with another chunk 0 or skips a chunk; repeated chunks (retries) are
+ignored.
+"""
+
+import argparse
+import collections
+import sys
+
+import numpy as np
+
+import columnar
+import crc
+import timeline
+import twinkie
+
+# Revision 3.1 Version 1.8 6.2.1.2 Extended Message Header.
+MAX_CHUNK_SIZE = 26
+MAX_EXTENDED_SIZE = 260
+
+# Far above tChunkSenderResponse (30 ms): the log timer stamps the time the
+# host stored the record, not the time it was on the wire.
+DEFAULT_TIMEOUT_MS = 100
+
+_EXT_HEADER_OFFSET = 2
+_PAYLOAD_OFFSET = 4
+_CHUNKED_SOPS = (
+    twinkie.SoPEnum.SOP, twinkie.SoPEnum.SOP_, twinkie.SoPEnum.SOP__,
+)
+
+ExtendedMessage = collections.namedtuple(
+    "ExtendedMessage",
+    [
+        "index",  # record of the first chunk
+        "time",
+        "end_index",  # record of the last chunk
+        "end_time",
+        "sop",
+        "power_role",  # power role, or cable plug for SOP'/SOP''
+        "msg_typ",  # twinkie.ExtMesgEnum value
+        "chunks",  # 0 for an unchunked message
+        "payload",  # the data_size bytes of the message
+    ],
+)
+
+
+class _Sequence:
+  """A chunked message being received."""
+
+  __slots__ = (
+      "msg_typ", "data_size", "payload", "next_chunk", "index", "time",
+      "last_time",
+  )
+
+  def __init__(self, msg_typ, data_size, index, time):
+    self.msg_typ = msg_typ
+    self.data_size = data_size
+    self.payload = bytearray()
+    self.next_chunk = 0
+    self.index = index
+    self.time = time
+    self.last_time = time
+
+
+def chunk_size(data_size, chunk_number):
+  """Returns the payload bytes of a chunk of a `data_size` byte message."""
+  return min(MAX_CHUNK_SIZE, data_size - MAX_CHUNK_SIZE * chunk_number)
+
+
+class Reassembler:
+  """Streaming reassembler of the extended messages of one capture.
+
+  `counts` tallies what happened to the extended records: complete and
+  unchunked messages, chunk requests, duplicate chunks, sequences dropped
+  on timeout, restart or skipped chunk ("aborted"), chunks of no sequence
+  ("orphan"), malformed records ("invalid"), records failing their CRC and
+  sequences left unfinished by finish().
+  """
+
+  def __init__(self, timeout_ms=DEFAULT_TIMEOUT_MS, check_crc=False):
+    """Creates a reassembler.
+
+    Args:
+      timeout_ms: silence of a sender after which its sequence is dropped.
+      check_crc: ignore, and count as `bad_crc`, the records failing their
+        CRC (crc.valid_mask); logged captures cannot be verified (crc.py),
+        so only for device packets.
+    """
+    self.timeout_ms = timeout_ms
+    self.check_crc = check_crc
+    self.counts = collections.Counter()
+    self._in_flight = {}
+
+  def feed(self, records, first_index=0, times=None):
+    """Processes the next records of the capture.
+
+    Args:
+      records: consecutive columnar.snooper_packet records.
+      first_index: index of the first record in the capture.
+      times: timeline ms of the records, their raw `time` field by default.
+
+    Returns:
+      The ExtendedMessages completed by these records, in order.
+    """
+    times = np.asarray(records["time"] if times is None else times, np.int64)
+    headers = columnar.pd_header_words(records)
+    sops = records["packet_bin"] >> 12
+    rows = np.flatnonzero(
+        (records["data_length"] != 0) & (headers >> 15 != 0)
+        & np.isin(sops, _CHUNKED_SOPS)
+    )
+    if self.check_crc and len(rows):
+      valid = crc.valid_mask(records[rows])
+      self.counts["bad_crc"] += int(np.count_nonzero(~valid))
+      rows = rows[valid]
+
+    done = []
+    data = records["data"]
+    for row in rows:
+      time = int(times[row])
+      self._expire(time)
+      header = int(headers[row])
+      length = int(records["data_length"][row])
+      message = self._record(
+          first_index + int(row), time, int(sops[row]), header >> 8 & 1,
+          header & 0b11111,
+          int(data[row, _EXT_HEADER_OFFSET])
+          | int(data[row, _EXT_HEADER_OFFSET + 1]) << 8,
+          data[row, _PAYLOAD_OFFSET:max(length, _PAYLOAD_OFFSET)].tobytes(),
+      )
+      if message is not None:
+        done.append(message)
+    if len(times):
+      self._expire(int(times[-1]))
+    return done
+
+  def finish(self):
+    """Drops the sequences still in flight at the end of the capture."""
+    if self._in_flight:
+      self.counts["unfinished"] += len(self._in_flight)
+      self._in_flight.clear()
+
+  def _expire(self, now):
+    for key, sequence in list(self._in_flight.items()):
+      if now - sequence.last_time > self.timeout_ms:
+        del self._in_flight[key]
+        self.counts["timeout"] += 1
+
+  def _record(self, index, time, sop, power_role, msg_typ, ext_header,
+              payload):
+    """Processes one extended record; returns the message it completes."""
+    chunked = ext_header >> 15
+    chunk_number = ext_header >> 11 & 0b1111
+    request_chunk = ext_header >> 10 & 1
+    data_size = ext_header & 0x1FF
+
+    if not chunked:
+      if data_size > len(payload):
+        self.counts["invalid"] += 1
+        return None
+      self.counts["unchunked"] += 1
+      return ExtendedMessage(
+          index, time, index, time, sop, power_role, msg_typ, 0,
+          payload[:data_size],
+      )
+
+    if request_chunk:
+      self.counts["chunk_requests"] += 1
+      # Sent by the receiver: keeps the sender's sequence alive.
+      sequence = self._in_flight.get((sop, 1 - power_role))
+      if sequence is not None and sequence.msg_typ == msg_typ:
+        sequence.last_time = time
+      return None
+
+    size = chunk_size(data_size, chunk_number)
+    if not 0 < data_size <= MAX_EXTENDED_SIZE or size <= 0 or (
+        len(payload) < size
+    ):
+      self.counts["invalid"] += 1
+      return None
+
+    key = (sop, power_role)
+    sequence = self._in_flight.get(key)
+    if sequence is not None and (
+        chunk_number == sequence.next_chunk - 1
+        and sequence.msg_typ == msg_typ
+        and sequence.data_size == data_size
+    ):
+      self.counts["duplicate"] += 1
+      sequence.last_time = time
+      return None
+    if chunk_number == 0:
+      if sequence is not None:
+        self.counts["aborted"] += 1
+      sequence = _Sequence(msg_typ, data_size, index, time)
+      self._in_flight[key] = sequence
+    elif sequence is None or sequence.msg_typ != msg_typ or (
+        sequence.data_size != data_size
+    ):
+      self.counts["orphan"] += 1
+      return None
+    elif chunk_number != sequence.next_chunk:
+      del self._in_flight[key]
+      self.counts["aborted"] += 1
+      return None
+
+    sequence.payload += payload[:size]
+    sequence.next_chunk += 1
+    sequence.last_time = time
+    if len(sequence.payload) < data_size:
+      return None
+    del self._in_flight[key]
+    self.counts["complete"] += 1
+    return ExtendedMessage(
+        sequence.index, sequence.time, index, time, sop, power_role, msg_typ,
+        sequence.next_chunk, bytes(sequence.payload),
+    )
+
+
+def reassemble(path_str, reassembler=None,
+               batch_records=columnar.DEFAULT_BATCH_RECORDS):
+  """Yields the extended messages of a capture in one streaming pass.
+
+  Args:
+    path_str: path of the capture.
+    reassembler: Reassembler to use, e.g. to read its counts afterwards; a
+      new one by default.
+    batch_records: records read at a time.
+
+  Yields:
+    ExtendedMessages, timed as by timeline.timed_batches.
+  """
+  reassembler = reassembler or Reassembler()
+  for first, batch, times in timeline.timed_batches(path_str, batch_records):
+    yield from reassembler.feed(batch, first, times)
+  reassembler.finish()
+
+
+def _type_name(msg_typ):
+  try:
+    return twinkie.ExtMesgEnum(msg_typ).name
+  except ValueError:
+    return f"RESERVED_{msg_typ}"
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(
+      description="Print the reassembled extended messages of a capture."
+  )
+  parser.add_argument("capture")
+  parser.add_argument(
+      "--timeout", type=int, default=DEFAULT_TIMEOUT_MS,
+      help="ms of silence dropping a chunked sequence",
+  )
+  parser.add_argument(
+      "--check-crc", action="store_true",
+      help="ignore the records failing their CRC",
+  )
+  parser.add_argument(
+      "-q", "--quiet", action="store_true", help="only print the counts"
+  )
+  args = parser.parse_args(argv)
+
+  reassembler = Reassembler(args.timeout, args.check_crc)
+  types = collections.Counter()
+  for m in reassemble(args.capture, reassembler):
+    types[_type_name(m.msg_typ)] += 1
+    if not args.quiet:
+      print(
+          f"{m.index}-{m.end_index} {twinkie.SoPEnum(m.sop).name} "
+          f"{_type_name(m.msg_typ)} {len(m.payload)} bytes "
+          f"{m.chunks} chunks {m.end_time - m.time} ms {m.payload.hex()}"
+      )
+  print("  ".join(f"{k} {v}" for k, v in sorted(types.items())))
+  print("  ".join(f"{k} {v}" for k, v in sorted(reassembler.counts.items())))
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
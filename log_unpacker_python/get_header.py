@@ -1,5 +1,4 @@
 import struct
-from pathlib import Path
 
 ctrl_msg_str = [
 	"",
@@ -166,7 +165,10 @@ class twinkie_header:
 		return format_time_num(self.time) + f', CC1 = {self.cc1_v}, CC2 = {self.cc2_v}, VBUS voltage = {self.vbus_v}, VBUS current = {self.vbus_c}'
 
 def get_header_list(path_str):
-	data = Path(path_str).read_bytes()
+	# Imported here: compact imports get_header through columnar and profiling.
+	import compact
+
+	data = compact.raw_bytes(path_str)
 	head = []
 	pd = []
 
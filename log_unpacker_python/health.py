@@ -0,0 +1,310 @@
+"""Capture health: lost packets, timestamp gaps and effective sample rate.
+
+Twinkie sets the Packet_Lost flag of the packet type word (twinkie_typ) when
+packets were dropped before the one it sends, and records lost because the
+snooper_stream ring buffer (20 slots) overflowed leave gaps in the log_file()
+millisecond timer. A HealthAnalyzer accounts for both in one vectorized pass
+over the batches of a capture:
+
+* records, duration and effective sample rate;
+* Packet_Lost flags, and on request the records failing their CRC;
+* the exact histogram of the intervals between records, from which the
+  nominal interval (the median), the gaps (intervals over `gap_factor`
+  nominal intervals) and the records they miss are derived;
+* the largest gaps and the seconds holding the fewest records;
+* timer steps backwards (host clock adjustments).
+
+A capture whose loss ratio exceeds `max_loss` is reported as not trusted for
+timing analysis.
+"""
+
+import argparse
+import collections
+import json
+import pathlib
+import sys
+
+import numpy as np
+
+import columnar
+import crc
+import pd_fields
+import session
+import timeline
+
+DEFAULT_GAP_FACTOR = 2.0
+DEFAULT_MAX_LOSS = 0.01
+DEFAULT_WORST = 10
+
+# Intervals are counted exactly up to this many ms, the longer ones together.
+MAX_TRACKED_MS = 1 << 16
+
+HealthReport = collections.namedtuple(
+    "HealthReport",
+    [
+        "records",
+        "duration_ms",
+        "sample_rate_hz",  # records per second over the duration
+        "nominal_ms",  # median interval between records
+        "lost_flags",  # records carrying Packet_Lost
+        "bad_crc",  # 0 without check_crc
+        "backwards",  # intervals < 0
+        "gaps",  # intervals > gap_factor * nominal_ms
+        "gap_ms",  # time spent in gaps beyond the nominal interval
+        "missing_records",  # estimated records lost in the gaps
+        "loss_ratio",  # (lost_flags + missing) / (records + missing)
+        "trusted",  # loss_ratio <= max_loss
+        "gap_histogram",  # [(low_ms, high_ms, count)], power of two bins
+        "worst_gaps",  # [(index, time, interval_ms)], largest first
+        "worst_seconds",  # [(time, records)], fewest first
+    ],
+)
+
+
+class HealthAnalyzer:
+  """Streaming health accounting of the records of one capture."""
+
+  def __init__(self, gap_factor=DEFAULT_GAP_FACTOR, max_loss=DEFAULT_MAX_LOSS,
+               worst=DEFAULT_WORST, check_crc=False):
+    """Creates an analyzer.
+
+    Args:
+      gap_factor: intervals longer than this many nominal intervals are gaps.
+      max_loss: highest loss ratio of a trusted capture.
+      worst: number of worst gaps and seconds reported.
+      check_crc: also count the records failing their CRC (crc.valid_mask);
+        logged captures cannot be verified (crc.py), so only for device
+        packets.
+    """
+    self.gap_factor = gap_factor
+    self.max_loss = max_loss
+    self.worst = worst
+    self.check_crc = check_crc
+    self._records = 0
+    self._first_time = None
+    self._last = None
+    self._lost = 0
+    self._bad_crc = 0
+    self._intervals = np.zeros(MAX_TRACKED_MS + 1, dtype=np.int64)
+    self._overflow_ms = 0
+    self._backwards = 0
+    self._worst_gaps = np.empty(0, dtype=[
+        ("index", "<i8"), ("time", "<i8"), ("interval", "<i8"),
+    ])
+    self._seconds = collections.Counter()
+
+  def feed(self, records, first_index=0, times=None):
+    """Accounts for the next records of the capture.
+
+    Args:
+      records: consecutive columnar.snooper_packet records.
+      first_index: index of the first record in the capture.
+      times: timeline ms of the records, their raw `time` field by default.
+    """
+    if not len(records):
+      return
+    times = np.asarray(records["time"] if times is None else times, np.int64)
+    self._records += len(records)
+    lost = pd_fields.decode_packet_type(records["packet_bin"])["packet_lost"]
+    self._lost += int(np.count_nonzero(lost))
+    if self.check_crc:
+      self._bad_crc += int(np.count_nonzero(~crc.valid_mask(records)))
+
+    if self._last is None:
+      self._first_time = int(times[0])
+      previous = times[:1]
+    else:
+      previous = np.array([self._last[1]], dtype=np.int64)
+    # Interval i ends at record i of the batch.
+    intervals = np.diff(np.r_[previous, times])
+    if self._last is None:
+      intervals = intervals[1:]
+      ends = np.arange(1, len(records))
+    else:
+      ends = np.arange(len(records))
+    self._last = (first_index + len(records) - 1, int(times[-1]))
+
+    self._backwards += int(np.count_nonzero(intervals < 0))
+    forward = intervals[intervals >= 0]
+    self._intervals += np.bincount(
+        np.minimum(forward, MAX_TRACKED_MS), minlength=MAX_TRACKED_MS + 1
+    )
+    self._overflow_ms += int(forward[forward >= MAX_TRACKED_MS].sum())
+
+    self._keep_worst_gaps(first_index + ends, times[ends], intervals)
+    seconds, counts = np.unique(times // 1000, return_counts=True)
+    self._seconds.update(dict(zip(seconds.tolist(), counts.tolist())))
+
+  def _keep_worst_gaps(self, indices, times, intervals):
+    if len(intervals) > self.worst:
+      top = np.argpartition(intervals, -self.worst)[-self.worst:]
+    else:
+      top = np.arange(len(intervals))
+    candidates = np.empty(len(top), dtype=self._worst_gaps.dtype)
+    candidates["index"] = indices[top]
+    candidates["time"] = times[top]
+    candidates["interval"] = intervals[top]
+    merged = np.r_[self._worst_gaps, candidates]
+    order = np.argsort(-merged["interval"], kind="stable")
+    self._worst_gaps = merged[order[:self.worst]]
+
+  def _nominal_ms(self):
+    """Median interval; the mean one if most records share a timestamp."""
+    total = int(self._intervals.sum())
+    if not total:
+      return 0.0
+    median = int(np.searchsorted(np.cumsum(self._intervals), (total + 1) / 2))
+    if median:
+      return float(median)
+    duration = self._last[1] - self._first_time
+    return max(duration, 0) / total
+
+  def _histogram(self):
+    rows = []
+    if self._intervals[0]:
+      rows.append((0, 0, int(self._intervals[0])))
+    low = 1
+    while low <= MAX_TRACKED_MS:
+      high = min(2 * low - 1, MAX_TRACKED_MS)
+      count = int(self._intervals[low:high + 1].sum())
+      if count:
+        rows.append((low, high, count))
+      low *= 2
+    return rows
+
+  def _worst_seconds(self):
+    if len(self._seconds) < 3:
+      return []
+    first, last = min(self._seconds), max(self._seconds)
+    # The first and last seconds are partial.
+    seconds = np.arange(first + 1, last)
+    counts = np.array([self._seconds.get(s, 0) for s in seconds.tolist()])
+    order = np.argsort(counts, kind="stable")[:self.worst]
+    return [(int(seconds[i]) * 1000, int(counts[i])) for i in order]
+
+  def finish(self):
+    """Returns the HealthReport of the records fed so far."""
+    nominal = self._nominal_ms()
+    gaps = gap_ms = 0
+    missing = 0.0
+    worst_gaps = self._worst_gaps[:0]
+    if nominal > 0:
+      lengths = np.arange(MAX_TRACKED_MS + 1)
+      is_gap = lengths > self.gap_factor * nominal
+      counts = self._intervals[is_gap]
+      # The last bin holds every longer interval, counted by _overflow_ms.
+      spans = lengths[is_gap] * counts
+      if is_gap[-1]:
+        spans[-1] = self._overflow_ms
+      gaps = int(counts.sum())
+      gap_ms = int(spans.sum() - nominal * gaps)
+      missing = max(gap_ms / nominal, 0.0)
+      worst_gaps = self._worst_gaps[
+          self._worst_gaps["interval"] > self.gap_factor * nominal
+      ]
+    missing = int(round(missing))
+    records = self._records
+    duration = self._last[1] - self._first_time if records else 0
+    loss = (self._lost + missing) / (records + missing) if records else 0.0
+    return HealthReport(
+        records=records,
+        duration_ms=int(duration),
+        sample_rate_hz=(records - 1) * 1000 / duration if duration > 0 else 0.0,
+        nominal_ms=nominal,
+        lost_flags=self._lost,
+        bad_crc=self._bad_crc,
+        backwards=self._backwards,
+        gaps=gaps,
+        gap_ms=gap_ms,
+        missing_records=missing,
+        loss_ratio=loss,
+        trusted=loss <= self.max_loss,
+        gap_histogram=self._histogram(),
+        worst_gaps=[
+            (int(index), int(time - interval), int(interval))
+            for index, time, interval in worst_gaps
+        ],
+        worst_seconds=self._worst_seconds(),
+    )
+
+
+def analyze(path_str, analyzer=None,
+            batch_records=columnar.DEFAULT_BATCH_RECORDS):
+  """Returns the HealthReport of a capture, read in one streaming pass.
+
+  Args:
+    path_str: path of the capture.
+    analyzer: HealthAnalyzer to use, e.g. with other limits; a new one by
+      default.
+    batch_records: records read at a time.
+
+  Returns:
+    A HealthReport, timed as by timeline.timed_batches.
+  """
+  analyzer = analyzer or HealthAnalyzer()
+  for first, batch, times in timeline.timed_batches(path_str, batch_records):
+    analyzer.feed(batch, first, times)
+  return analyzer.finish()
+
+
+def _format(path, report):
+  lines = [
+      f"{path}: {'trusted' if report.trusted else 'NOT TRUSTED'}, "
+      f"loss {report.loss_ratio:.3%}",
+      f"  records {report.records}  duration {report.duration_ms / 1000:.1f} s"
+      f"  rate {report.sample_rate_hz:.1f} Hz"
+      f"  nominal interval {report.nominal_ms:g} ms",
+      f"  lost flags {report.lost_flags}  bad CRC {report.bad_crc}"
+      f"  backwards {report.backwards}",
+      f"  gaps {report.gaps} ({report.gap_ms} ms)"
+      f"  missing records ~{report.missing_records}",
+      "  intervals: " + "  ".join(
+          f"{low}-{high} ms: {count}" if high > low else f"{low} ms: {count}"
+          for low, high, count in report.gap_histogram
+      ),
+  ]
+  for index, time, interval in report.worst_gaps:
+    lines.append(f"  gap {interval} ms before record {index} at {time}")
+  for time, records in report.worst_seconds[:3]:
+    lines.append(f"  second at {time}: {records} records")
+  return "\n".join(lines)
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(
+      description="Report lost packets, gaps and sample rate of captures."
+  )
+  parser.add_argument("paths", nargs="+", help="captures or session dirs")
+  parser.add_argument("--gap-factor", type=float, default=DEFAULT_GAP_FACTOR)
+  parser.add_argument("--max-loss", type=float, default=DEFAULT_MAX_LOSS)
+  parser.add_argument(
+      "--check-crc", action="store_true",
+      help="count the records failing their CRC",
+  )
+  parser.add_argument("--json", action="store_true", help="print JSON")
+  args = parser.parse_args(argv)
+
+  paths = []
+  for path in args.paths:
+    if pathlib.Path(path).is_dir():
+      paths.extend(session.list_captures(path))
+    else:
+      paths.append(path)
+  reports = {}
+  untrusted = 0
+  for path in paths:
+    report = analyze(path, HealthAnalyzer(
+        args.gap_factor, args.max_loss, check_crc=args.check_crc
+    ))
+    untrusted += not report.trusted
+    if args.json:
+      reports[str(path)] = report._asdict()
+    else:
+      print(_format(path, report))
+  if args.json:
+    print(json.dumps(reports, indent=2))
+  return 1 if untrusted else 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -1,16 +1,52 @@
 import matplotlib.pyplot as plt
+import matplotlib.ticker
 import sys
-from get_header import *
+from get_header import format_time_num
+import columnar
+import decimate
+import session
+import timeline
 
-(header, pd_msg) = get_header_list(sys.argv[1])
-xval = []
-xticks = []
-for i in range(len(header)):
-	if (i % 2000 == 0):
-		xval.append(header[i].time)
-		xticks.append(format_time_num(header[i].time))
+col = columnar.read_columns(sys.argv[1])
+# The log_file() timer restarts every month: plot on the absolute timeline
+# when the file name gives the capture start.
+start = session.capture_start(sys.argv[1])
+time = col["time"]
+if start is not None:
+	time = timeline.absolute_times(time, start)
 
-plt.xticks(xval, xticks)
-plt.plot([x.time for x in header],[x.vbus_v for x in header])
-plt.plot([x.time for x in header],[x.vbus_c for x in header])
+# (axes row, channel, label)
+channels = [
+	(0, "vbus_v", "VBUS voltage"),
+	(0, "cc1_v", "CC1 voltage"),
+	(0, "cc2_v", "CC2 voltage"),
+	(1, "vbus_c", "VBUS current"),
+	(1, "cc2_c", "VCONN current"),
+]
+
+fig, axes = plt.subplots(2, 1, sharex=True)
+lines = []
+for row, name, label in channels:
+	pyramid = decimate.MinMaxPyramid(time, col[name])
+	(line,) = axes[row].plot([], [], label=label)
+	lines.append((pyramid, line))
+
+def redraw(ax):
+	xmin, xmax = ax.get_xlim()
+	max_points = 2 * int(ax.bbox.width)
+	for pyramid, line in lines:
+		line.set_data(*pyramid.view(xmin, xmax, max_points))
+	fig.canvas.draw_idle()
+
+for ax in axes:
+	ax.legend(loc="upper right")
+axes[1].xaxis.set_major_formatter(
+	matplotlib.ticker.FuncFormatter(lambda x, pos: format_time_num(x)))
+if len(time):
+	axes[0].set_xlim(time[0], time[-1])
+	for row, ax in enumerate(axes):
+		top = max(col[name].max() for r, name, label in channels if r == row)
+		ax.set_ylim(0, top * 1.05 + 1)
+redraw(axes[0])
+axes[0].callbacks.connect("xlim_changed", redraw)
 plt.show()
@@ -0,0 +1,177 @@
+"""Content-addressed memoization of decoded PD payloads.
+
+Captures repeat the same few messages over and over: GoodCRC, the
+Source_Capabilities re-sent every few seconds, the same Request. A
+PayloadCache decodes a payload once per (SOP, raw payload bytes) and returns
+the decoded result of every later copy from a bounded LRU cache.
+
+Cached results are shared by every caller: treat them as read-only.
+"""
+
+import collections
+import functools
+import struct
+import threading
+
+import construct as ct
+
+import columnar
+import data_mesg
+import profiling
+import twinkie
+import util
+
+DEFAULT_MAXSIZE = 4096
+
+_pd = util.LazyCompiled(twinkie.pd, "pd", twinkie.__file__, data_mesg.__file__)
+
+# Header fields of struct SnooperPacket before the payload.
+_RECORD_HEADER = struct.Struct("<IHHHHHHHH")
+
+
+def _sop_name(sop):
+  try:
+    return twinkie.SoPEnum(sop).name
+  except ValueError:
+    return sop
+
+
+@functools.lru_cache(maxsize=None)
+def packet_type(word):
+  """Returns the twinkie.twinkie_typ container of a packet_bin word."""
+  return twinkie.twinkie_typ.parse(struct.pack("<H", word))
+
+
+def decode_pd(sop, payload):
+  """Parses a PD payload with twinkie.pd, as twinkie.twinkie does.
+
+  Bytes past the payload, which twinkie.twinkie would read from the rest of
+  the record, are taken as zeros.
+  """
+  payload = bytes(payload).ljust(columnar.SNOOPER_MAX_DATA_SIZE, b"\0")
+  return _pd.parse(payload, packet_bin=ct.Container(SOP=_sop_name(sop)))
+
+
+CacheStats = collections.namedtuple(
+    "CacheStats", ["hits", "misses", "evictions", "size", "maxsize"]
+)
+
+
+class PayloadCache:
+  """Thread-safe LRU cache of decoded PD payloads."""
+
+  def __init__(self, maxsize=DEFAULT_MAXSIZE, decode=decode_pd):
+    """Creates an empty cache.
+
+    Args:
+      maxsize: number of payloads kept; the least recently used one is
+        evicted past it.
+      decode: function(sop, payload) decoding a missing payload, e.g. a
+        fast path returning arrays instead of construct containers.
+    """
+    if maxsize < 1:
+      raise ValueError("maxsize must be positive")
+    self.maxsize = maxsize
+    self._decode = decode
+    self._entries = collections.OrderedDict()
+    self._lock = threading.Lock()
+    self._hits = 0
+    self._misses = 0
+    self._evictions = 0
+
+  def get(self, sop, payload):
+    """Returns the decoded payload, decoding it on a miss.
+
+    A payload failing to decode raises its construct error again on every
+    copy without being decoded again: a new error of the same type and
+    arguments, so that no traceback is kept alive or grows in the cache.
+
+    Args:
+      sop: SOP of the packet (twinkie.SoPEnum value).
+      payload: raw PD payload, the first `data_length` bytes of `data`.
+    """
+    key = (sop, bytes(payload))
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is not None:
+        self._entries.move_to_end(key)
+        self._hits += 1
+    if entry is not None:
+      profiling.count("pd_cache.hit")
+    else:
+      profiling.count("pd_cache.miss")
+      # Decoded outside the lock: a concurrent miss of the same payload
+      # decodes it twice rather than serializing every miss.
+      error = None
+      try:
+        entry = (self._decode(sop, key[1]), None)
+      except ct.ConstructError as e:
+        error = e
+        entry = (None, (type(e), e.args))
+      with self._lock:
+        self._misses += 1
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+          self._entries.popitem(last=False)
+          self._evictions += 1
+      if error is not None:
+        raise error
+    value, error = entry
+    if error is not None:
+      error_type, args = error
+      raise error_type(*args)
+    return value
+
+  def stats(self):
+    with self._lock:
+      return CacheStats(
+          self._hits, self._misses, self._evictions, len(self._entries),
+          self.maxsize,
+      )
+
+  def hit_rate(self):
+    stats = self.stats()
+    total = stats.hits + stats.misses
+    return stats.hits / total if total else 0.0
+
+  def clear(self):
+    """Drops every entry and resets the statistics."""
+    with self._lock:
+      self._entries.clear()
+      self._hits = self._misses = self._evictions = 0
+
+
+# Shared by the functions of this module unless given another cache.
+pd_cache = PayloadCache()
+
+
+def parse_record(data, cache=None):
+  """Parses a record like twinkie.twinkie.parse, the PD part through a cache.
+
+  Args:
+    data: the 512 bytes of a record.
+    cache: PayloadCache to use, `pd_cache` by default.
+
+  Returns:
+    A Container with the fields of twinkie.twinkie.
+  """
+  cache = cache or pd_cache
+  (time, cc1_v, cc2_v, cc2_c, vbus_v, vbus_c, packet_bin, data_length,
+   _) = _RECORD_HEADER.unpack_from(data)
+  packet = packet_type(packet_bin)
+  pd = None
+  if data_length:
+    offset = _RECORD_HEADER.size
+    pd = cache.get(packet_bin >> 12, data[offset:offset + data_length])
+  return ct.Container(
+      time=time,
+      cc1_v=cc1_v,
+      cc2_v=cc2_v,
+      cc2_c=cc2_c,
+      vbus_v=vbus_v,
+      vbus_c=vbus_c,
+      packet_bin=packet,
+      data_length=data_length,
+      pd=pd,
+  )
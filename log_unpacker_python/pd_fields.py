@@ -0,0 +1,93 @@
+"""Vectorized decoding of the packet type word and the PD message header.
+
+Array counterparts of twinkie.twinkie_typ and twinkie.pd_header: each decoder
+takes a whole column of raw 16-bit words and returns one array per field.
+"""
+
+import numpy as np
+
+import columnar
+import profiling
+
+# Message kinds, selecting which enum msg_typ is read with.
+MSG_CTRL = 0
+MSG_DATA = 1
+MSG_EXT = 2
+
+
+def decode_packet_type(words):
+  """Splits packet type words (twinkie.twinkie_typ) into field arrays.
+
+  Args:
+    words: array of raw `packet_bin` words.
+
+  Returns:
+    A dict of uint8 arrays keyed sop, version, partial, packet_lost and cc.
+  """
+  words = np.asarray(words, dtype=np.uint16)
+  return {
+      "sop": ((words >> 12) & 0b1111).astype(np.uint8),
+      "version": ((words >> 8) & 0b1111).astype(np.uint8),
+      "partial": ((words >> 7) & 0b1).astype(np.uint8),
+      "packet_lost": ((words >> 6) & 0b1).astype(np.uint8),
+      "cc": ((words >> 4) & 0b11).astype(np.uint8),
+  }
+
+
+def decode_pd_header(headers):
+  """Splits PD message headers (twinkie.pd_header) into field arrays.
+
+  `power_role` holds the Cable Plug bit for SOP'/SOP'' messages and
+  `data_role` is reserved for them, as in twinkie.pd_header.
+
+  Args:
+    headers: array of raw 16-bit PD message headers.
+
+  Returns:
+    A dict of uint8 arrays keyed extended, num_data_obj, msg_id, power_role,
+    spec, data_role, msg_typ and msg_kind (MSG_CTRL, MSG_DATA or MSG_EXT).
+  """
+  headers = np.asarray(headers, dtype=np.uint16)
+  extended = (headers >> 15).astype(np.uint8)
+  num_data_obj = ((headers >> 12) & 0b111).astype(np.uint8)
+  msg_kind = np.where(
+      extended != 0, MSG_EXT, np.where(num_data_obj != 0, MSG_DATA, MSG_CTRL)
+  ).astype(np.uint8)
+  return {
+      "extended": extended,
+      "num_data_obj": num_data_obj,
+      "msg_id": ((headers >> 9) & 0b111).astype(np.uint8),
+      "power_role": ((headers >> 8) & 0b1).astype(np.uint8),
+      "spec": ((headers >> 6) & 0b11).astype(np.uint8),
+      "data_role": ((headers >> 5) & 0b1).astype(np.uint8),
+      "msg_typ": (headers & 0b11111).astype(np.uint8),
+      "msg_kind": msg_kind,
+  }
+
+
+def packed_role(fields):
+  """Packs the role and spec fields the way get_header.pd_packet_header does."""
+  return (
+      (fields["power_role"] << 3) | (fields["spec"] << 1) | fields["data_role"]
+  )
+
+
+def decode_records(records):
+  """Decodes the packet type and PD header fields of a record array.
+
+  PD header fields are only meaningful where `data_length` is not zero.
+
+  Args:
+    records: array of columnar.snooper_packet records.
+
+  Returns:
+    The merged dicts of decode_packet_type and decode_pd_header.
+  """
+  with profiling.stage(
+      "unpack.decode_records",
+      len(records),
+      len(records) * columnar.SNOOPER_PACKET_SIZE,
+  ):
+    fields = decode_packet_type(records["packet_bin"])
+    fields.update(decode_pd_header(columnar.pd_header_words(records)))
+  return fields
@@ -0,0 +1,160 @@
+"""Persistent sidecar index of the PD-bearing records of a capture.
+
+Most records are analog-only samples with `data_length == 0`. The index keeps
+one small row per PD record so tools listing PD traffic do not rescan the
+capture. It is stored next to the capture as `<capture>.pdidx.npz` and is
+rebuilt whenever the capture size or mtime no longer match.
+
+`crc_ok` is only checked on request (check_crc): logged captures cannot be
+verified against the device CRC (crc.py), so by default every row has it
+True.
+"""
+
+import os
+import pathlib
+
+import numpy as np
+
+import columnar
+import crc
+import get_header
+import pd_fields
+import profiling
+
+INDEX_SUFFIX = ".pdidx.npz"
+INDEX_VERSION = 3
+
+pd_index_entry = np.dtype([
+    ("offset", "<u8"),
+    ("time", "<u4"),
+    ("sop", "u1"),
+    ("cc_line", "u1"),
+    ("msg_typ", "u1"),
+    ("role", "u1"),
+    ("msg_id", "u1"),
+    ("extended", "?"),
+    ("num_data_obj", "u1"),
+    ("crc_ok", "?"),
+])
+
+
+def index_path(path_str):
+  """Returns the sidecar path of a capture."""
+  path = pathlib.Path(path_str)
+  return path.with_name(path.name + INDEX_SUFFIX)
+
+
+def _signature(path, check_crc):
+  st = path.stat()
+  return np.array(
+      [INDEX_VERSION, st.st_size, st.st_mtime_ns, check_crc], dtype="<i8"
+  )
+
+
+def _entries(batch, first_offset, check_crc):
+  """Returns the index rows of the PD records of one batch."""
+  where = np.flatnonzero(batch["data_length"])
+  pd_records = batch[where]
+  fields = pd_fields.decode_records(pd_records)
+
+  entries = np.empty(len(where), dtype=pd_index_entry)
+  entries["offset"] = first_offset + where * columnar.SNOOPER_PACKET_SIZE
+  entries["time"] = pd_records["time"]
+  entries["sop"] = fields["sop"]
+  entries["cc_line"] = fields["cc"]
+  entries["msg_typ"] = fields["msg_typ"]
+  entries["role"] = pd_fields.packed_role(fields)
+  entries["msg_id"] = fields["msg_id"]
+  entries["extended"] = fields["extended"]
+  entries["num_data_obj"] = fields["num_data_obj"]
+  entries["crc_ok"] = crc.valid_mask(pd_records) if check_crc else True
+  return entries
+
+
+def build_index(path_str, batch_records=columnar.DEFAULT_BATCH_RECORDS,
+                check_crc=False):
+  """Scans a capture once and returns its PD index without saving it.
+
+  Args:
+    path_str: path of the capture.
+    batch_records: records read at a time.
+    check_crc: fill `crc_ok` with crc.valid_mask instead of True.
+  """
+  parts = []
+  offset = 0
+  with profiling.stage("index.build") as stage:
+    for batch in columnar.iter_batches(path_str, batch_records):
+      parts.append(_entries(batch, offset, check_crc))
+      offset += len(batch) * columnar.SNOOPER_PACKET_SIZE
+    stage.add(offset // columnar.SNOOPER_PACKET_SIZE, offset)
+  if not parts:
+    return np.empty(0, dtype=pd_index_entry)
+  return np.concatenate(parts)
+
+
+def load_index(path_str, check_crc=False):
+  """Returns the saved index of a capture, or None if missing or stale.
+
+  An index built with another `check_crc` is stale too.
+  """
+  path = pathlib.Path(path_str)
+  try:
+    with np.load(index_path(path)) as saved:
+      if not np.array_equal(saved["signature"], _signature(path, check_crc)):
+        return None
+      return saved["entries"]
+  except (OSError, KeyError, ValueError):
+    return None
+
+
+def save_index(path_str, entries, check_crc=False):
+  """Writes the index of a capture atomically; returns False if not writable."""
+  path = pathlib.Path(path_str)
+  target = index_path(path)
+  tmp = target.with_name(target.name + f".{os.getpid()}.tmp")
+  try:
+    with open(tmp, "wb") as f:
+      np.savez(f, signature=_signature(path, check_crc), entries=entries)
+    os.replace(tmp, target)
+  except OSError:
+    tmp.unlink(missing_ok=True)
+    return False
+  return True
+
+
+def get_index(path_str, check_crc=False):
+  """Returns the PD index of a capture, building and saving it if needed.
+
+  Args:
+    path_str: path of the .bin capture.
+    check_crc: check the CRC of the records (only meaningful for packets
+      as read from the device, see crc.py).
+
+  Returns:
+    A `pd_index_entry` array, one row per record with `data_length != 0`.
+    With check_crc, rows whose record failed the CRC have `crc_ok` False.
+  """
+  entries = load_index(path_str, check_crc)
+  profiling.count("pd_index.miss" if entries is None else "pd_index.hit")
+  if entries is None:
+    entries = build_index(path_str, check_crc=check_crc)
+    save_index(path_str, entries, check_crc)
+  return entries
+
+
+def pd_packet_headers(path_str):
+  """Returns the get_header.pd_packet_header list of a capture from its index."""
+  return [
+      get_header.pd_packet_header(
+          int(e["offset"]) // columnar.SNOOPER_PACKET_SIZE,
+          int(e["time"]),
+          int(e["cc_line"]),
+          int(e["sop"]),
+          int(e["msg_typ"]),
+          int(e["role"]),
+          int(e["msg_id"]),
+          int(e["num_data_obj"]),
+          int(e["extended"]),
+      )
+      for e in get_index(path_str)
+  ]
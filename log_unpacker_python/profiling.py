@@ -0,0 +1,327 @@
+"""Opt-in instrumentation of the decode pipeline.
+
+When enabled, every stage accumulates its calls, wall and CPU time, records
+and bytes, and named counters record cache hits and misses:
+
+* batch level code (file reads, vectorized unpacking, CRC checks, index and
+  rollup builds, construct compilation) calls stage() and count() directly;
+  disabled, each call costs one flag test;
+* the per-record functions (get_header_list, the get_header formatters,
+  twinkie.twinkie.parse, the data_mesg constructs) are wrapped by enable()
+  and restored by disable(), so they run unchanged while disabled.
+
+Stage times are inclusive of nested stages; CPU time is the process time, so
+it includes the other threads of the process.
+
+Enable with enable(), or with the TWINKIE_PROFILE environment variable: any
+value enables at import, and a path ending in .json also dumps the stats
+there at exit. `python profiling.py script.py args...` runs a script with
+the instrumentation enabled and prints the stats.
+"""
+
+import argparse
+import atexit
+import functools
+import importlib
+import json
+import os
+import runpy
+import sys
+import threading
+import time
+
+_enabled = False
+
+# columnar.SNOOPER_PACKET_SIZE, not imported: columnar imports this module.
+_RECORD_SIZE = 512
+
+
+class _Stage:
+  """Times one execution of a stage."""
+
+  __slots__ = ("_stats", "_name", "_records", "_bytes", "_wall", "_cpu")
+
+  def __init__(self, stats, name, records, nbytes):
+    self._stats = stats
+    self._name = name
+    self._records = records
+    self._bytes = nbytes
+
+  def add(self, records=0, nbytes=0):
+    """Adds records and bytes processed by this execution."""
+    self._records += records
+    self._bytes += nbytes
+
+  def __enter__(self):
+    self._wall = time.perf_counter()
+    self._cpu = time.process_time()
+    return self
+
+  def __exit__(self, *exc):
+    self._stats.add(
+        self._name,
+        time.perf_counter() - self._wall,
+        time.process_time() - self._cpu,
+        self._records,
+        self._bytes,
+    )
+    return False
+
+
+class _NullStage:
+  """The stage of a disabled instrumentation."""
+
+  __slots__ = ()
+
+  def add(self, records=0, nbytes=0):
+    pass
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    return False
+
+
+_NULL_STAGE = _NullStage()
+
+_FIELDS = ("calls", "wall_s", "cpu_s", "records", "bytes")
+
+
+class Stats:
+  """Accumulated stage measurements and counters; thread safe."""
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.reset()
+
+  def reset(self):
+    with self._lock:
+      self.stages = {}
+      self.counters = {}
+
+  def add(self, name, wall, cpu, records=0, nbytes=0):
+    with self._lock:
+      stage = self.stages.setdefault(name, [0, 0.0, 0.0, 0, 0])
+      stage[0] += 1
+      stage[1] += wall
+      stage[2] += cpu
+      stage[3] += records
+      stage[4] += nbytes
+
+  def count(self, name, n=1):
+    with self._lock:
+      self.counters[name] = self.counters.get(name, 0) + n
+
+  def snapshot(self):
+    """Returns the stats as a JSON-serializable dict.
+
+    `stages` maps every stage to its calls, wall_s, cpu_s, records, bytes
+    and, when time was spent, records_per_s and mb_per_s.
+    """
+    with self._lock:
+      stages = {
+          name: dict(zip(_FIELDS, values))
+          for name, values in sorted(self.stages.items())
+      }
+      counters = dict(sorted(self.counters.items()))
+    for stage in stages.values():
+      if stage["wall_s"] > 0:
+        stage["records_per_s"] = stage["records"] / stage["wall_s"]
+        stage["mb_per_s"] = stage["bytes"] / (1 << 20) / stage["wall_s"]
+    return {"stages": stages, "counters": counters}
+
+  def dump(self, file):
+    """Writes snapshot() as JSON to a path or a text file object."""
+    text = json.dumps(self.snapshot(), indent=2) + "\n"
+    if hasattr(file, "write"):
+      file.write(text)
+    else:
+      with open(file, "w") as f:
+        f.write(text)
+
+  def __str__(self):
+    snapshot = self.snapshot()
+    lines = [
+        f"{'stage':28} {'calls':>9} {'wall ms':>10} {'cpu ms':>10} "
+        f"{'records':>10} {'MB/s':>8}"
+    ]
+    for name, s in snapshot["stages"].items():
+      mb_per_s = ""
+      if s["bytes"] and "mb_per_s" in s:
+        mb_per_s = f"{s['mb_per_s']:.1f}"
+      lines.append(
+          f"{name:28} {s['calls']:9} {s['wall_s'] * 1000:10.1f} "
+          f"{s['cpu_s'] * 1000:10.1f} {s['records']:10} {mb_per_s:>8}"
+      )
+    for name, value in snapshot["counters"].items():
+      lines.append(f"{name:28} {value:9}")
+    return "\n".join(lines)
+
+
+stats = Stats()
+
+
+def enabled():
+  return _enabled
+
+
+def stage(name, records=0, nbytes=0):
+  """Returns a context manager timing a stage, a no-op while disabled.
+
+  Args:
+    name: stage name, dotted by pipeline step, e.g. "io.read".
+    records: records the stage processes, if known upfront.
+    nbytes: bytes the stage processes, if known upfront.
+  """
+  if not _enabled:
+    return _NULL_STAGE
+  return _Stage(stats, name, records, nbytes)
+
+
+def count(name, n=1):
+  """Increments a counter, e.g. "pd_index.hit", while enabled."""
+  if _enabled:
+    stats.count(name, n)
+
+
+def _record(args, result):
+  return 1, 0
+
+
+def _parsed(args, result):
+  return 1, len(args[0])
+
+
+def _header_list(args, result):
+  return len(result[0]), len(result[0]) * _RECORD_SIZE
+
+
+_construct_cache = threading.local()
+
+
+def _cache_load(args, result):
+  _construct_cache.hit = True
+  return 0, 0
+
+
+def _cache_compile(args, result):
+  """Counts construct cache hits, misses and uncached (read-only) compiles."""
+  if getattr(_construct_cache, "hit", False):
+    count("construct_cache.hit")
+  elif result is args[0]:
+    count("construct_cache.uncached")
+  else:
+    count("construct_cache.miss")
+  _construct_cache.hit = False
+  return 0, 0
+
+
+# Per-record functions wrapped while enabled: stage name, module, attribute
+# path and the (records, bytes) of a call from its arguments and result.
+_WRAPPED = (
+    ("unpack.get_header_list", "get_header", "get_header_list", _header_list),
+    ("format.time", "get_header", "format_time_num", _record),
+    ("format.pd_packet_header", "get_header", "pd_packet_header.__str__",
+     _record),
+    ("format.twinkie_header", "get_header", "twinkie_header.__str__", _record),
+    ("parse.twinkie", "twinkie", "twinkie.parse", _parsed),
+    ("parse.data_mesg.pdo", "data_mesg", "pdo.parse", _parsed),
+    ("parse.data_mesg.pdo_sink", "data_mesg", "pdo_sink.parse", _parsed),
+    ("parse.data_mesg.rdo", "data_mesg", "rdo.parse", _parsed),
+    ("parse.data_mesg.vdm", "data_mesg", "vdm.parse", _parsed),
+    ("construct.compile_cached", "util", "compile_cached", _cache_compile),
+    ("construct.load_cached", "util", "_load", _cache_load),
+)
+
+# (owner, attribute, original, whether the owner held it itself).
+_originals = []
+_install_lock = threading.Lock()
+
+
+def _wrap(function, name, measure):
+  @functools.wraps(function)
+  def wrapper(*args, **kwargs):
+    with _Stage(stats, name, 0, 0) as s:
+      result = function(*args, **kwargs)
+      s.add(*measure(args, result))
+    return result
+
+  return wrapper
+
+
+def _install():
+  for name, module_name, path, measure in _WRAPPED:
+    owner = importlib.import_module(module_name)
+    *parents, attr = path.split(".")
+    for parent in parents:
+      owner = getattr(owner, parent)
+    original = getattr(owner, attr)
+    # Bound methods of construct instances are shadowed on the instance.
+    _originals.append((owner, attr, original, attr in vars(owner)))
+    setattr(owner, attr, _wrap(original, name, measure))
+
+
+def _uninstall():
+  while _originals:
+    owner, attr, original, own = _originals.pop()
+    if own:
+      setattr(owner, attr, original)
+    else:
+      delattr(owner, attr)
+
+
+def enable(on=True):
+  """Enables (or disables) the instrumentation; stats are kept."""
+  global _enabled
+  with _install_lock:
+    if on and not _enabled:
+      _install()
+    elif not on and _enabled:
+      _uninstall()
+    _enabled = on
+
+
+def disable():
+  enable(False)
+
+
+def _from_environment():
+  value = os.environ.get("TWINKIE_PROFILE")
+  if not value:
+    return
+  enable()
+  if value.endswith(".json"):
+    atexit.register(stats.dump, value)
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(
+      description="Run a script with the decode instrumentation enabled."
+  )
+  parser.add_argument("-o", "--output", help="also dump the stats as JSON")
+  parser.add_argument("script")
+  parser.add_argument("args", nargs=argparse.REMAINDER)
+  args = parser.parse_args(argv)
+
+  # The modules instrument through `profiling`, not this __main__ copy.
+  profiling = importlib.import_module("profiling")
+  sys.argv = [args.script] + args.args
+  sys.path.insert(0, os.path.dirname(os.path.abspath(args.script)))
+  profiling.enable()
+  try:
+    runpy.run_path(args.script, run_name="__main__")
+  except SystemExit:
+    pass
+  finally:
+    profiling.disable()
+    print(profiling.stats, file=sys.stderr)
+    if args.output:
+      profiling.stats.dump(args.output)
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
+else:
+  _from_environment()
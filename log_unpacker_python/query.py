@@ -0,0 +1,561 @@
+"""Filter expressions over capture records, compiled to NumPy masks.
+
+An expression compares fields with numbers or enum names and combines the
+comparisons with `and`, `or`, `not` and parentheses::
+
+  msg_typ == REQUEST and sop == SOP and vbus_v > 15000 and cc == CC2
+  msg_typ in (ACCEPT, REJECT, WAIT) or packet_lost
+  pd and not crc_ok
+
+Fields are the record fields (time, cc1_v, cc2_v, cc2_c, vbus_v, vbus_c,
+data_length), the packet type fields (sop, version, partial, packet_lost, cc),
+the PD header fields (extended, num_data_obj, msg_id, power_role, spec,
+data_role, msg_typ, msg_kind), `pd` (the record holds a PD message), `crc_ok`
+(the record matches its device CRC; only packets as read from the device
+do, see crc.py) and a few data object fields (rdo_pos, vdm_vid, vdm_typ, vdm_command_typ,
+vdm_command). Values are numbers or the member names of the matching twinkie
+and data_mesg enums; msg_typ takes the names of the control, data and
+extended message enums. A field alone tests that it is not zero.
+power_role holds the Port Power Role on SOP messages and the Cable Plug
+bit on SOP'/SOP'' (and their debug variants), so its names also select the
+SOP: `power_role == SRC` only matches SOP messages and
+`power_role == CABLE_VPD` only cable plug ones.
+
+PD header and data object fields only exist on the records holding such a
+message; comparing them is false elsewhere. An expression that only matches
+PD records and only uses fields of the PD index (pd_index.py) runs on the
+saved index instead of the capture.
+"""
+
+import argparse
+import operator
+import re
+import sys
+
+import numpy as np
+
+import columnar
+import crc
+import data_mesg
+import data_objects
+import get_header
+import pd_fields
+import pd_index
+import twinkie
+
+
+class QueryError(ValueError):
+  """A filter expression that does not parse or names unknown fields."""
+
+
+_MESSAGE_ENUMS = {
+    pd_fields.MSG_CTRL: twinkie.CtrlMesgEnum,
+    pd_fields.MSG_DATA: twinkie.DataMesgEnum,
+    pd_fields.MSG_EXT: twinkie.ExtMesgEnum,
+}
+_MESSAGES = {
+    member.name: (kind, member.value)
+    for kind, enum in _MESSAGE_ENUMS.items()
+    for member in enum
+}
+
+RECORD_FIELDS = ("time", "data_length") + columnar.ANALOG_CHANNELS
+PACKET_TYPE_FIELDS = ("sop", "version", "partial", "packet_lost", "cc")
+PD_HEADER_FIELDS = (
+    "extended", "num_data_obj", "msg_id", "power_role", "spec", "data_role",
+    "msg_typ", "msg_kind",
+)
+DATA_OBJECT_FIELDS = (
+    "rdo_pos", "vdm_vid", "vdm_typ", "vdm_command_typ", "vdm_command",
+)
+FIELDS = (
+    RECORD_FIELDS + PACKET_TYPE_FIELDS + PD_HEADER_FIELDS + DATA_OBJECT_FIELDS
+    + ("pd", "crc_ok")
+)
+# Fields only defined on PD records.
+PD_FIELDS = frozenset(PD_HEADER_FIELDS + DATA_OBJECT_FIELDS + ("pd",))
+# The index only checks crc_ok on request, so crc_ok queries scan records.
+INDEX_FIELDS = frozenset(("time", "sop", "cc", "pd") + PD_HEADER_FIELDS)
+
+# Enums whose member names a field compares with.
+_FIELD_ENUMS = {
+    "sop": (twinkie.SoPEnum,),
+    "cc": (twinkie.CCEnum,),
+    "spec": (twinkie.ReVerEnum,),
+    "data_role": (twinkie.DroleEnum,),
+    "vdm_command_typ": (data_mesg.VdmCommandTypeEnum,),
+    "vdm_command": (data_mesg.VdmCommandEnum,),
+}
+
+# power_role names, and the SOPs where the bit has their meaning.
+_ROLE_SOPS = {
+    twinkie.ProleEnum: (twinkie.SoPEnum.SOP,),
+    twinkie.CableEnum: (
+        twinkie.SoPEnum.SOP_, twinkie.SoPEnum.SOP__, twinkie.SoPEnum.DBG_,
+        twinkie.SoPEnum.DBG__,
+    ),
+}
+_ROLES = {
+    member.name: (member.value, sops)
+    for enum, sops in _ROLE_SOPS.items()
+    for member in enum
+}
+
+_OPS = {
+    "==": operator.eq,
+    "=": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+_TOKEN = re.compile(
+    r"\s*(?:(?P<number>0[xX][0-9a-fA-F]+|\d+)"
+    r"|(?P<name>[A-Za-z_][A-Za-z0-9_]*)"
+    r"|(?P<op>==|!=|<=|>=|<|>|=)"
+    r"|(?P<punct>[(),]))"
+)
+_KEYWORDS = ("and", "or", "not", "in")
+
+
+def _tokenize(text):
+  """Returns the (kind, value, position) tokens of an expression."""
+  tokens = []
+  pos = 0
+  text = text.rstrip()
+  while pos < len(text):
+    match = _TOKEN.match(text, pos)
+    if match is None or match.end() == pos:
+      raise QueryError(f"unexpected character at {pos}: {text[pos:]!r}")
+    kind = match.lastgroup
+    value = match.group(kind)
+    start = match.start(kind)
+    if kind == "name" and value.lower() in _KEYWORDS:
+      kind, value = "keyword", value.lower()
+    tokens.append((kind, value, start))
+    pos = match.end()
+  tokens.append(("end", None, pos))
+  return tokens
+
+
+class _Compare:
+  """`field op value`, or `field in (values)` with op None."""
+
+  def __init__(self, field, op, values):
+    self.field = field
+    self.op = op
+    self.values = values
+
+  def fields(self):
+    if self.field == "msg_typ":
+      return {"msg_kind", "msg_typ"}
+    if self.field == "power_role" and any(
+        isinstance(v, tuple) for v in self.values
+    ):
+      return {"sop", "power_role"}
+    return {self.field}
+
+  def requires_pd(self):
+    return self.field in PD_FIELDS
+
+  def _test(self, columns, op, value):
+    if self.field == "msg_typ" and isinstance(value, tuple):
+      kind, msg_typ = value
+      equal = (columns.get("msg_kind") == kind) & (
+          columns.get("msg_typ") == msg_typ
+      )
+      return equal if op is operator.eq else ~equal
+    if self.field == "power_role" and isinstance(value, tuple):
+      role, sops = value
+      equal = (columns.get("power_role") == role) & np.isin(
+          columns.get("sop"), sops
+      )
+      return equal if op is operator.eq else ~equal
+    return op(columns.get(self.field), value)
+
+  def mask(self, columns):
+    if self.op is None:
+      result = np.zeros(columns.size, dtype=bool)
+      for value in self.values:
+        result |= self._test(columns, operator.eq, value)
+    else:
+      result = self._test(columns, self.op, self.values[0])
+    valid = columns.valid(self.field)
+    return result if valid is None else result & valid
+
+
+class _Truthy:
+  """A field alone: not zero."""
+
+  def __init__(self, field):
+    self.field = field
+
+  def fields(self):
+    return {self.field}
+
+  def requires_pd(self):
+    return self.field in PD_FIELDS
+
+  def mask(self, columns):
+    result = columns.get(self.field) != 0
+    valid = columns.valid(self.field)
+    return result if valid is None else result & valid
+
+
+class _And:
+
+  def __init__(self, terms):
+    self.terms = terms
+
+  def fields(self):
+    return set().union(*(t.fields() for t in self.terms))
+
+  def requires_pd(self):
+    return any(t.requires_pd() for t in self.terms)
+
+  def mask(self, columns):
+    result = self.terms[0].mask(columns)
+    for term in self.terms[1:]:
+      result &= term.mask(columns)
+    return result
+
+
+class _Or(_And):
+
+  def requires_pd(self):
+    return all(t.requires_pd() for t in self.terms)
+
+  def mask(self, columns):
+    result = self.terms[0].mask(columns)
+    for term in self.terms[1:]:
+      result |= term.mask(columns)
+    return result
+
+
+class _Not:
+
+  def __init__(self, term):
+    self.term = term
+
+  def fields(self):
+    return self.term.fields()
+
+  def requires_pd(self):
+    return False
+
+  def mask(self, columns):
+    return ~self.term.mask(columns)
+
+
+class _Parser:
+  """Recursive descent parser of filter expressions."""
+
+  def __init__(self, text):
+    self.text = text
+    self.tokens = _tokenize(text)
+    self.pos = 0
+
+  def _peek(self):
+    return self.tokens[self.pos]
+
+  def _next(self):
+    token = self.tokens[self.pos]
+    self.pos += 1
+    return token
+
+  def _error(self, message, token=None):
+    token = token or self._peek()
+    return QueryError(f"{message} at {token[2]}: {self.text!r}")
+
+  def _accept(self, kind, value=None):
+    token = self._peek()
+    if token[0] == kind and (value is None or token[1] == value):
+      self.pos += 1
+      return token
+    return None
+
+  def _expect(self, kind, value=None):
+    token = self._accept(kind, value)
+    if token is None:
+      raise self._error(f"expected {value or kind}")
+    return token
+
+  def parse(self):
+    node = self._or()
+    if self._peek()[0] != "end":
+      raise self._error("unexpected token")
+    return node
+
+  def _or(self):
+    terms = [self._and()]
+    while self._accept("keyword", "or"):
+      terms.append(self._and())
+    return terms[0] if len(terms) == 1 else _Or(terms)
+
+  def _and(self):
+    terms = [self._not()]
+    while self._accept("keyword", "and"):
+      terms.append(self._not())
+    return terms[0] if len(terms) == 1 else _And(terms)
+
+  def _not(self):
+    if self._accept("keyword", "not"):
+      return _Not(self._not())
+    if self._accept("punct", "("):
+      node = self._or()
+      self._expect("punct", ")")
+      return node
+    return self._comparison()
+
+  def _comparison(self):
+    token = self._expect("name")
+    field = token[1]
+    if field not in FIELDS:
+      raise self._error(f"unknown field {field!r}", token)
+    op = self._accept("op")
+    if op is not None:
+      return _Compare(field, _OPS[op[1]], [self._value(field, _OPS[op[1]])])
+    if self._accept("keyword", "in"):
+      self._expect("punct", "(")
+      values = [self._value(field, operator.eq)]
+      while self._accept("punct", ","):
+        values.append(self._value(field, operator.eq))
+      self._expect("punct", ")")
+      return _Compare(field, None, values)
+    return _Truthy(field)
+
+  def _value(self, field, op):
+    token = self._next()
+    kind, value = token[0], token[1]
+    if kind == "number":
+      return int(value, 0)
+    if kind != "name":
+      raise self._error("expected a value", token)
+    if field == "msg_typ":
+      if value not in _MESSAGES:
+        raise self._error(f"unknown message {value!r}", token)
+      if op not in (operator.eq, operator.ne):
+        raise self._error("messages only compare with == and !=", token)
+      return _MESSAGES[value]
+    if field == "power_role":
+      if value not in _ROLES:
+        raise self._error(f"{value!r} is not a value of {field}", token)
+      if op not in (operator.eq, operator.ne):
+        raise self._error("roles only compare with == and !=", token)
+      return _ROLES[value]
+    for enum in _FIELD_ENUMS.get(field, ()):
+      if value in enum.__members__:
+        return enum[value].value
+    raise self._error(f"{value!r} is not a value of {field}", token)
+
+
+class Query:
+  """A compiled filter expression."""
+
+  def __init__(self, text):
+    """Parses an expression.
+
+    Raises:
+      QueryError: if it does not parse or uses unknown fields or values.
+    """
+    self.text = text
+    self._root = _Parser(text).parse()
+    self.fields = frozenset(self._root.fields())
+    # True if the expression is false on every record without PD message.
+    self.requires_pd = self._root.requires_pd()
+
+  def uses_index(self):
+    """Returns True if the PD index holds everything the query needs."""
+    return self.requires_pd and self.fields <= INDEX_FIELDS
+
+  def mask(self, columns):
+    """Returns the boolean mask of the rows of `columns` matching."""
+    return self._root.mask(columns)
+
+  def __repr__(self):
+    return f"Query({self.text!r})"
+
+
+class RecordColumns:
+  """Fields of a record array, decoded on first use."""
+
+  def __init__(self, records):
+    self.records = records
+    self.size = len(records)
+    self._cache = {}
+
+  def _decode(self, name):
+    records = self.records
+    if name in RECORD_FIELDS:
+      return records[name]
+    if name in PACKET_TYPE_FIELDS:
+      self._cache.update(pd_fields.decode_packet_type(records["packet_bin"]))
+      return self._cache[name]
+    if name in PD_HEADER_FIELDS:
+      self._cache.update(
+          pd_fields.decode_pd_header(columnar.pd_header_words(records))
+      )
+      return self._cache[name]
+    if name == "pd":
+      return records["data_length"] != 0
+    if name == "crc_ok":
+      return crc.valid_mask(records)
+    first = data_objects.data_objects(records)[:, 0]
+    if name == "rdo_pos":
+      return data_objects.decode_rdo(first)["pos"]
+    vdm = data_objects.decode_vdm(first)
+    return {
+        "vdm_vid": vdm["vid"],
+        "vdm_typ": vdm["vdm_typ"],
+        "vdm_command_typ": vdm["structured"]["command_typ"],
+        "vdm_command": vdm["structured"]["command"],
+    }[name]
+
+  def get(self, name):
+    if name not in self._cache:
+      self._cache[name] = self._decode(name)
+    return self._cache[name]
+
+  def _data_message(self, msg_typ):
+    return (
+        self.get("pd")
+        & (self.get("msg_kind") == pd_fields.MSG_DATA)
+        & (self.get("msg_typ") == msg_typ)
+    )
+
+  def valid(self, name):
+    """Returns the rows where `name` is defined, None for all of them."""
+    if name in PD_HEADER_FIELDS:
+      return self.get("pd")
+    if name == "rdo_pos":
+      return self._data_message(twinkie.DataMesgEnum.REQUEST)
+    if name in ("vdm_vid", "vdm_typ"):
+      return self._data_message(twinkie.DataMesgEnum.VDM)
+    if name in ("vdm_command_typ", "vdm_command"):
+      return self._data_message(twinkie.DataMesgEnum.VDM) & self.get("vdm_typ")
+    return None
+
+
+class IndexColumns:
+  """Fields of PD index rows."""
+
+  def __init__(self, entries):
+    self.entries = entries
+    self.size = len(entries)
+
+  def get(self, name):
+    entries = self.entries
+    role = entries["role"]
+    if name == "cc":
+      return entries["cc_line"]
+    if name == "pd":
+      return np.ones(self.size, dtype=bool)
+    if name == "power_role":
+      return role >> 3
+    if name == "spec":
+      return (role >> 1) & 0b11
+    if name == "data_role":
+      return role & 1
+    if name == "msg_kind":
+      return np.where(
+          entries["extended"],
+          pd_fields.MSG_EXT,
+          np.where(entries["num_data_obj"] != 0, pd_fields.MSG_DATA,
+                   pd_fields.MSG_CTRL),
+      )
+    return entries[name]
+
+  def valid(self, name):
+    return None
+
+
+def select(path_str, query, batch_records=columnar.DEFAULT_BATCH_RECORDS,
+           use_index=True):
+  """Returns the indices of the records of a capture matching a query.
+
+  Args:
+    path_str: path of the .bin capture.
+    query: Query or expression text.
+    batch_records: records scanned at a time without the index.
+    use_index: run on the saved PD index when the query allows it.
+
+  Returns:
+    A sorted int64 array of record indices.
+  """
+  if not isinstance(query, Query):
+    query = Query(query)
+  if use_index and query.uses_index():
+    entries = pd_index.load_index(path_str)
+    if entries is not None:
+      matches = entries["offset"][query.mask(IndexColumns(entries))]
+      return (matches // columnar.SNOOPER_PACKET_SIZE).astype(np.int64)
+
+  parts = []
+  first = 0
+  for batch in columnar.iter_batches(path_str, batch_records):
+    if query.requires_pd:
+      # Only decode the few PD records of the batch.
+      rows = np.flatnonzero(batch["data_length"])
+      matches = rows[query.mask(RecordColumns(batch[rows]))]
+    else:
+      matches = np.flatnonzero(query.mask(RecordColumns(batch)))
+    parts.append(first + matches)
+    first += len(batch)
+  return np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+
+def format_record(index, record):
+  """Formats a record like get_header: its PD header, else its samples."""
+  if not record["data_length"]:
+    return f"{index}: " + str(get_header.twinkie_header(
+        [int(record[name]) for name in ("time",) + columnar.ANALOG_CHANNELS]
+        + [int(record["packet_bin"]), 0]
+    ))
+  fields = pd_fields.decode_records(record[np.newaxis])
+  return str(get_header.pd_packet_header(
+      index,
+      int(record["time"]),
+      int(fields["cc"][0]),
+      int(fields["sop"][0]),
+      int(fields["msg_typ"][0]),
+      int(pd_fields.packed_role(fields)[0]),
+      int(fields["msg_id"][0]),
+      int(fields["num_data_obj"][0]),
+      int(fields["extended"][0]),
+  ))
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(
+      description="Print the records of a capture matching an expression."
+  )
+  parser.add_argument("capture")
+  parser.add_argument(
+      "expression", help="e.g. 'msg_typ == REQUEST and vbus_v > 15000'"
+  )
+  parser.add_argument(
+      "-c", "--count", action="store_true", help="only print the count"
+  )
+  parser.add_argument(
+      "--no-index", action="store_true", help="scan the capture"
+  )
+  args = parser.parse_args(argv)
+
+  try:
+    query = Query(args.expression)
+  except QueryError as e:
+    parser.error(str(e))
+  indices = select(args.capture, query, use_index=not args.no_index)
+  if args.count:
+    print(len(indices))
+    return 0
+  records = columnar.lazy_records(args.capture)
+  for index in indices:
+    print(format_record(int(index), records[index]))
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,204 @@
+"""Precomputed per-second and per-minute rollups of the analog channels.
+
+A rollup row aggregates the samples of one capture falling in a time bucket
+aligned on the timeline (timeline.py): count, then min, max and sum of every
+analog channel, and the VBUS energy. Rollups are stored next to the capture
+as `<capture>.rollup.npz`, checked against its size and mtime like the PD
+index, so dashboards query them instead of the raw records.
+"""
+
+import os
+import pathlib
+
+import numpy as np
+
+import columnar
+import profiling
+import timeline
+
+ROLLUP_SUFFIX = ".rollup.npz"
+ROLLUP_VERSION = 1
+
+RESOLUTIONS_MS = (1000, 60 * 1000)
+
+# Gaps longer than this do not count towards the energy of a sample.
+MAX_SAMPLE_MS = 1000
+
+rollup_row = np.dtype(
+    [("bucket", "<i8"), ("count", "<i8")]
+    + [
+        (f"{name}_{stat}", "<u2" if stat != "sum" else "<f8")
+        for name in columnar.ANALOG_CHANNELS
+        for stat in ("min", "max", "sum")
+    ]
+    + [("vbus_energy_nj", "<f8")]
+)
+
+
+def rollup_path(path_str):
+  """Returns the sidecar path of a capture."""
+  path = pathlib.Path(path_str)
+  return path.with_name(path.name + ROLLUP_SUFFIX)
+
+
+def _signature(path):
+  st = path.stat()
+  return np.array([ROLLUP_VERSION, st.st_size, st.st_mtime_ns], dtype="<i8")
+
+
+def _aggregate(times, dt, records, resolution):
+  """Aggregates time-sorted samples into one row per bucket.
+
+  `dt` is the time from every sample to the next one.
+  """
+  buckets = times // resolution * resolution
+  firsts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+  rows = np.empty(len(firsts), dtype=rollup_row)
+  rows["bucket"] = buckets[firsts]
+  rows["count"] = np.diff(np.r_[firsts, len(buckets)])
+  for name in columnar.ANALOG_CHANNELS:
+    values = records[name]
+    rows[f"{name}_min"] = np.minimum.reduceat(values, firsts)
+    rows[f"{name}_max"] = np.maximum.reduceat(values, firsts)
+    rows[f"{name}_sum"] = np.add.reduceat(values, firsts, dtype=np.float64)
+
+  # mV * mA = uW, times ms until the next sample = nJ.
+  dt = np.clip(dt, 0, MAX_SAMPLE_MS)
+  power = records["vbus_v"].astype(np.float64) * records["vbus_c"]
+  rows["vbus_energy_nj"] = np.add.reduceat(power * dt, firsts)
+  return rows
+
+
+def merge(rows):
+  """Merges rows of equal bucket (from several chunks or captures)."""
+  if not len(rows):
+    return rows
+  rows = rows[np.argsort(rows["bucket"], kind="stable")]
+  bucket = rows["bucket"]
+  firsts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+  if len(firsts) == len(rows):
+    return rows
+  merged = np.empty(len(firsts), dtype=rollup_row)
+  for field in rollup_row.names:
+    if field == "bucket":
+      merged[field] = rows[field][firsts]
+    elif field.endswith("_min"):
+      merged[field] = np.minimum.reduceat(rows[field], firsts)
+    elif field.endswith("_max"):
+      merged[field] = np.maximum.reduceat(rows[field], firsts)
+    else:
+      merged[field] = np.add.reduceat(rows[field], firsts)
+  return merged
+
+
+def build_rollups(path_str, chunk_records=1 << 20):
+  """Computes the rollups of a capture at every RESOLUTIONS_MS.
+
+  The capture, .bin or compact, is streamed once, `chunk_records` records at
+  a time (timeline.timed_batches), so memory is bounded by `chunk_records`
+  for both formats. A chunk is
+  aggregated once the next one is read: its first sample gives the duration
+  of the last sample of the chunk.
+
+  Returns:
+    A dict mapping resolution ms to an array of `rollup_row`.
+  """
+  parts = {resolution: [] for resolution in RESOLUTIONS_MS}
+
+  def aggregate(chunk, chunk_times, next_time):
+    dt = np.diff(chunk_times, append=next_time)
+    for resolution in RESOLUTIONS_MS:
+      parts[resolution].append(_aggregate(chunk_times, dt, chunk, resolution))
+
+  pending = None
+  with profiling.stage("rollup.build") as stage:
+    for _, chunk, chunk_times in timeline.timed_batches(
+        path_str, chunk_records
+    ):
+      if chunk_times is None:
+        chunk_times = np.asarray(chunk["time"], dtype=np.int64)
+      if pending is not None:
+        aggregate(*pending, chunk_times[0])
+      pending = chunk, chunk_times
+      stage.add(len(chunk), len(chunk) * columnar.SNOOPER_PACKET_SIZE)
+    if pending is not None:
+      aggregate(*pending, pending[1][-1])
+  return {
+      resolution: merge(np.concatenate(p)) if p else np.empty(0, rollup_row)
+      for resolution, p in parts.items()
+  }
+
+
+def load_rollups(path_str):
+  """Returns the saved rollups of a capture, or None if missing or stale."""
+  path = pathlib.Path(path_str)
+  try:
+    with np.load(rollup_path(path)) as saved:
+      if not np.array_equal(saved["signature"], _signature(path)):
+        return None
+      return {r: saved[f"r{r}"] for r in RESOLUTIONS_MS}
+  except (OSError, KeyError, ValueError):
+    return None
+
+
+def save_rollups(path_str, rollups):
+  """Writes the rollups of a capture atomically; returns False on failure."""
+  path = pathlib.Path(path_str)
+  target = rollup_path(path)
+  tmp = target.with_name(target.name + f".{os.getpid()}.tmp")
+  try:
+    with open(tmp, "wb") as f:
+      np.savez(
+          f,
+          signature=_signature(path),
+          **{f"r{r}": rows for r, rows in rollups.items()},
+      )
+    os.replace(tmp, target)
+  except OSError:
+    tmp.unlink(missing_ok=True)
+    return False
+  return True
+
+
+def get_rollups(path_str):
+  """Returns the rollups of a capture, building and saving them if needed."""
+  rollups = load_rollups(path_str)
+  profiling.count("rollup.miss" if rollups is None else "rollup.hit")
+  if rollups is None:
+    rollups = build_rollups(path_str)
+    save_rollups(path_str, rollups)
+  return rollups
+
+
+def query(paths, begin=None, end=None, resolution=RESOLUTIONS_MS[-1]):
+  """Returns the merged rollup rows of captures over [begin, end).
+
+  Args:
+    paths: capture paths.
+    begin: naive local datetime or timeline ms, unbounded by default.
+    end: naive local datetime or timeline ms, unbounded by default.
+    resolution: one of RESOLUTIONS_MS.
+
+  Returns:
+    An array of `rollup_row` sorted by bucket.
+  """
+  if resolution not in RESOLUTIONS_MS:
+    raise ValueError(f"resolution must be one of {RESOLUTIONS_MS}")
+  parts = []
+  for path in paths:
+    rows = get_rollups(path)[resolution]
+    lo = 0 if begin is None else np.searchsorted(
+        rows["bucket"], timeline.to_ms(begin)
+    )
+    hi = len(rows) if end is None else np.searchsorted(
+        rows["bucket"], timeline.to_ms(end)
+    )
+    parts.append(rows[lo:hi])
+  if not parts:
+    return np.empty(0, dtype=rollup_row)
+  return merge(np.concatenate(parts))
+
+
+def mean(rows, name):
+  """Returns the per-row mean of an analog channel."""
+  return rows[f"{name}_sum"] / np.maximum(rows["count"], 1)
@@ -0,0 +1,50 @@
+"""Capture files of a twinkie_console session directory.
+
+control_d names every file it opens after the local time it was opened at,
+`<year>_<tm_mon>_<tm_mday>_<tm_hour>_<tm_min>_<tm_sec>.bin`, with the month
+counted from 0 as in `struct tm`. Captures converted to the compact format
+(compact.py) keep the name with the .twkc extension.
+"""
+
+import datetime
+import pathlib
+import re
+
+CAPTURE_SUFFIXES = (".bin", ".twkc")
+
+_NAME_RE = re.compile(r"^(\d+)_(\d+)_(\d+)_(\d+)_(\d+)_(\d+)\.(?:bin|twkc)$")
+
+
+def capture_start(path_str):
+  """Returns the local datetime encoded in a capture file name, or None."""
+  match = _NAME_RE.match(pathlib.Path(path_str).name)
+  if match is None:
+    return None
+  year, mon, mday, hour, minute, sec = (int(x) for x in match.groups())
+  try:
+    return datetime.datetime(year, mon + 1, mday, hour, minute, sec)
+  except ValueError:
+    return None
+
+
+def chronological(paths):
+  """Sorts capture paths by start time; untimestamped names sort last."""
+
+  def key(path):
+    start = capture_start(path)
+    return (start is None, start or datetime.datetime.min, str(path))
+
+  return sorted(paths, key=key)
+
+
+def list_captures(dir_str, suffixes=CAPTURE_SUFFIXES):
+  """Returns the capture files of a session directory in chronological order.
+
+  Args:
+    dir_str: session directory.
+    suffixes: extensions of the listed files, .bin and compact by default.
+  """
+  directory = pathlib.Path(dir_str)
+  return chronological(
+      path for suffix in suffixes for path in directory.glob("*" + suffix)
+  )
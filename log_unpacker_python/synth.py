@@ -0,0 +1,346 @@
+"""Synthetic captures in the SnooperPacket format, for benchmarks and checks.
+
+Analog samples follow bounded random walks with 1-2 ms between records, the
+log_file() timer and file name encode the start time, and a configurable
+share of the records carry PD messages drawn from a message mix, each
+followed by its GoodCRC. Extended messages longer than a chunk are sent as
+chunked exchanges: chunk 0, then a chunk request of the receiver and the
+requested chunk for every next one. Every record gets the CRC the device
+computed over its packet before log_file() overwrote the sequence word with
+the timer, so crc.sequence_words() recovers consecutive sequence numbers.
+The messages only use data objects the twinkie construct parses: fixed,
+variable, battery, SPR PPS and EPR AVS PDOs, fixed/variable RDOs, structured
+and unstructured VDMs, extended messages and control messages.
+"""
+
+import argparse
+import datetime
+import pathlib
+import struct
+import sys
+
+import numpy as np
+
+import columnar
+import crc
+import data_mesg
+import twinkie
+
+# Relative weights of the generated messages.
+DEFAULT_MIX = {
+    "src_cap": 2,
+    "request": 2,
+    "ctrl": 4,
+    "vdm": 1,
+    "extended": 1,
+}
+DEFAULT_PD_RATIO = 0.05
+DEFAULT_START = datetime.datetime(2024, 1, 15, 10, 0, 0)
+CHUNK_RECORDS = 1 << 16
+
+_PD_FLAG = 1 << 7
+_SPEC = twinkie.ReVerEnum.V3_0
+
+_CTRL_MESSAGES = (
+    twinkie.CtrlMesgEnum.ACCEPT,
+    twinkie.CtrlMesgEnum.PS_RDY,
+    twinkie.CtrlMesgEnum.GET_SRC_CAP,
+    twinkie.CtrlMesgEnum.GET_SNK_CAP,
+    twinkie.CtrlMesgEnum.REJECT,
+    twinkie.CtrlMesgEnum.WAIT,
+    twinkie.CtrlMesgEnum.GET_STATUS,
+)
+# Extended message types and their data_size range; the last two need
+# chunking.
+_EXTENDED_MESSAGES = (
+    (twinkie.ExtMesgEnum.EXT_SRC_CAP, 25, 25),
+    (twinkie.ExtMesgEnum.EXT_STATUS, 7, 7),
+    (twinkie.ExtMesgEnum.EXT_ERP_SRC_CAP, 32, 44),
+    (twinkie.ExtMesgEnum.EXT_SECURITY_RESPONSE, 27, 260),
+)
+_MAX_CHUNK_SIZE = 26
+_VDM_COMMANDS = (
+    data_mesg.VdmCommandEnum.DISCOVER_IDENTITY,
+    data_mesg.VdmCommandEnum.DISCOVER_SVIDS,
+    data_mesg.VdmCommandEnum.DISCOVER_MODES,
+    data_mesg.VdmCommandEnum.ENTER_MODE,
+    data_mesg.VdmCommandEnum.ATTENTION,
+)
+
+
+def capture_name(start):
+  """Returns the control_d file name of a capture opened at `start`."""
+  return (
+      f"{start.year}_{start.month - 1}_{start.day}_"
+      f"{start.hour}_{start.minute}_{start.second}.bin"
+  )
+
+
+def _log_timer(when):
+  """The log_file() timer value of a datetime (ms from day 0 of the month)."""
+  return when.microsecond // 1000 + 1000 * (
+      when.second + 60 * (when.minute + 60 * (when.hour + 24 * when.day))
+  )
+
+
+def _header(msg_typ, num_data_obj, msg_id, power_role, data_role,
+            extended=False):
+  return (
+      int(extended) << 15 | num_data_obj << 12 | msg_id << 9
+      | power_role << 8 | _SPEC << 6 | data_role << 5 | msg_typ
+  )
+
+
+def _fixed_pdo(rng, voltage_50mv):
+  return (
+      data_mesg.PdoEnum.FIXED_SUPPLY << 30 | voltage_50mv << 10
+      | int(rng.choice((150, 300, 500)))
+  )
+
+
+def _pdo(rng):
+  """Returns a random non-first source PDO of any parsable type."""
+  kind = rng.integers(5)
+  if kind == 0:
+    return _fixed_pdo(rng, int(rng.choice((180, 300, 400))))
+  if kind == 1:
+    return (
+        data_mesg.PdoEnum.VARIABLE_SUPPLY << 30 | 420 << 20 | 100 << 10
+        | int(rng.integers(50, 500))
+    )
+  if kind == 2:
+    return (
+        data_mesg.PdoEnum.BATTERY << 30 | 420 << 20 | 100 << 10
+        | int(rng.integers(20, 400))
+    )
+  if kind == 3:
+    return (
+        data_mesg.PdoEnum.APDO << 30 | data_mesg.ApdoEnum.SPR_PPS << 28
+        | 210 << 17 | 33 << 8 | int(rng.integers(20, 100))
+    )
+  return (
+      data_mesg.PdoEnum.APDO << 30 | data_mesg.ApdoEnum.EPR_AVS << 28
+      | 480 << 17 | 150 << 8 | int(rng.integers(15, 240))
+  )
+
+
+def _messages(rng, kind, msg_ids):
+  """Returns the header and the payload after it of the messages of a new
+  exchange: one message, or the chunks of a chunked extended message.
+
+  `msg_ids` holds the next MessageID of the sink and of the source.
+  """
+  bodies = _chunks(rng) if kind == "extended" else [_body(rng, kind)]
+  messages = []
+  for power_role, msg_typ, num_data_obj, extended, payload in bodies:
+    msg_id = msg_ids[power_role]
+    msg_ids[power_role] = (msg_id + 1) % 8
+    messages.append((_header(
+        msg_typ, num_data_obj, msg_id, power_role, power_role, extended
+    ), payload))
+  return messages
+
+
+def _extended_body(power_role, msg_typ, ext_header, data=b""):
+  payload = struct.pack("<H", ext_header) + data
+  payload += bytes(-len(payload) % 4)
+  return power_role, msg_typ, len(payload) // 4, True, payload
+
+
+def _chunks(rng):
+  """Returns the bodies of an extended message sent by the source: its
+  chunks, with a chunk request of the sink before every chunk after 0."""
+  msg_typ, low, high = _EXTENDED_MESSAGES[
+      rng.integers(len(_EXTENDED_MESSAGES))
+  ]
+  data_size = int(rng.integers(low, high + 1))
+  data = rng.integers(256, size=data_size, dtype=np.uint8).tobytes()
+  bodies = []
+  for chunk_number in range(-(-data_size // _MAX_CHUNK_SIZE)):
+    if chunk_number:
+      bodies.append(_extended_body(
+          0, msg_typ, 1 << 15 | chunk_number << 11 | 1 << 10
+      ))
+    first = chunk_number * _MAX_CHUNK_SIZE
+    bodies.append(_extended_body(
+        1, msg_typ, 1 << 15 | chunk_number << 11 | data_size,
+        data[first:first + _MAX_CHUNK_SIZE],
+    ))
+  return bodies
+
+
+def _body(rng, kind):
+  """Returns power role, msg_typ, num_data_obj, extended and payload."""
+  if kind == "src_cap":
+    pdos = [_fixed_pdo(rng, 100)]
+    pdos += [_pdo(rng) for _ in range(int(rng.integers(0, 7)))]
+    return (
+        1, twinkie.DataMesgEnum.SRC_CAP, len(pdos), False,
+        struct.pack(f"<{len(pdos)}I", *pdos),
+    )
+  if kind == "request":
+    current = int(rng.integers(50, 500))
+    rdo = int(rng.integers(1, 8)) << 28 | current << 10 | current
+    return 0, twinkie.DataMesgEnum.REQUEST, 1, False, struct.pack("<I", rdo)
+  if kind == "vdm":
+    if rng.random() < 0.8:
+      command = int(rng.choice(_VDM_COMMANDS))
+      vdm = (
+          0xFF00 << 16 | 1 << 15 | 1 << 11 | int(rng.integers(8)) << 8
+          | int(rng.integers(4)) << 6 | command
+      )
+    else:
+      vdm = int(rng.integers(1 << 16)) << 16 | int(rng.integers(1 << 15))
+    return 1, twinkie.DataMesgEnum.VDM, 1, False, struct.pack("<I", vdm)
+  if kind == "ctrl":
+    return (
+        int(rng.integers(2)), int(rng.choice(_CTRL_MESSAGES)), 0, False, b""
+    )
+  raise ValueError(f"unknown message kind: {kind}")
+
+
+class _Generator:
+  """Generates consecutive chunks of one capture."""
+
+  def __init__(self, pd_ratio, mix, seed, start):
+    self.rng = np.random.default_rng(seed)
+    self.pd_ratio = pd_ratio
+    mix = mix or DEFAULT_MIX
+    self.kinds = list(mix)
+    weights = np.array([mix[k] for k in self.kinds], dtype=np.float64)
+    self.weights = weights / weights.sum()
+    self.time = _log_timer(start)
+    self.sequence = int(self.rng.integers(1 << 32))
+    self.msg_ids = [0, 0]
+    self.analog = np.array([400, 1600, 20, 5000, 500], dtype=np.float64)
+
+  def _analog(self, count):
+    steps = self.rng.normal(0, 8, size=(count, len(self.analog)))
+    walk = np.clip(self.analog + np.cumsum(steps, axis=0), 0, 21000)
+    self.analog = walk[-1]
+    return walk.astype(np.uint16)
+
+  def chunk(self, count):
+    rng = self.rng
+    records = np.zeros(count, dtype=columnar.snooper_packet)
+    times = self.time + np.cumsum(rng.integers(1, 3, size=count))
+    self.time = int(times[-1])
+    records["time"] = times
+    walk = self._analog(count)
+    for i, name in enumerate(columnar.ANALOG_CHANNELS):
+      records[name] = walk[:, i]
+    records["packet_bin"] = twinkie.CCEnum.CC1 << 4
+
+    # A message and its GoodCRC take two consecutive records, the messages
+    # of a chunked exchange consecutive pairs; an exchange starting in the
+    # previous one is pushed after it.
+    pairs = count // 2
+    starts = np.sort(rng.choice(
+        pairs, min(pairs, int(count * self.pd_ratio)), replace=False
+    ))
+    kinds = rng.choice(len(self.kinds), size=len(starts), p=self.weights)
+    data = records["data"]
+    free = 0
+    for pair, kind in zip(starts, kinds):
+      messages = _messages(rng, self.kinds[kind], self.msg_ids)
+      pair = max(int(pair), free)
+      if pair + len(messages) > pairs:
+        break
+      for header, payload in messages:
+        message = struct.pack("<H", header) + payload
+        # Same MessageID, sent back by the other port.
+        power_role = 1 - (header >> 8 & 1)
+        good_crc = struct.pack("<H", _header(
+            twinkie.CtrlMesgEnum.GOOD_CRC, 0, header >> 9 & 0b111,
+            power_role, power_role,
+        ))
+        for row, body in ((2 * pair, message), (2 * pair + 1, good_crc)):
+          data[row, :len(body)] = np.frombuffer(body, dtype=np.uint8)
+          records["data_length"][row] = len(body)
+        pair += 1
+      free = pair
+    pd_rows = np.flatnonzero(records["data_length"])
+    records["packet_bin"][pd_rows] |= _PD_FLAG
+
+    sequences = (self.sequence + np.arange(count)) & 0xFFFFFFFF
+    self.sequence = int(sequences[-1] + 1) & 0xFFFFFFFF
+    records["crc"] = crc.device_crcs(
+        records, sequences, zero_data=records["data_length"] == 0
+    )
+    return records
+
+
+def synthetic_records(records, pd_ratio=DEFAULT_PD_RATIO, mix=None, seed=0,
+                      start=DEFAULT_START):
+  """Returns an in-memory synthetic capture.
+
+  Args:
+    records: number of records.
+    pd_ratio: share of the records starting a PD exchange, not counting the
+      GoodCRC that follows each message nor the later chunks of chunked
+      extended messages.
+    mix: relative weights of the message kinds of DEFAULT_MIX.
+    seed: random seed; equal arguments give identical captures.
+    start: capture start datetime.
+
+  Returns:
+    An array of columnar.snooper_packet records.
+  """
+  return _Generator(pd_ratio, mix, seed, start).chunk(records)
+
+
+def generate(path_str, records, pd_ratio=DEFAULT_PD_RATIO, mix=None, seed=0,
+             start=DEFAULT_START):
+  """Writes a synthetic capture, CHUNK_RECORDS records at a time.
+
+  Args:
+    path_str: capture file, or directory to create it in under its
+      control_d name.
+    records: number of records.
+    pd_ratio, mix, seed, start: as in synthetic_records.
+
+  Returns:
+    The path of the written capture.
+  """
+  path = pathlib.Path(path_str)
+  if path.is_dir():
+    path = path / capture_name(start)
+  generator = _Generator(pd_ratio, mix, seed, start)
+  with open(path, "wb") as f:
+    for first in range(0, records, CHUNK_RECORDS):
+      generator.chunk(min(CHUNK_RECORDS, records - first)).tofile(f)
+  return path
+
+
+def _mix(text):
+  """Parses a mix like `src_cap=2,vdm=1`."""
+  mix = {}
+  for item in text.split(","):
+    kind, _, weight = item.partition("=")
+    if kind not in DEFAULT_MIX:
+      raise argparse.ArgumentTypeError(f"unknown message kind: {kind}")
+    mix[kind] = float(weight or 1)
+  return mix
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Write a synthetic capture.")
+  parser.add_argument("path", help="capture file or directory")
+  parser.add_argument("-n", "--records", type=int, default=1 << 20)
+  parser.add_argument(
+      "--pd-ratio", type=float, default=DEFAULT_PD_RATIO,
+      help="share of records holding a PD message",
+  )
+  parser.add_argument(
+      "--mix", type=_mix, default=None,
+      help="message weights, e.g. src_cap=2,request=2,ctrl=4,vdm=1,extended=1",
+  )
+  parser.add_argument("--seed", type=int, default=0)
+  args = parser.parse_args(argv)
+  path = generate(args.path, args.records, args.pd_ratio, args.mix, args.seed)
+  print(path)
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
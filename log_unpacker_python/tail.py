@@ -0,0 +1,230 @@
+"""Live decoding of a capture while twinkie_console is still writing it.
+
+log_file() fwrite()s whole 512-byte records into the open session file. The
+Follower polls the file size, reads the complete records appended since its
+last offset and hands them as record batches to its subscribers. When
+control_d rotates to a new file (SIGUSR1) in the same session directory, the
+follower drains the old file and continues with the new one from its start.
+
+Polling keeps to the standard library; with the default 10 ms interval the
+added latency stays well under 50 ms.
+"""
+
+import argparse
+import os
+import pathlib
+import sys
+import threading
+import time
+
+import numpy as np
+
+import columnar
+import get_header
+import pd_fields
+import session
+
+DEFAULT_POLL_INTERVAL = 0.01
+
+# How often the session directory is listed to notice a rotation.
+ROTATION_CHECK_INTERVAL = 0.2
+
+
+class Follower:
+  """Follows a capture file, or the newest capture of a session directory."""
+
+  def __init__(
+      self,
+      path_str,
+      poll_interval=DEFAULT_POLL_INTERVAL,
+      batch_records=columnar.DEFAULT_BATCH_RECORDS,
+      from_start=True,
+  ):
+    """Opens the capture to follow.
+
+    Args:
+      path_str: capture file, or session directory whose newest capture is
+        followed, rotations included.
+      poll_interval: seconds slept when no new record is available.
+      batch_records: maximum records delivered per batch.
+      from_start: deliver the records already in the file, otherwise start
+        at its current end.
+    """
+    path = pathlib.Path(path_str)
+    self.directory = path if path.is_dir() else None
+    self.poll_interval = poll_interval
+    self.batch_records = batch_records
+    self._subscribers = []
+    self._lock = threading.Lock()
+    self._file = None
+    self.path = None
+    self.offset = 0
+    self._next_rotation_check = 0.0
+
+    if self.directory is not None:
+      path = self._newest()
+    if path is not None:
+      self._open(path)
+      if not from_start:
+        self.offset = self._complete_size()
+
+  def subscribe(self, callback):
+    """Registers callback(path, first_index, batch) for new records."""
+    with self._lock:
+      self._subscribers.append(callback)
+
+  def unsubscribe(self, callback):
+    with self._lock:
+      self._subscribers.remove(callback)
+
+  def close(self):
+    if self._file is not None:
+      self._file.close()
+      self._file = None
+
+  def _newest(self):
+    # Only .bin captures grow; compact ones are converted archives.
+    captures = session.list_captures(self.directory, (".bin",))
+    return captures[-1] if captures else None
+
+  def _open(self, path):
+    self.close()
+    self._file = open(path, "rb")
+    self.path = path
+    self.offset = 0
+
+  def _complete_size(self):
+    size = os.fstat(self._file.fileno()).st_size
+    return size - size % columnar.SNOOPER_PACKET_SIZE
+
+  def _read(self):
+    """Returns the next batch of complete records, or None."""
+    end = self._complete_size()
+    if end < self.offset:
+      # Truncated or rewritten in place: start over.
+      self.offset = 0
+    count = min(
+        (end - self.offset) // columnar.SNOOPER_PACKET_SIZE, self.batch_records
+    )
+    if count <= 0:
+      return None
+    self._file.seek(self.offset)
+    data = self._file.read(count * columnar.SNOOPER_PACKET_SIZE)
+    count = len(data) // columnar.SNOOPER_PACKET_SIZE
+    if not count:
+      return None
+    return np.frombuffer(data, dtype=columnar.snooper_packet, count=count)
+
+  def _rotated(self):
+    """Switches to a newer capture of the directory, if there is one."""
+    now = time.monotonic()
+    if self.directory is None or now < self._next_rotation_check:
+      return False
+    self._next_rotation_check = now + ROTATION_CHECK_INTERVAL
+    newest = self._newest()
+    if newest is None or newest == self.path:
+      return False
+    self._open(newest)
+    return True
+
+  def poll(self):
+    """Delivers the records appended since the last poll.
+
+    Returns:
+      The number of records delivered.
+    """
+    if self._file is None and not self._rotated():
+      return 0
+    batch = self._read()
+    if batch is None:
+      # Only leave a file once it is drained.
+      if not self._rotated():
+        return 0
+      batch = self._read()
+      if batch is None:
+        return 0
+
+    first_index = self.offset // columnar.SNOOPER_PACKET_SIZE
+    self.offset += len(batch) * columnar.SNOOPER_PACKET_SIZE
+    with self._lock:
+      subscribers = list(self._subscribers)
+    for callback in subscribers:
+      callback(self.path, first_index, batch)
+    return len(batch)
+
+  def run(self, stop=None):
+    """Polls until `stop` (a threading.Event) is set."""
+    stop = stop or threading.Event()
+    while not stop.is_set():
+      if not self.poll():
+        stop.wait(self.poll_interval)
+
+
+class _PathPrinter:
+  """Prints the path of the followed capture when following starts and on
+  every rotation.
+
+  Following may start past the first record (from_start=False), so a new
+  capture is noticed by its path rather than by a batch at index 0.
+  """
+
+  def __init__(self):
+    self.path = None
+
+  def show(self, path):
+    if path is not None and path != self.path:
+      self.path = path
+      print(f"# {path}", flush=True)
+
+  def __call__(self, path, first_index, batch):
+    self.show(path)
+
+
+def _print_pd(path, first_index, batch):
+  """Prints the PD messages of a batch like get_header.pd_packet_header."""
+  fields = pd_fields.decode_records(batch)
+  role = pd_fields.packed_role(fields)
+  for i in np.flatnonzero(batch["data_length"]):
+    print(
+        get_header.pd_packet_header(
+            first_index + int(i),
+            int(batch["time"][i]),
+            int(fields["cc"][i]),
+            int(fields["sop"][i]),
+            int(fields["msg_typ"][i]),
+            int(role[i]),
+            int(fields["msg_id"][i]),
+            int(fields["num_data_obj"][i]),
+            int(fields["extended"][i]),
+        ),
+        flush=True,
+    )
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(
+      description="Print the PD messages of a capture as it is written."
+  )
+  parser.add_argument("path", help="capture file or session directory")
+  parser.add_argument(
+      "--from-end", action="store_true",
+      help="skip the records already written",
+  )
+  args = parser.parse_args(argv)
+
+  follower = Follower(args.path, from_start=not args.from_end)
+  printer = _PathPrinter()
+  printer.show(follower.path)
+  follower.subscribe(printer)
+  follower.subscribe(_print_pd)
+  try:
+    follower.run()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    follower.close()
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,89 @@
+"""Round trip of captures through the compact format (compact.py).
+
+  python -m unittest test_compact   # from log_unpacker_python
+"""
+
+import pathlib
+import tempfile
+import unittest
+
+import numpy as np
+
+import columnar
+import compact
+import synth
+
+BLOCK_RECORDS = 1000
+
+
+def _garbage_records(count, seed):
+  """Records of random bytes: data_length past the data, stray bytes past
+  data_length and CRCs of no sequence number."""
+  rng = np.random.default_rng(seed)
+  data = rng.integers(256, size=count * columnar.SNOOPER_PACKET_SIZE)
+  return np.frombuffer(
+      data.astype(np.uint8).tobytes(), dtype=columnar.snooper_packet
+  )
+
+
+class RoundTripTest(unittest.TestCase):
+
+  def setUp(self):
+    self._dir = tempfile.TemporaryDirectory()
+    self.dir = pathlib.Path(self._dir.name)
+
+  def tearDown(self):
+    self._dir.cleanup()
+
+  def round_trip(self, raw):
+    """Packs and unpacks `raw` .bin bytes and checks every byte comes back."""
+    src = self.dir / "2024_0_15_10_0_0.bin"
+    src.write_bytes(raw)
+    packed = compact.pack(src, block_records=BLOCK_RECORDS)
+    self.assertTrue(compact.is_compact(packed))
+    self.assertEqual(compact.raw_bytes(packed), raw)
+    unpacked = compact.unpack(packed, self.dir / "unpacked.bin")
+    self.assertEqual(unpacked.read_bytes(), raw)
+
+    count = len(raw) // columnar.SNOOPER_PACKET_SIZE
+    records = np.frombuffer(
+        raw, dtype=columnar.snooper_packet, count=count
+    )
+    with compact.CompactReader(packed) as reader:
+      self.assertEqual(len(reader), count)
+      self.assertEqual(reader.read().tobytes(), records.tobytes())
+      self.assertEqual(
+          reader.read(BLOCK_RECORDS - 3, BLOCK_RECORDS + 5).tobytes(),
+          records[BLOCK_RECORDS - 3:BLOCK_RECORDS + 5].tobytes(),
+      )
+    batches = list(columnar.iter_batches(packed, 777))
+    self.assertEqual(
+        b"".join(batch.tobytes() for batch in batches), records.tobytes()
+    )
+
+  def test_synthetic(self):
+    records = synth.synthetic_records(2500, pd_ratio=0.2, seed=1)
+    self.round_trip(records.tobytes())
+
+  def test_truncated_tail(self):
+    records = synth.synthetic_records(1200, seed=2)
+    self.round_trip(records.tobytes() + bytes(range(200)))
+
+  def test_garbage(self):
+    records = synth.synthetic_records(1500, seed=3)
+    raw = bytearray(records.tobytes())
+    garbage = _garbage_records(40, 4).tobytes()
+    position = 900 * columnar.SNOOPER_PACKET_SIZE
+    raw[position:position + len(garbage)] = garbage
+    self.round_trip(bytes(raw) + garbage[:300])
+
+  def test_only_garbage(self):
+    self.round_trip(_garbage_records(BLOCK_RECORDS + 1, 5).tobytes())
+
+  def test_empty(self):
+    self.round_trip(b"")
+    self.round_trip(b"\x01" * 100)
+
+
+if __name__ == "__main__":
+  unittest.main()
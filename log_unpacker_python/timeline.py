@@ -0,0 +1,269 @@
+"""Timeline of captures and time-window queries.
+
+log_file() stores in the sequence field the local wall-clock time as
+milliseconds counted from day 0 of the current month (`tm_mday` is 1-based),
+so the value drops at every month boundary. Combined with the capture start
+that control_d encodes in the file name, it converts into an absolute
+timeline. Times here are milliseconds since 1970-01-01 in local wall-clock
+time, so naive local datetimes convert without a time zone.
+
+The timeline is only monotonic while the host clock is: a clock set back
+by less than _ROLLOVER_DROP steps the times back with it (health.py counts
+these as `backwards`), and they are kept as logged rather than clamped, so
+that every record keeps the time it was written at.
+"""
+
+import bisect
+import calendar
+import datetime
+
+import numpy as np
+
+import columnar
+import session
+
+MS_PER_DAY = 24 * 60 * 60 * 1000
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+# A drop of the raw counter larger than this is a month rollover, smaller
+# ones are host clock adjustments, left in the timeline as steps back.
+_ROLLOVER_DROP = MS_PER_DAY // 2
+
+
+def to_ms(when):
+  """Converts a naive local datetime (or a ms value) to timeline ms."""
+  if isinstance(when, datetime.datetime):
+    return (when - _EPOCH) // datetime.timedelta(milliseconds=1)
+  return int(when)
+
+
+def to_datetime(ms):
+  """Converts timeline ms back to a naive local datetime."""
+  return _EPOCH + datetime.timedelta(milliseconds=int(ms))
+
+
+def _month_start(when):
+  return datetime.datetime(when.year, when.month, 1)
+
+
+def _raw_ms(when):
+  """The log_file() timer value of a datetime."""
+  return to_ms(when) - to_ms(_month_start(when)) + MS_PER_DAY
+
+
+def _month_offsets(start, count):
+  """Returns the ms offset of day 0 of `count` months from `start`'s month."""
+  offsets = [to_ms(_month_start(start)) - MS_PER_DAY]
+  year, month = start.year, start.month
+  for _ in range(count - 1):
+    offsets.append(offsets[-1] + calendar.monthrange(year, month)[1] * MS_PER_DAY)
+    year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+  return np.array(offsets, dtype=np.int64)
+
+
+def absolute_times(raw, start):
+  """Converts raw log_file() timers into timeline ms.
+
+  The ms rise with the records except across host clock steps back, which
+  are kept (see the module docstring).
+
+  Args:
+    raw: array of the `time` field of consecutive records of one capture.
+    start: datetime the capture was opened at (session.capture_start).
+
+  Returns:
+    An int64 array of timeline ms.
+  """
+  raw = np.asarray(raw, dtype=np.int64)
+  if not len(raw):
+    return raw
+  rollover = np.zeros(len(raw), dtype=np.int64)
+  # The first records may already belong to the month after the file name.
+  rollover[0] = raw[0] < _raw_ms(start) - _ROLLOVER_DROP
+  rollover[1:] = np.diff(raw) < -_ROLLOVER_DROP
+  month = np.cumsum(rollover)
+  return _month_offsets(start, int(month[-1]) + 1)[month] + raw
+
+
+class Timeline:
+  """Timeline of one capture, with O(log n) time-window queries.
+
+  Building one reads the time field of the first and last records, and of
+  O(log n) more to find the month rollover when the last one is past it;
+  queries read the time field of O(log n) records of the memory map. Those
+  of a compact capture find their block from the block index and decode it
+  alone. A capture is assumed to span less than a month.
+  """
+
+  def __init__(self, path_str, start=None, raw=None, blocks=None):
+    """Maps the time field of a capture.
+
+    Args:
+      path_str: path of the capture.
+      start: capture start datetime, taken from the file name by default.
+      raw: time column to query, anything indexed like an array; by default
+        the column of columnar.lazy_records, so that neither a .bin nor a
+        compact capture is read beyond the records queried.
+      blocks: block index (compact.block_entry) of a compact `raw`; taken
+        from the capture when `raw` is not given.
+    """
+    self.path = path_str
+    self.start = start or session.capture_start(path_str)
+    if self.start is None:
+      raise ValueError(f"no start time in capture name: {path_str}")
+    if raw is None:
+      records = columnar.lazy_records(path_str)
+      raw = records["time"]
+      blocks = getattr(records, "blocks", None)
+    self._raw = raw
+    self._blocks = blocks
+    offsets = _month_offsets(self.start, 3)
+    if not len(self._raw):
+      self._offsets = offsets[:1]
+      self._rollover = 0
+      return
+    first = int(self._raw[0])
+    if first < _raw_ms(self.start) - _ROLLOVER_DROP:
+      offsets = offsets[1:]
+    self._offsets = offsets
+    # First index of the next month, found by bisection on the counter drop
+    # when the last record, whose time a block index has, is past it.
+    last = self._raw[-1] if blocks is None else blocks["last_time"][-1]
+    self._rollover = len(self._raw)
+    if int(last) < first - _ROLLOVER_DROP:
+      self._rollover = self._first_where(
+          lambda indices, raw: raw < first - _ROLLOVER_DROP
+      )
+
+  def _first_where(self, key):
+    """Bisection for the first record where key(indices, raw timers) holds.
+
+    `key` must turn from false to true once along the capture, and works on
+    arrays. With a block index, the block is found from the raw time of the
+    last record of every block, and only that block is read.
+    """
+    if self._blocks is None:
+      return bisect.bisect_left(
+          range(len(self._raw)), True,
+          key=lambda i: bool(key(i, int(self._raw[i]))),
+      )
+    starts = self._blocks["first_record"].astype(np.int64)
+    lasts = starts + self._blocks["records"] - 1
+    found = key(lasts, self._blocks["last_time"].astype(np.int64))
+    if not found.any():
+      return len(self._raw)
+    block = int(np.argmax(found))
+    first = int(starts[block])
+    raw = np.asarray(self._raw[first:int(lasts[block]) + 1], dtype=np.int64)
+    return first + int(np.argmax(key(np.arange(first, first + len(raw)), raw)))
+
+  def __len__(self):
+    return len(self._raw)
+
+  def time_at(self, index):
+    """Returns the timeline ms of a record."""
+    month = 1 if index >= self._rollover else 0
+    return int(self._offsets[month]) + int(self._raw[index])
+
+  def times(self, start=0, stop=None):
+    """Returns the timeline ms of records [start, stop) in one pass."""
+    stop = len(self) if stop is None else stop
+    raw = np.asarray(self._raw[start:stop], dtype=np.int64)
+    month = (np.arange(start, start + len(raw)) >= self._rollover).astype(int)
+    return self._offsets[month] + raw
+
+  def times_at(self, indices):
+    """Returns the timeline ms of the records at `indices`, in any order."""
+    indices = np.asarray(indices, dtype=np.int64)
+    return self.times_of(indices, self._raw[indices])
+
+  def times_of(self, indices, raw):
+    """Returns the timeline ms of the records at `indices` from their raw
+    timers `raw` read elsewhere, e.g. a compact block index."""
+    indices = np.asarray(indices, dtype=np.int64)
+    raw = np.asarray(raw, dtype=np.int64)
+    return self._offsets[(indices >= self._rollover).astype(int)] + raw
+
+  def index_at(self, when):
+    """Returns the index of the first record at or after `when`.
+
+    Across a host clock step back the times are not sorted, and the result
+    is then some index i with time(i - 1) < when <= time(i) (or len(self)),
+    not necessarily the first such record: records logged before the step
+    with a later time than records after it may fall on either side.
+    """
+    ms = to_ms(when)
+    return self._first_where(
+        lambda indices, raw: self.times_of(indices, raw) >= ms
+    )
+
+  def window(self, begin, end):
+    """Returns the slice of records with begin <= time < end.
+
+    When the host clock stepped back inside the capture, the slice bounds are
+    as in index_at, and the slice may include records outside [begin, end)
+    or miss some inside it around the step.
+
+    Args:
+      begin: naive local datetime or timeline ms.
+      end: naive local datetime or timeline ms.
+    """
+    return slice(self.index_at(begin), self.index_at(end))
+
+
+def timed_batches(path_str, batch_records=columnar.DEFAULT_BATCH_RECORDS):
+  """Streams a capture with the timeline ms of its records.
+
+  The ms are converted from the timers of each batch (Timeline.times_of),
+  so a .bin or compact capture is read once, a batch at a time.
+
+  Args:
+    path_str: path of the .bin or compact capture.
+    batch_records: records read at a time (columnar.iter_batches).
+
+  Yields:
+    (first, batch, times): the index of the first record of the batch, its
+    records, and their timeline ms, or None when the capture name carries
+    no start (session.capture_start), leaving only the raw log timer.
+  """
+  line = None
+  if session.capture_start(path_str) is not None:
+    line = Timeline(path_str)
+  first = 0
+  for batch in columnar.iter_batches(path_str, batch_records):
+    times = None
+    if line is not None:
+      times = line.times_of(np.arange(first, first + len(batch)), batch["time"])
+    yield first, batch, times
+    first += len(batch)
+
+
+class DirectoryTimeline:
+  """Timeline across the captures of a session directory."""
+
+  def __init__(self, dir_str):
+    self.timelines = [
+        Timeline(path)
+        for path in session.list_captures(dir_str)
+        if session.capture_start(path) is not None
+    ]
+    self.timelines = [t for t in self.timelines if len(t)]
+    self._firsts = [t.time_at(0) for t in self.timelines]
+
+  def times(self):
+    """Returns the concatenated timeline ms of every capture."""
+    if not self.timelines:
+      return np.empty(0, dtype=np.int64)
+    return np.concatenate([t.times() for t in self.timelines])
+
+  def window(self, begin, end):
+    """Returns the (path, slice) pairs of records with begin <= time < end."""
+    begin, end = to_ms(begin), to_ms(end)
+    first = max(bisect.bisect_right(self._firsts, begin) - 1, 0)
+    last = bisect.bisect_left(self._firsts, end)
+    result = []
+    for t in self.timelines[first:last]:
+      window = t.window(begin, end)
+      if window.stop > window.start:
+        result.append((t.path, window))
+    return result
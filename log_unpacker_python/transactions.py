@@ -0,0 +1,478 @@
+"""PD transaction reconstruction and negotiation latency analytics.
+
+Works on the rows of the PD index (pd_index.py) in one streaming pass:
+
+* every message is paired with the GoodCRC that immediately follows it on the
+  same SOP with the same MessageID, giving the GoodCRC turnaround;
+* a message repeating the type and MessageID of the previous message of the
+  same sender (SOP and power role / cable plug) is a retry;
+* the SOP messages that are neither GoodCRC nor retries are matched against
+  the Atomic Message Sequences of AMS_STEPS, giving one row per sequence with
+  its outcome and the latency of every step;
+* hard resets, cable resets and Soft_Reset messages are listed as resets.
+
+Each feed() is vectorized; the few messages a chunk boundary leaves
+undecided are carried over to the next feed, so the results do not depend on
+the chunking. Times come from the capture timeline (timeline.py) when the
+capture name carries its start, in whole milliseconds like the log_file()
+timer.
+"""
+
+import argparse
+import collections
+import sys
+
+import numpy as np
+
+import columnar
+import pd_fields
+import pd_index
+import session
+import timeline
+import twinkie
+
+DEFAULT_CHUNK_ENTRIES = 1 << 16
+
+_CTRL = twinkie.CtrlMesgEnum
+_DATA = twinkie.DataMesgEnum
+_EXT = twinkie.ExtMesgEnum
+
+
+def message_code(kind, msg_typ):
+  """Returns the code of a message type: its kind (pd_fields.MSG_*) and type."""
+  return (kind << 5) | msg_typ
+
+
+def code_name(code):
+  """Returns the enum name of a message code."""
+  if code == HARD_RESET:
+    return "HARD_RESET"
+  if code == CABLE_RESET:
+    return "CABLE_RESET"
+  enum = (_CTRL, _DATA, _EXT)[code >> 5]
+  try:
+    return enum(code & 0b11111).name
+  except ValueError:
+    return f"RESERVED_{code >> 5}_{code & 0b11111}"
+
+
+def _ctrl(msg_typ):
+  return message_code(pd_fields.MSG_CTRL, msg_typ)
+
+
+def _data(msg_typ):
+  return message_code(pd_fields.MSG_DATA, msg_typ)
+
+
+def _ext(msg_typ):
+  return message_code(pd_fields.MSG_EXT, msg_typ)
+
+
+GOOD_CRC = _ctrl(_CTRL.GOOD_CRC)
+SOFT_RESET = _ctrl(_CTRL.SOFT_RESET)
+
+# Code of the records of a hard or cable reset, whatever their header holds.
+HARD_RESET = -1
+CABLE_RESET = -2
+
+# Message sequence of every AMS, from its initiating message.
+AMS_STEPS = {
+    "power_negotiation": (
+        _data(_DATA.SRC_CAP), _data(_DATA.REQUEST), _ctrl(_CTRL.ACCEPT),
+        _ctrl(_CTRL.PS_RDY),
+    ),
+    "get_source_cap": (_ctrl(_CTRL.GET_SRC_CAP), _data(_DATA.SRC_CAP)),
+    "get_sink_cap": (_ctrl(_CTRL.GET_SNK_CAP), _data(_DATA.SNK_CAP)),
+    "power_role_swap": (
+        _ctrl(_CTRL.PR_SWAP), _ctrl(_CTRL.ACCEPT), _ctrl(_CTRL.PS_RDY),
+        _ctrl(_CTRL.PS_RDY),
+    ),
+    "fast_role_swap": (
+        _ctrl(_CTRL.FR_SWAP), _ctrl(_CTRL.ACCEPT), _ctrl(_CTRL.PS_RDY),
+        _ctrl(_CTRL.PS_RDY),
+    ),
+    "vconn_swap": (
+        _ctrl(_CTRL.VCONN_SWAP), _ctrl(_CTRL.ACCEPT), _ctrl(_CTRL.PS_RDY),
+    ),
+    "data_role_swap": (_ctrl(_CTRL.DR_SWAP), _ctrl(_CTRL.ACCEPT)),
+    "soft_reset": (_ctrl(_CTRL.SOFT_RESET), _ctrl(_CTRL.ACCEPT)),
+    "data_reset": (
+        _ctrl(_CTRL.DATA_RESET), _ctrl(_CTRL.ACCEPT),
+        _ctrl(_CTRL.DATA_RESET_COMPLETE),
+    ),
+    "get_status": (_ctrl(_CTRL.GET_STATUS), _ext(_EXT.EXT_STATUS)),
+    "get_pps_status": (_ctrl(_CTRL.GET_PPS_STATUS), _ext(_EXT.EXT_PPS_STATUS)),
+}
+AMS_NAMES = tuple(AMS_STEPS)
+MAX_STEPS = max(len(steps) for steps in AMS_STEPS.values())
+
+# Outcome of an AMS: completed, refused by the message at the first step it
+# did not follow, or interrupted by anything else (end of capture included).
+OUTCOMES = ("complete", "reject", "wait", "not_supported", "interrupted")
+COMPLETE = 0
+INTERRUPTED = len(OUTCOMES) - 1
+_REFUSALS = {
+    _ctrl(_CTRL.REJECT): OUTCOMES.index("reject"),
+    _ctrl(_CTRL.WAIT): OUTCOMES.index("wait"),
+    _ctrl(_CTRL.NOT_SUPPORTED): OUTCOMES.index("not_supported"),
+}
+
+message_row = np.dtype([
+    ("index", "<i8"),
+    ("time", "<i8"),
+    ("sop", "u1"),
+    ("role", "u1"),
+    ("code", "<i2"),
+    ("msg_id", "u1"),
+    ("retry", "?"),
+    ("goodcrc_ms", "<i8"),
+])
+
+ams_row = np.dtype([
+    ("ams", "u1"),
+    ("index", "<i8"),
+    ("time", "<i8"),
+    ("steps", "u1"),
+    ("outcome", "u1"),
+    ("step_ms", "<i8", (MAX_STEPS - 1,)),
+    ("total_ms", "<i8"),
+])
+
+Transactions = collections.namedtuple(
+    "Transactions", ["messages", "ams", "good_crcs", "bad_crc"]
+)
+
+
+def _messages(entries, times):
+  """Converts PD index rows into message rows, not yet paired."""
+  messages = np.zeros(len(entries), dtype=message_row)
+  messages["index"] = entries["offset"] // columnar.SNOOPER_PACKET_SIZE
+  messages["time"] = times
+  messages["sop"] = entries["sop"]
+  messages["role"] = entries["role"]
+  messages["msg_id"] = entries["msg_id"]
+  kind = np.where(
+      entries["extended"],
+      pd_fields.MSG_EXT,
+      np.where(entries["num_data_obj"] != 0, pd_fields.MSG_DATA,
+               pd_fields.MSG_CTRL),
+  )
+  code = message_code(kind, entries["msg_typ"].astype(np.int16))
+  code = np.where(entries["sop"] == twinkie.SoPEnum.HRST, HARD_RESET, code)
+  code = np.where(entries["sop"] == twinkie.SoPEnum.CRST, CABLE_RESET, code)
+  messages["code"] = code
+  messages["goodcrc_ms"] = -1
+  return messages
+
+
+def _sender(messages):
+  """Returns the sender key: the SOP and the power role / cable plug bit."""
+  return messages["sop"].astype(np.int16) << 1 | (messages["role"] >> 3) & 1
+
+
+class TransactionEngine:
+  """Streaming reconstruction of the PD transactions of a capture."""
+
+  def __init__(self, check_crc=False):
+    """Creates an engine.
+
+    Args:
+      check_crc: leave out, and count as `bad_crc`, the rows whose `crc_ok`
+        is False; only meaningful for an index built with check_crc.
+    """
+    self.check_crc = check_crc
+    self._pending = np.empty(0, dtype=message_row)
+    self._ams_pending = np.empty(0, dtype=message_row)
+    self._last_sent = {}
+    self._resets = 0
+    self._messages = []
+    self._ams = []
+    self._good_crcs = 0
+    self._bad_crc = 0
+
+  def feed(self, entries, times=None):
+    """Processes the next PD index rows of the capture.
+
+    Args:
+      entries: consecutive `pd_index.pd_index_entry` rows.
+      times: timeline ms of the rows, their raw `time` field by default.
+    """
+    if times is None:
+      times = entries["time"]
+    times = np.asarray(times)
+    if self.check_crc:
+      crc_ok = entries["crc_ok"]
+      self._bad_crc += int(np.count_nonzero(~crc_ok))
+      entries, times = entries[crc_ok], times[crc_ok]
+    messages = np.concatenate([self._pending, _messages(entries, times)])
+    # The last message may still get its GoodCRC from the next rows.
+    self._pending = messages[-1:]
+    self._process(messages, len(messages) - 1)
+
+  def finish(self):
+    """Processes the carried-over messages and returns the Transactions."""
+    self._process(self._pending, len(self._pending))
+    self._pending = self._pending[:0]
+    self._match_ams(final=True)
+    ams = np.concatenate(self._ams) if self._ams else np.empty(0, ams_row)
+    return Transactions(
+        messages=(
+            np.concatenate(self._messages)
+            if self._messages
+            else np.empty(0, message_row)
+        ),
+        ams=ams[np.argsort(ams["index"], kind="stable")],
+        good_crcs=self._good_crcs,
+        bad_crc=self._bad_crc,
+    )
+
+  def _process(self, messages, count):
+    """Pairs `messages` with their GoodCRC and finalizes the first `count`."""
+    good_crc = messages["code"] == GOOD_CRC
+    acked = np.flatnonzero(good_crc[1:] & ~good_crc[:-1])
+    acked = acked[
+        (messages["sop"][acked] == messages["sop"][acked + 1])
+        & (messages["msg_id"][acked] == messages["msg_id"][acked + 1])
+    ]
+    messages["goodcrc_ms"][acked] = (
+        messages["time"][acked + 1] - messages["time"][acked]
+    )
+
+    done = messages[:count]
+    self._good_crcs += int(np.count_nonzero(good_crc[:count]))
+    done = done[~good_crc[:count]]
+    self._mark_retries(done)
+    self._messages.append(done)
+
+    sequence = done[
+        ~done["retry"]
+        & ((done["sop"] == twinkie.SoPEnum.SOP) | (done["code"] < 0))
+    ]
+    self._ams_pending = np.concatenate([self._ams_pending, sequence])
+    self._match_ams(final=False)
+
+  def _mark_retries(self, messages):
+    """Flags the messages repeating the previous one of their sender.
+
+    Resets restart the MessageID counters, so no message is compared with
+    one sent before a reset.
+    """
+    if not len(messages):
+      return
+    epoch = self._resets + np.cumsum(messages["code"] < 0)
+    self._resets = int(epoch[-1])
+    sender = _sender(messages)
+    order = np.argsort(sender, kind="stable")
+    s = sender[order]
+    key = np.stack(
+        [messages["code"][order], messages["msg_id"][order], epoch[order]]
+    ).astype(np.int64)
+
+    prev = np.empty_like(key)
+    prev[:, 1:] = key[:, :-1]
+    firsts = np.flatnonzero(np.r_[True, s[1:] != s[:-1]])
+    for first in firsts:
+      prev[:, first] = self._last_sent.get(int(s[first]), -1)
+    retry = (prev == key).all(axis=0)
+    # Resets carry no meaningful header.
+    retry &= key[0] >= 0
+    messages["retry"][order] = retry
+
+    lasts = np.r_[firsts[1:], len(s)] - 1
+    for last in lasts:
+      self._last_sent[int(s[last])] = key[:, last]
+
+  def _match_ams(self, final):
+    """Matches the AMS starting at the carried-over sequence messages.
+
+    Only starts whose MAX_STEPS window is complete are matched, unless
+    `final`; the others stay carried over.
+    """
+    sequence = self._ams_pending
+    starts = len(sequence) if final else len(sequence) - (MAX_STEPS - 1)
+    if starts <= 0:
+      return
+    pad = MAX_STEPS - 1
+    codes = np.r_[sequence["code"].astype(np.int32), np.full(pad, -1 << 16)]
+    times = np.r_[sequence["time"], np.zeros(pad, dtype=np.int64)]
+    code_windows = np.lib.stride_tricks.sliding_window_view(codes, MAX_STEPS)
+    time_windows = np.lib.stride_tricks.sliding_window_view(times, MAX_STEPS)
+    code_windows = code_windows[:starts]
+    time_windows = time_windows[:starts]
+
+    for ams, steps in enumerate(AMS_STEPS.values()):
+      where = np.flatnonzero(code_windows[:, 0] == steps[0])
+      if not len(where):
+        continue
+      codes_at = code_windows[where]
+      times_at = time_windows[where]
+      matched = np.cumprod(codes_at[:, :len(steps)] == steps, axis=1)
+      reached = matched.sum(axis=1)
+
+      rows = np.empty(len(where), dtype=ams_row)
+      rows["ams"] = ams
+      rows["index"] = sequence["index"][where]
+      rows["time"] = times_at[:, 0]
+      rows["steps"] = reached
+      outcome = np.full(len(where), INTERRUPTED, dtype=np.uint8)
+      outcome[reached == len(steps)] = COMPLETE
+      refused_by = codes_at[np.arange(len(where)), np.minimum(reached, pad)]
+      for code, refusal in _REFUSALS.items():
+        outcome[(reached < len(steps)) & (refused_by == code)] = refusal
+      rows["outcome"] = outcome
+
+      step_ms = np.diff(times_at, axis=1)
+      step_ms[np.arange(pad) >= (reached - 1)[:, None]] = -1
+      rows["step_ms"] = step_ms
+      last_step = times_at[np.arange(len(where)), reached - 1]
+      rows["total_ms"] = last_step - times_at[:, 0]
+      self._ams.append(rows)
+    self._ams_pending = sequence[starts:]
+
+
+def message_times(path_str, entries):
+  """Returns the timeline ms of PD index rows, their raw time if unknown."""
+  if session.capture_start(path_str) is None:
+    return np.asarray(entries["time"], dtype=np.int64)
+  return timeline.Timeline(path_str).times_of(
+      entries["offset"] // columnar.SNOOPER_PACKET_SIZE, entries["time"]
+  )
+
+
+def analyze(path_str, chunk_entries=DEFAULT_CHUNK_ENTRIES, check_crc=False):
+  """Reconstructs the transactions of a capture from its PD index.
+
+  Args:
+    path_str: path of the .bin capture.
+    chunk_entries: index rows processed at a time.
+    check_crc: leave out the records failing their CRC; logged captures
+      cannot be verified (crc.py), so only for device packets.
+
+  Returns:
+    Transactions: `messages` (message_row, GoodCRC excluded), `ams`
+    (ams_row), the count of GoodCRC messages and of rows failing the CRC
+    (0 without check_crc).
+  """
+  entries = pd_index.get_index(path_str, check_crc)
+  times = message_times(path_str, entries)
+  engine = TransactionEngine(check_crc)
+  for first in range(0, len(entries), chunk_entries):
+    last = first + chunk_entries
+    engine.feed(entries[first:last], times[first:last])
+  return engine.finish()
+
+
+def distribution(values):
+  """Returns count, min, p50, p90, p99, max and mean of latencies in ms."""
+  values = np.asarray(values)
+  if not len(values):
+    return {"count": 0}
+  p50, p90, p99 = np.percentile(values, (50, 90, 99))
+  return {
+      "count": len(values),
+      "min": int(values.min()),
+      "p50": float(p50),
+      "p90": float(p90),
+      "p99": float(p99),
+      "max": int(values.max()),
+      "mean": float(values.mean()),
+  }
+
+
+def summary(transactions):
+  """Summarizes Transactions into latency distributions and counters.
+
+  Returns:
+    A dict with `goodcrc_ms` (distribution per SOP name), `ams` (per AMS
+    name: outcome counts, and the distribution of every step and of the
+    whole of the completed sequences), `retries` and `resets` counts.
+  """
+  messages = transactions.messages
+  acked = messages[messages["goodcrc_ms"] >= 0]
+  goodcrc = {
+      twinkie.SoPEnum(sop).name: distribution(
+          acked["goodcrc_ms"][acked["sop"] == sop]
+      )
+      for sop in np.unique(acked["sop"])
+  }
+
+  ams = {}
+  for i, name in enumerate(AMS_NAMES):
+    rows = transactions.ams[transactions.ams["ams"] == i]
+    if not len(rows):
+      continue
+    steps = AMS_STEPS[name]
+    complete = rows[rows["outcome"] == COMPLETE]
+    ams[name] = {
+        "outcomes": {
+            outcome: int(np.count_nonzero(rows["outcome"] == j))
+            for j, outcome in enumerate(OUTCOMES)
+        },
+        "steps": [
+            distribution(rows["step_ms"][rows["steps"] > k + 1, k])
+            for k in range(len(steps) - 1)
+        ],
+        "total_ms": distribution(complete["total_ms"]),
+    }
+
+  code = messages["code"]
+  return {
+      "messages": len(messages),
+      "good_crcs": transactions.good_crcs,
+      "unacknowledged": int(np.count_nonzero(
+          (messages["goodcrc_ms"] < 0) & (code >= 0)
+      )),
+      "bad_crc": transactions.bad_crc,
+      "retries": int(np.count_nonzero(messages["retry"])),
+      "resets": {
+          "hard": int(np.count_nonzero(code == HARD_RESET)),
+          "cable": int(np.count_nonzero(code == CABLE_RESET)),
+          "soft": int(np.count_nonzero(code == SOFT_RESET)),
+      },
+      "goodcrc_ms": goodcrc,
+      "ams": ams,
+  }
+
+
+def _format_distribution(d):
+  if not d["count"]:
+    return "-"
+  return (
+      f"n={d['count']} min={d['min']} p50={d['p50']:g} p90={d['p90']:g} "
+      f"p99={d['p99']:g} max={d['max']}"
+  )
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(
+      description="Print the PD transaction latencies of a capture."
+  )
+  parser.add_argument("capture")
+  parser.add_argument(
+      "--check-crc", action="store_true",
+      help="leave out the records failing their CRC",
+  )
+  args = parser.parse_args(argv)
+
+  s = summary(analyze(args.capture, check_crc=args.check_crc))
+  print(
+      f"messages {s['messages']}  GoodCRC {s['good_crcs']}  "
+      f"unacknowledged {s['unacknowledged']}  retries {s['retries']}  "
+      f"bad CRC {s['bad_crc']}"
+  )
+  print("resets " + "  ".join(f"{k} {v}" for k, v in s["resets"].items()))
+  for sop, d in s["goodcrc_ms"].items():
+    print(f"GoodCRC {sop}: {_format_distribution(d)}")
+  for name, a in s["ams"].items():
+    outcomes = "  ".join(f"{k} {v}" for k, v in a["outcomes"].items() if v)
+    print(f"{name}: {outcomes}")
+    steps = AMS_STEPS[name]
+    for k, d in enumerate(a["steps"]):
+      step = f"{code_name(steps[k])} -> {code_name(steps[k + 1])}"
+      print(f"  {step}: {_format_distribution(d)}")
+    print(f"  total: {_format_distribution(a['total_ms'])}")
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -1,7 +1,6 @@
 """The data package for the twinkie and top layer of the Power Delivery."""
 
 import enum
-import pathlib
 
 import construct as ct
 import data_mesg
@@ -242,15 +241,20 @@ twinkie_typ = util.ByteSwappedBitStruct(
     ct.Padding(4),
     __size=2,
 )
-twinkie = ct.Struct(
-    "time" / ct.Int32ul,
-    "cc1_v" / ct.Int16ul,
-    "cc2_v" / ct.Int16ul,
-    "cc2_c" / ct.Int16ul,
-    "vbus_v" / ct.Int16ul,
-    "vbus_c" / ct.Int16ul,
-    "packet_bin" / twinkie_typ,
-    "data_length" / ct.Int16ul,
-    ct.Padding(2),
-    "pd" / ct.If(ct.this.data_length, pd),
-).compile(pathlib.Path(__file__).parent / "__pycache__" / "compile_twinkie.py")
+twinkie = util.LazyCompiled(
+    ct.Struct(
+        "time" / ct.Int32ul,
+        "cc1_v" / ct.Int16ul,
+        "cc2_v" / ct.Int16ul,
+        "cc2_c" / ct.Int16ul,
+        "vbus_v" / ct.Int16ul,
+        "vbus_c" / ct.Int16ul,
+        "packet_bin" / twinkie_typ,
+        "data_length" / ct.Int16ul,
+        ct.Padding(2),
+        "pd" / ct.If(ct.this.data_length, pd),
+    ),
+    "twinkie",
+    __file__,
+    data_mesg.__file__,
+)
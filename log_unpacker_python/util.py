@@ -1,7 +1,21 @@
 """command util that use for log_unpacker."""
 
+import hashlib
+import importlib.machinery
+import importlib.util
+import marshal
+import os
+import pathlib
+import re
+import sys
+import threading
+
 import construct as ct
 
+CACHE_DIR = pathlib.Path(__file__).parent / "__pycache__"
+
+_LINKED_RE = re.compile(r"\blinked(instances|parsers|builders)\[(\d+)\]")
+
 
 def ByteSwappedBitStruct(*subcons, **subconskw):
   """A helper function to construct the Fixex size ByteSwapped BitStruct."""
@@ -10,3 +24,157 @@ def ByteSwappedBitStruct(*subcons, **subconskw):
   return ct.ByteSwapped(
       ct.FixedSized(size, ct.BitStruct(*subcons, **subconskw))
   )
+
+
+def _walk(subcon):
+  """Yields every construct reachable from `subcon` in a stable order."""
+  stack = [subcon]
+  seen = set()
+  while stack:
+    node = stack.pop()
+    if not isinstance(node, ct.Construct) or id(node) in seen:
+      continue
+    seen.add(id(node))
+    yield node
+    children = []
+    for attr in ("subcon", "thensubcon", "elsesubcon", "default"):
+      children.append(getattr(node, attr, None))
+    children.extend(getattr(node, "subcons", None) or ())
+    children.extend((getattr(node, "cases", None) or {}).values())
+    stack.extend(reversed(children))
+
+
+def _definitions_key(name, definitions):
+  digest = hashlib.sha256()
+  for part in (name, ct.__version__, sys.implementation.cache_tag):
+    digest.update(part.encode() + b"\0")
+  for path in (__file__, *definitions):
+    digest.update(pathlib.Path(path).read_bytes())
+  return digest.hexdigest()[:20]
+
+
+def _normalize(compiled, subcon):
+  """Rewrites the object ids of the generated source as walk positions.
+
+  Returns the process independent source and the walk positions of the
+  linked constructs, or None if a linked construct is not reachable.
+  """
+  position = {id(node): i for i, node in enumerate(_walk(subcon))}
+  links = {}
+
+  def replace(match):
+    node_id = int(match.group(2))
+    if node_id not in position:
+      raise KeyError(node_id)
+    links[position[node_id]] = True
+    return f"linked{match.group(1)}[{position[node_id]}]"
+
+  try:
+    source = _LINKED_RE.sub(replace, compiled.source)
+  except KeyError:
+    return None
+  return source, sorted(links)
+
+
+def _load(code, links, subcon):
+  """Executes cached generated code and returns its Compiled construct."""
+  nodes = list(_walk(subcon))
+  module_spec = importlib.machinery.ModuleSpec(f"compiled_{id(subcon)}", None)
+  module = importlib.util.module_from_spec(module_spec)
+  exec(code, module.__dict__)
+  module.linkedinstances = {}
+  module.linkedparsers = {}
+  module.linkedbuilders = {}
+  for i in links:
+    field = ct.core.extractfield(nodes[i])
+    module.linkedinstances[i] = field
+    module.linkedparsers[i] = field._parse
+    module.linkedbuilders[i] = field._build
+  compiled = module.compiled
+  compiled.module = module
+  compiled.defersubcon = subcon
+  return compiled
+
+
+def compile_cached(subcon, name, definitions=(), cache_dir=CACHE_DIR):
+  """Compiles a construct, reusing the generated code cached on disk.
+
+  The cache entry is keyed by a hash of the files defining the construct and
+  of the construct version. If the cache directory cannot be written, the
+  construct is returned uncompiled so that no code generation is paid for.
+
+  Args:
+    subcon: the construct to compile.
+    name: cache entry name.
+    definitions: paths of the source files the construct is defined in.
+    cache_dir: directory of the cache entries.
+
+  Returns:
+    A compiled construct, or `subcon` itself.
+  """
+  path = pathlib.Path(cache_dir) / (
+      f"{name}.{_definitions_key(name, definitions)}.construct"
+  )
+  try:
+    links, code = marshal.loads(path.read_bytes())
+    return _load(code, links, subcon)
+  except (OSError, ValueError, EOFError, TypeError, IndexError):
+    pass
+
+  try:
+    path.parent.mkdir(exist_ok=True)
+  except OSError:
+    return subcon
+  if not os.access(path.parent, os.W_OK):
+    return subcon
+
+  compiled = subcon.compile()
+  normalized = _normalize(compiled, subcon)
+  if normalized is None:
+    return compiled
+  source, links = normalized
+  code = compile(source, str(path), "exec")
+  tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+  try:
+    tmp.write_bytes(marshal.dumps((links, code)))
+    os.replace(tmp, path)
+  except OSError:
+    tmp.unlink(missing_ok=True)
+  return compiled
+
+
+class LazyCompiled:
+  """A construct compiled with compile_cached the first time it is used."""
+
+  def __init__(self, subcon, name, *definitions):
+    self._subcon = subcon
+    self._name = name
+    self._definitions = definitions
+    self._compiled = None
+    self._lock = threading.Lock()
+
+  @property
+  def compiled(self):
+    """The compiled (or, without a writable cache, interpreted) construct."""
+    if self._compiled is None:
+      with self._lock:
+        if self._compiled is None:
+          self._compiled = compile_cached(
+              self._subcon, self._name, self._definitions
+          )
+    return self._compiled
+
+  def parse(self, data, **contextkw):
+    return self.compiled.parse(data, **contextkw)
+
+  def parse_stream(self, stream, **contextkw):
+    return self.compiled.parse_stream(stream, **contextkw)
+
+  def build(self, obj, **contextkw):
+    return self.compiled.build(obj, **contextkw)
+
+  def sizeof(self, **contextkw):
+    return self._subcon.sizeof(**contextkw)
+
+  def __getattr__(self, name):
+    return getattr(self._subcon, name)